@@ -8,13 +8,10 @@ import os.path
 import sys
 from datetime import datetime
 from . import config
-from . import main_gui
-from . import excelwriter
-from . import excelreader
 from . import confighandler
-from . import dkan_api_test
+from . import logsetup
+from . import progress
 
-logging.basicConfig(level=logging.DEBUG, format='<%(asctime)s %(levelname)s> %(message)s')
 logging.getLogger("requests").setLevel(logging.WARNING)
 
 
@@ -34,12 +31,8 @@ except:
 
 
 log_file = os.path.normpath(config.x_log_dir + log_filename)
-log_handler = logging.FileHandler(log_file, mode='a')
-log_formatter = logging.Formatter('%(asctime)s %(levelname)s\t%(message)s', datefmt='%I:%M:%S')
-log_handler.setFormatter(log_formatter)
-log_handler.setLevel(logging.DEBUG)
-logger = logging.getLogger()
-logger.addHandler(log_handler)
+# console and log file are written by a background thread
+logsetup.setup(log_file)
 
 
 class DkanUploader:
@@ -50,31 +43,49 @@ class DkanUploader:
         logging.debug('Start of program')
 
         confighandler.read_config_file()
+        logsetup.set_module_levels(config.x_log_levels)
 
         args = DkanUploader.get_commandline_args()
 
         # copy command line arguments into config
         config.overwrite_rows = True if args.overwrite else False
+        if args.incremental:
+            config.incremental_export = True
         if args.ids:
             config.dataset_ids = args.ids
+        if args.workers:
+            config.upload_workers = args.workers
+        if args.resume:
+            config.resume_upload = True
 
+        if args.download or args.upload:
+            # the gui shows the progress in its progress bar, on the command line a status line is logged
+            progress.add_listener(progress.StatusLogger())
+
+        # every mode imports only the modules it needs (tkinter, xlsxwriter, jsonschema, pydkan, ...),
+        # so the command line starts fast, see benchmarks/startup.py
         if args.download:
             logging.info("== Running commandline mode: DOWNLOAD ==")
+            from . import excelwriter
             excelwriter.write(args.filename)
         elif args.upload:
             logging.info("== Running commandline mode: UPLOAD ==")
+            from . import excelreader
             excelreader.read(args.filename)
         elif args.testwrite:
             logging.info("== Running commandline mode: ANALYZE-API ==")
+            from . import dkan_api_test
             dkan_api_test.analyze()
         elif args.node_id:
             logging.info("== Running commandline mode: ANALYZE-NODE %s ==", args.node_id)
+            from . import dkan_api_test
             dkan_api_test.validate(args.node_id)
 
         else:
             print("")
             print("Starting in GUI mode. To print available command line options, start with --help.")
             print("")
+            from . import main_gui
             main_gui.show()
 
     @staticmethod
@@ -104,11 +115,17 @@ class DkanUploader:
         parser.add_argument('-d', '--download', action='store_true',
             help='Run in DOWNLOAD mode: The excel file will be overwritten! It will be filled with data from the DKAN instance')
         parser.add_argument('-or', '--overwrite', action='store_true', dest='overwrite',
-            help='If datasets already exist in the excel file, overwrite the row content. (Default: no)\n\n')
+            help='If datasets already exist in the excel file, overwrite the row content. (Default: no)')
+        parser.add_argument('-i', '--incremental', action='store_true', dest='incremental',
+            help='Only read datasets that are new or were modified in DKAN since the last download,\nkeep the rows of all other datasets. Datasets that were deleted in DKAN are removed.\n\n')
 
         # Command line arguments for UPLOAD
         parser.add_argument('-u', '--upload', action='store_true',
-            help='Run in UPLOAD mode: The DKAN content will be overwritten with data from the excel file\n\ndkan api debugging:')
+            help='Run in UPLOAD mode: The DKAN content will be overwritten with data from the excel file')
+        parser.add_argument('-w', '--workers', action='store', dest='workers', type=int, metavar='N',
+            help='Number of datasets that are uploaded at the same time, each with its own DKAN login. (Default: 1)')
+        parser.add_argument('-r', '--resume', action='store_true', dest='resume',
+            help='Continue an interrupted upload: skip the datasets that were already uploaded according to the\nupload journal (<excel file>.journal.jsonl), and reconcile the ones that were only partly uploaded.\n\ndkan api debugging:')
 
         parser.add_argument('-wt', '--write-test', action='store_true', dest='testwrite',
             help='Try to write a test-dataset to DKAN instance')
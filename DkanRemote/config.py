@@ -21,20 +21,86 @@ api_encoding = "utf-8"
 
 # command line options
 overwrite_rows = False
+incremental_export = False   # only write new or changed datasets, keep the other rows of the excel file
 dataset_ids = ""
 message_level = "Debug"
 force_resource_update = False
+upload_workers = 1  # number of datasets that are uploaded at the same time
+resume_upload = False   # continue an interrupted upload, see uploadjournal.py
+log_dataset_changes = False     # read every uploaded dataset again and log the changes (debug messages)
 
 # ------------------------------------------------------------------------
 # Internal settings, only change below here if you know what you are doing
 # ------------------------------------------------------------------------
 
 x_api_find_node_id = "/api/dataset/node.json?parameters[uuid]={}"
+x_api_node_index = "/api/dataset/node.json?parameters[type]={}&fields=nid,uuid&pagesize={}&page={}"
+x_node_index_types = ['dataset', 'resource']
+x_node_index_page_size = 500
+x_node_index_ttl = 3600     # seconds, then the index file in x_temp_dir is read again from DKAN
 x_api_get_node_details = "/api/dataset/node/{}.json?cachebuster={}"
+x_api_group_list = "/api/dataset/node.json?parameters[type]=group&fields=nid,type,title&pagesize={}&page={}"
+x_api_attach_file = "/api/dataset/node/{}/attach_file"
+
+# taxonomies, file formats and groups are read once and then used for this many seconds (see dkanhelpers.ReferenceData)
+x_reference_data_ttl = 3600
 
 x_download_extended_dataset_infos = True
+
+# number of packages whose details are fetched ahead, while the excel rows are written
+x_prefetch_packages = 8
+
+# number of resource nodes that are read from DKAN at the same time
+# (create, update and delete of the resources of one dataset are sent one after the other)
+x_resource_workers = 4
+
+# link checker: urls that are checked at the same time, in total and per host
+x_linkcheck_workers = 16
+x_linkcheck_host_connections = 2
+
+# results of url checks (see linkstatus.py), stored in x_temp_dir
+x_link_status_file = 'link_status.sqlite'
+x_link_status_ttl = 24 * 3600           # seconds, can be changed in section [http] of config.ini
+x_link_status_error_ttl = 10 * 60       # failed connections are checked again sooner
 x_temp_dir = 'temp/'
+
+# download of resource files (see resourcedownload.py), the manifest is stored in download_dir
+x_download_workers = 4
+x_download_chunk_size = 64 * 1024
+x_download_manifest = 'download_manifest.json'
+
+# resource files are uploaded in chunks of this size (see fileupload.py)
+x_upload_chunk_size = 1024 * 1024
+x_upload_manifest = 'upload_manifest.json'    # checksums of uploaded files, stored in download_dir
+x_journal_clock_skew = 5 * 60   # seconds the clock of the DKAN server may be behind, see DatasetUploader.findCreatedNode
+
+# cache for DKAN API responses (see responsecache.py), stored in x_temp_dir
+x_cache_file = 'responses.sqlite'
+x_cache_max_bytes = 500 * 1024 * 1024
+x_cache_ttl = 24 * 3600                 # seconds, default lifetime of cached responses
+x_cache_ttl_package_list = 10 * 60      # the package list changes with every dataset change
+x_cache_ttl_nodes = 5 * 60              # node and package details, they can be edited in the DKAN web interface (and have no ETag)
+
+# shared http transport (see transport.py), can be changed in section [http] of config.ini
+x_http_pool_hosts = 50          # number of hosts to keep a connection pool for
+x_http_pool_size = 10           # keep-alive connections per host
+x_http_connect_timeout = 10     # seconds
+x_http_read_timeout = 60        # seconds
+x_upload_read_timeout = 3600    # seconds, DKAN answers a file upload only after it has stored the whole file
+x_http_retries = 3
+x_http_backoff = 0.5            # wait 0.5s, 1s, 2s, .. between the retries
 x_log_dir = 'logs/'
+# raise the log level of single modules, e.g. {'constants': 'INFO'}, can be changed in section [log_levels] of config.ini
+x_log_levels = {}
+
+# log window of the gui: lines that are kept, and how often new log messages are written to it
+x_gui_log_max_lines = 5000
+x_gui_log_interval = 100        # milliseconds
+
+# progress of long running jobs (see progress.py): throughput is measured over the last x_progress_window seconds,
+# on the command line a status line is logged every x_progress_log_interval seconds
+x_progress_window = 30
+x_progress_log_interval = 10
 
 # these paths will be used to detect resource types "datastore" and "uploaded_file" in fast mode
 x_uploaded_resource_path = '/sites/default/files/'
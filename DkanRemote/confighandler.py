@@ -35,8 +35,11 @@ def read_config_file():
             config.check_resources = config_ini.getboolean('features', 'check_resources')
             config.detailed_resources = config_ini.getboolean('features', 'detailed_resources')
             config.resources_download = config_ini.getboolean('features', 'resources_download')
+            config.incremental_export = config_ini.getboolean('features', 'incremental_export', fallback=config.incremental_export)
             config.dataset_ids = config_ini['features']['dataset_ids']
             config.message_level = config_ini['features']['message_level']
+            config.upload_workers = config_ini.getint('features', 'upload_workers', fallback=config.upload_workers)
+            config.log_dataset_changes = config_ini.getboolean('features', 'log_dataset_changes', fallback=config.log_dataset_changes)
         except:
             logging.error("Beim Lesen der Config-Datei ist ein Fehler aufgetreten. Es wird mit der Standard-Config fortgefahren.")
 
@@ -52,6 +55,24 @@ def read_config_file():
         else:
             logging.warning('Config-Variable "api.resource_list" wurde nicht gefunden, nutze Defaultwert.')
 
+    if 'http' in config_ini:
+        try:
+            config.x_http_pool_hosts = config_ini.getint('http', 'pool_hosts', fallback=config.x_http_pool_hosts)
+            config.x_http_pool_size = config_ini.getint('http', 'pool_size', fallback=config.x_http_pool_size)
+            config.x_http_connect_timeout = config_ini.getfloat('http', 'connect_timeout', fallback=config.x_http_connect_timeout)
+            config.x_http_read_timeout = config_ini.getfloat('http', 'read_timeout', fallback=config.x_http_read_timeout)
+            config.x_upload_read_timeout = config_ini.getfloat('http', 'upload_read_timeout', fallback=config.x_upload_read_timeout)
+            config.x_http_retries = config_ini.getint('http', 'retries', fallback=config.x_http_retries)
+            config.x_http_backoff = config_ini.getfloat('http', 'backoff', fallback=config.x_http_backoff)
+            config.x_link_status_ttl = config_ini.getint('http', 'link_status_ttl', fallback=config.x_link_status_ttl)
+        except ValueError as err:
+            logging.error('Ungültiger Wert in Config-Abschnitt "http": %s', err)
+
+
+    if 'log_levels' in config_ini:
+        # configparser also returns the values of the DEFAULT section, only the own values are levels
+        config.x_log_levels = {name: level for name, level in config_ini['log_levels'].items() if name not in config_ini.defaults()}
+
 
 def write_config_file():
     """Write back values to config.ini
@@ -82,8 +103,10 @@ def write_config_file():
     config_ini.set('features', 'check_resources', 'Yes' if config.check_resources else 'No')
     config_ini.set('features', 'detailed_resources', 'Yes' if config.detailed_resources else 'No')
     config_ini.set('features', 'resources_download', 'Yes' if config.resources_download else 'No')
+    config_ini.set('features', 'incremental_export', 'Yes' if config.incremental_export else 'No')
     config_ini.set('features', 'dataset_ids', config.dataset_ids)
     config_ini.set('features', 'message_level', config.message_level)
+    config_ini.set('features', 'upload_workers', str(config.upload_workers))
 
     config_new = {s:dict(config_ini.items(s)) for s in config_ini.sections()}
 
@@ -2,7 +2,8 @@ from ftplib import all_errors
 import re
 import os.path
 import logging
-from geomet import wkt
+from collections import namedtuple
+from types import MappingProxyType
 from . import dkanhelpers
 from . import config
 
@@ -133,12 +134,10 @@ class Resource:
 
 
     def getFieldNameAndTaxonomyValue(self, valueName):
-        column_config = {**get_column_config_resource(), **get_column_config_resource_detailed()}
-        field_name_raw = column_config[valueName]
-        if field_name_raw[:7] != "TID_REF":
-            logging.error(_('Feld Name hätte "TID_REF" sein müssen: %s'), field_name_raw)
-        s_dummy, field_name, taxonomy_name = field_name_raw.split('|')
-        return field_name, self.getValue(valueName)
+        column = get_column_schema().resource_known[valueName]
+        if column.kind != ColumnKind.TID_REF:
+            logging.error(_('Feld Name hätte "TID_REF" sein müssen: %s'), column.key)
+        return column.field, self.getValue(valueName)
 
 
     @staticmethod
@@ -146,7 +145,8 @@ class Resource:
 
         # Check if row contains a dataset
         count_non_empty_dataset_fields = 0
-        for column in get_column_config_resource():
+        resource_columns = get_column_schema().resource
+        for column in resource_columns:
             if column in row and row[column]:
                 logging.debug(" [r] %s", column)
                 count_non_empty_dataset_fields += 1
@@ -172,7 +172,7 @@ class Resource:
         logging.log(
             # prevent showing too many uninteresting log messages if Datensatz-Beschränkung is set
             logging.DEBUG if config.x_dataset_ids_temp else logging.INFO,
-            _(" Resource-Felder: %s/%s ('%s')"), count_non_empty_dataset_fields, len(get_column_config_resource()), row[Resource.NAME]
+            _(" Resource-Felder: %s/%s ('%s')"), count_non_empty_dataset_fields, len(resource_columns), row[Resource.NAME]
             )
         return Resource(row)
 
@@ -181,6 +181,10 @@ class Resource:
         self._row[field] = value
 
 
+    def getRow(self):
+        return dict(self._row)
+
+
     def getRawValue(self, valueName, default=""):
         if (valueName == Resource.TYP) and (Resource.TYP not in self._row) and (Resource.TYP2 in self._row):
             return self._row[Resource.TYP2]
@@ -188,11 +192,10 @@ class Resource:
 
 
     def getValue(self, valueName, default=""):
-        known_columns = {**get_column_config_resource(True), **get_column_config_resource_detailed()}
-        column_key = known_columns[valueName]
+        column = get_column_schema().resource_known[valueName]
         value =""
-        if (column_key[:7] == "TID_REF"):
-            value = Dataset.getValueForTidRef(column_key, valueName, self.getRawValue(valueName))
+        if column.kind == ColumnKind.TID_REF:
+            value = Dataset.getValueForTidRef(column.key, valueName, self.getRawValue(valueName))
         else:
             value = self.getRawValue(valueName)
         return value if value else default
@@ -210,8 +213,8 @@ class Resource:
         members = [getattr(Resource, attr) for attr in dir(Resource) if not callable(getattr(Resource, attr)) and not attr.startswith("_")]
         logging.debug("members %s", members)
 
-        known_columns = {**get_column_config_resource(True), **get_column_config_resource_detailed()}
-        logging.debug("known_columns %s", known_columns)
+        known_columns = get_column_schema().resource_known
+        logging.debug("known_columns %s", list(known_columns))
         for member in members:
             if not member in known_columns:
                 raise AbortProgramError(_('Programmfehler: Resource-Objekt nutzt eine Spalte "{}" die es garnicht gibt.').format(member))
@@ -287,7 +290,8 @@ class Dataset:
 
         # Check if row contains a dataset
         count_non_empty_dataset_fields = 0
-        for column in get_column_config_dataset():
+        dataset_columns = get_column_schema().dataset
+        for column in dataset_columns:
             if column in row and row[column]:
                 logging.debug(" [x] %s", column)
                 count_non_empty_dataset_fields += 1
@@ -343,6 +347,7 @@ class Dataset:
 
         # Validate spatial
         if Dataset.GEO_AREA in row:
+            from geomet import wkt     # not imported at startup, see app.py
             try:
                 ls_json = wkt.loads(row[Dataset.GEO_AREA])
                 logging.debug(_("Geo-Daten: %s"), ls_json)
@@ -357,7 +362,7 @@ class Dataset:
             logging.DEBUG if config.x_dataset_ids_temp else logging.INFO,
             _(" Datensatz-Felder: %s/%s ('%s')"),
             count_non_empty_dataset_fields,
-            len(get_column_config_dataset()),
+            len(dataset_columns),
             new_object.getValue(Dataset.TITLE)
             )
 
@@ -368,7 +373,7 @@ class Dataset:
     def verify():
         ''' Internal test: check if our Dataset class definition is correct '''
         members = [getattr(Dataset, attr) for attr in dir(Dataset) if not callable(getattr(Dataset, attr)) and not attr.startswith("_")]
-        known_columns = get_column_config_dataset()
+        known_columns = get_column_schema().dataset
         for member in members:
             if not member in known_columns:
                 raise AbortProgramError(_('Programmierfehler: Dataset-Objekt nutzt eine Spalte "{}" die es garnicht gibt.').format(member))
@@ -394,32 +399,31 @@ class Dataset:
             has_error = True
             logging.error(_('Problem bei "%s". Wert wurde nicht erkannt: %s'), valueName, tags)
 
-        all_tags_in_dkan = dkanhelpers.HttpHelper.get_taxonomy_values(s_taxonomy_name)
-
         # TODOs we completely ignore ids_in_dataset .. do we need that at all?
         has_error = False
         value = []
-        for tag_name in tags_in_dataset:
-            found = ''
-            for tkey, tval in all_tags_in_dkan.items():
-                if tval.lower() == tag_name.lower():
-                    found = tkey
-                    logging.debug("%s gefunden: %s '%s'", valueName, tkey, tag_name)
+        term_ids = dkanhelpers.ReferenceData.find_term_ids(s_taxonomy_name, tags_in_dataset)
+        for tag_name, found in zip(tags_in_dataset, term_ids):
             if not found:
                 logging.error("'%s' unbekannt: '%s' wird verworfen", valueName, tag_name)
                 has_error = True
             else:
+                logging.debug("%s gefunden: %s '%s'", valueName, found, tag_name)
                 value.append(found)
         if has_error:
             logging.error(_('Problem bei "%s". Mögliche Lösung:'), valueName)
             logging.error(_('a) Bitte schreiben Sie %s immer in Anführungszeichen, z.B.: "Statistik", "API"'), valueName)
             logging.error(_('b) Sie können nur %s verwenden, die im DKAN Administrationsbereich angelegt wurden.'), valueName)
             logging.error(_('Mögliche Werte für "%s" sind:'), valueName)
-            logging.error(_('%s'), all_tags_in_dkan.values())
+            logging.error(_('%s'), dkanhelpers.HttpHelper.get_taxonomy_values(s_taxonomy_name).values())
         logging.debug("Gefunden -%s-: %s", s_node_field, value)
         return value
 
 
+    def getRow(self):
+        return dict(self._row)
+
+
     def getRawValue(self, valueName, default=""):
 
         value = None
@@ -438,18 +442,17 @@ class Dataset:
 
     def getValue(self, valueName, default=""):
 
-        known_columns = get_column_config_dataset()
-        column_key = known_columns[valueName]
+        column = get_column_schema().dataset[valueName]
 
-        if (column_key[:7] == "TID_REF"):
-            value = Dataset.getValueForTidRef(column_key, valueName, self.getRawValue(valueName))
+        if column.kind == ColumnKind.TID_REF:
+            value = Dataset.getValueForTidRef(column.key, valueName, self.getRawValue(valueName))
 
         elif valueName == Dataset.GROUPS:
             tags = self.getRawValue(valueName)
             value = re.findall(r'"([^"]*)"\s+\((\d+)\)', tags)
             logging.debug(_("Gefundene Gruppen: %s"), value)
 
-        elif column_key[:7] == "RELATED":
+        elif column.kind == ColumnKind.RELATED:
             tags = self.getRawValue(valueName)
             value = re.findall(r'"([^"]*)"\s+\(([^"]*)\)', tags)
             logging.debug(_("Einträge '%s' gefunden: %s"), valueName, value)
@@ -461,19 +464,15 @@ class Dataset:
 
 
     def getFieldNameAndTaxonomyValue(self, valueName):
-        column_config = get_column_config_dataset()
-        field_name_raw = column_config[valueName]
-        if field_name_raw[:7] != "TID_REF":
-            logging.error(_('Feld Name hätte "TID_REF" sein müssen: %s'), field_name_raw)
-        s_dummy, field_name, taxonomy_name = field_name_raw.split('|')
-        return field_name, self.getValue(valueName)
+        column = get_column_schema().dataset[valueName]
+        if column.kind != ColumnKind.TID_REF:
+            logging.error(_('Feld Name hätte "TID_REF" sein müssen: %s'), column.key)
+        return column.field, self.getValue(valueName)
 
 
     def getTitleUrlAttributes(self, valueName):
         relatedcontent = self.getValue(valueName)
-        column_config = get_column_config_dataset()
-        field_name_raw = column_config[valueName]
-        field_name = field_name_raw[8:]
+        field_name = get_column_schema().dataset[valueName].field
         logging.debug(_("gTUA '%s' gefunden: %s"), valueName, field_name)
 
         related_list = []
@@ -667,6 +666,90 @@ def get_column_config_resource(get_all=False):
     return columns
 
 
+class ColumnKind:
+    """ How the value of a column is stored in DKAN, see get_column_config_dataset() """
+    PLAIN = 'plain'         # key in current_package_list_with_resources, e.g. "title"
+    PATH = 'path'           # path in the dkan node json, e.g. ["body", "und", 0, "format"]
+    TID_REF = 'tid_ref'     # taxonomy terms, "TID_REF|$node_json_field_name|$taxonomy_name"
+    RELATED = 'related'     # title/url entries, "RELATED|$node_json_field_name"
+    COLLECT = 'collect'     # groups, "COLLECT|groups.title"
+    EXTRA = 'extra'         # additional info fields (only in the excel writer), "EXTRA|$key"
+    SPECIAL = 'special'     # computed by the excel writer, e.g. "RTYPE", "RPATH"
+
+
+# A compiled column of the column config.
+# field is the node json field (TID_REF, RELATED, EXTRA), taxonomy the name of the taxonomy (TID_REF),
+# accessor reads the raw value from the DKAN data: package data for PLAIN, COLLECT and EXTRA, otherwise the node json
+Column = namedtuple('Column', ['name', 'key', 'kind', 'field', 'taxonomy', 'accessor'])
+
+
+def compile_column(name, key):
+    if isinstance(key, list):
+        path = list(key)
+        return Column(name, key, ColumnKind.PATH, None, None, lambda node: dkanhelpers.JsonHelper.get_nested_json_value(node, path))
+
+    parts = key.split('|')
+    if parts[0] == 'TID_REF':
+        field = parts[1]
+        return Column(name, key, ColumnKind.TID_REF, field, parts[2], lambda node: _get_und_values(node, field))
+    if parts[0] == 'RELATED':
+        field = parts[1]
+        return Column(name, key, ColumnKind.RELATED, field, None, lambda node: _get_und_values(node, field))
+    if parts[0] == 'COLLECT':
+        return Column(name, key, ColumnKind.COLLECT, parts[1], None, lambda package_data: package_data.get('groups', []))
+    if parts[0] == 'EXTRA':
+        field = parts[1]
+        return Column(name, key, ColumnKind.EXTRA, field, None, lambda package_data: _get_extra_value(package_data, field))
+    if key.isupper():
+        return Column(name, key, ColumnKind.SPECIAL, None, None, None)
+    return Column(name, key, ColumnKind.PLAIN, None, None, lambda package_data: package_data.get(key))
+
+
+def _get_und_values(node, field):
+    values = node.get(field) if isinstance(node, dict) else None
+    values = values.get('und') if isinstance(values, dict) else None
+    return values if isinstance(values, list) else []
+
+
+def _get_extra_value(package_data, extra_key):
+    extra_obj = [x for x in package_data.get("extras", []) if x["key"] == extra_key]
+    return extra_obj[0]["value"] if extra_obj else None
+
+
+def compile_columns(columns_config):
+    """ Read-only mapping column name => Column, in the order of the column config """
+    return MappingProxyType({name: compile_column(name, key) for name, key in columns_config.items()})
+
+
+class ColumnSchema:
+    """ The column config, compiled once into read-only mappings column name => Column
+
+        dataset             dataset columns
+        resource            resource columns in the excel file (depends on config.detailed_resources)
+        resource_detailed   detailed resource columns
+        resource_known      all resource columns that can be read from the excel file
+    """
+
+    def __init__(self, detailed_resources):
+        self.detailed_resources = detailed_resources
+        self.dataset = compile_columns(get_column_config_dataset())
+        resource_all = get_column_config_resource(True)
+        self.resource = compile_columns(
+            {name: key for name, key in resource_all.items() if not (detailed_resources and name == Resource.TYP)})
+        self.resource_detailed = compile_columns(get_column_config_resource_detailed())
+        self.resource_known = compile_columns({**resource_all, **get_column_config_resource_detailed()})
+
+
+_column_schemas = {}
+
+def get_column_schema():
+    """ Compiled column config for the current settings """
+    schema = _column_schemas.get(config.detailed_resources)
+    if schema is None:
+        schema = _column_schemas[config.detailed_resources] = ColumnSchema(config.detailed_resources)
+    return schema
+
+
 # JSON Schema of the dataset entries in endpoint "current_package_list_with_resources"
 datasetSchema = {
     "type": "object",
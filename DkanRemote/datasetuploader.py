@@ -1,12 +1,11 @@
 
 import re
-import json
 import logging
-import requests
-from jsondiff import diff
 from . import dkanhandler
 from . import dkanhelpers
 from . import config
+from . import transport
+from . import uploadjournal
 from .constants import Dataset
 
 class DatasetUploader:
@@ -38,6 +37,15 @@ class DatasetUploader:
 
 
     def processDataset(self, dataset, resources):
+        if not self.claimDataset(dataset):
+            return None
+
+        return self.uploadDataset(dataset, resources)
+
+
+    def claimDataset(self, dataset):
+        """Check limit and dataset query for the dataset and count it, if it will be uploaded.
+        This has to be called in row order, also when the uploads themselves run concurrently."""
 
         if not dataset:
             raise Exception(_("Fehler: Kein Datensatz zum Erstellen in datasetuploader.processDataset()"))
@@ -47,51 +55,132 @@ class DatasetUploader:
 
         if self.dataset_count >= self.limit:
             logging.info(_("Datensatz wird übersprungen. Limit von %s erreicht."), self.limit)
-            return None
+            return False
 
         logging.info(_("Bearbeite Datensatz: '%s'"), dataset)
-        logging.debug(_("Resourcen: %s"), resources)
 
+        if (dataset.getValue(Dataset.NODE_ID) or dataset.getValue(Dataset.DATASET_ID)) and not self.isSelected(dataset):
+            return False
+
+        self.dataset_count += 1
+        return True
+
+
+    def uploadDataset(self, dataset, resources):
+        """Create or update the dataset and its resources in DKAN, and record it in the upload journal"""
+
+        journal = uploadjournal.get_journal()
+        if not journal:
+            return self.sendDataset(dataset, resources)
+
+        key = journal.get_dataset_key(dataset, resources)
+        previous = journal.get_previous(key)
+        if previous and previous['state'] == uploadjournal.DONE:
+            logging.info(_(" '-> [laut Journal bereits hochgeladen] %s"), previous['nid'])
+            return previous['nid']
+        if previous:
+            self.reconcileDataset(dataset, previous)
+
+        journal.record('dataset', key, uploadjournal.PLANNED, row=str(dataset))
+        node_id = self.sendDataset(dataset, resources, key)
+        journal.record('dataset', key, uploadjournal.DONE, nid=node_id)
+        return node_id
+
+
+    def reconcileDataset(self, dataset, previous):
+        """The interrupted upload stopped while the dataset was sent: continue with the node that it created.
+        The resources are not taken from the journal, they are compared with the fresh node like in every update."""
+
+        logging.info(_(" '-> [Upload wurde unterbrochen, Stand laut Journal: %s]"), previous['state'])
         node_id = dataset.getValue(Dataset.NODE_ID)
+        if not node_id and not dataset.getValue(Dataset.DATASET_ID):
+            node_id = previous['nid']
+            if not node_id and previous['state'] in (uploadjournal.SENT, uploadjournal.FAILED):
+                # DKAN maybe created the node, but the answer got lost (or timed out)
+                node_id = self.findCreatedNode(dataset.getValue(Dataset.TITLE), previous)
+            if node_id:
+                logging.info(_("  Datensatz wurde bereits erstellt: %s"), node_id)
+                dataset.set(Dataset.NODE_ID, node_id)
+
+        # the cached node does not know about the changes of the interrupted upload
         if node_id:
-            # update existing dataset by node_id
-            node_id = self.updateDataset(dataset)
+            dkanhelpers.HttpHelper.invalidate_dkan_node(node_id)
 
-        elif dataset.getValue(Dataset.DATASET_ID):
-            # update by package_id
-            package_id = dataset.getValue(Dataset.DATASET_ID)
-            if not node_id:
-                remote_url = config.x_api_find_node_id.format(package_id)
-                r = requests.get(remote_url)
-                node_search = json.load(r.text)
 
-                if node_search[0]['nid']:
-                    node_id = node_search[0]['nid']
-                    dataset.set(Dataset.NODE_ID, node_id)
+    def findCreatedNode(self, title, previous):
+        """Node id of the dataset that the interrupted create made, or None if it can not be identified.
+        Titles are not unique, so the node is only used if it is the only one with the title
+        and it was created after the request was sent."""
+
+        nodes = dkanhandler.findAll(title)
+        if not nodes:
+            return None
+
+        sent_at = uploadjournal.get_sent_time(previous)
+        try:
+            created = int(nodes[0].get('created'))
+        except (TypeError, ValueError):
+            created = None
+        if len(nodes) == 1 and sent_at is not None and created is not None and created >= sent_at - config.x_journal_clock_skew:
+            return nodes[0]['nid']
+
+        logging.warning(_("  %s Datensätze mit dem Titel '%s' gefunden, keiner wurde sicher vom abgebrochenen Upload erstellt. "
+            "Der Datensatz wird neu erstellt."), len(nodes), title)
+        return None
+
+
+    def sendDataset(self, dataset, resources, journal_key=None):
+        """Create or update the dataset and its resources in DKAN"""
+
+        logging.debug(_("Resourcen: %s"), resources)
+        journal = uploadjournal.get_journal() if journal_key else None
 
-                node_id = self.updateDataset(dataset)
+        raw_dataset = None
+        node_id = dataset.getValue(Dataset.NODE_ID)
+        if not node_id and dataset.getValue(Dataset.DATASET_ID):
+            # update by package_id
+            package_id = dataset.getValue(Dataset.DATASET_ID)
+            node_id = self.findNodeId(package_id)
+            if node_id:
+                dataset.set(Dataset.NODE_ID, node_id)
             else:
                 logging.error(_("Datensatz mit der Package-ID '%s' wurde nicht gefunden"), package_id)
+                raise Exception(_("Fehler beim Erstellen oder beim Update des Datensatzes"))
+
+        if node_id:
+            # update existing dataset, but only if something has changed.
+            # The node is read without cache: it may have been edited in DKAN, and its resource list decides
+            # which resources are created, a cached list could create them again.
+            old_dataset = dkanhandler.getDatasetDetails(node_id)
+            dkan_data = dkanhandler.getDkanData(dataset)
+            if dkanhandler.datasetHasChanged(dkan_data, old_dataset):
+                if journal:
+                    node_id = journal.run_operation('dataset', journal_key, self.updateDataset, dataset)
+                else:
+                    node_id = self.updateDataset(dataset)
+                if node_id:
+                    # the update does not touch the resources, so the old node with the sent values is up to date
+                    raw_dataset = dict(old_dataset, **dkan_data)
+                    self.logDatasetChanges(old_dataset, node_id)
+            else:
+                logging.info(_(" '-> [Datensatz nicht geändert]"))
+                raw_dataset = old_dataset
 
         else:
             # create new dataset
-            self.dataset_count += 1
-            node_id = dkanhandler.create(dataset)
+            if journal:
+                node_id = journal.run_operation('dataset', journal_key, dkanhandler.create, dataset)
+            else:
+                node_id = dkanhandler.create(dataset)
             logging.debug(_("NEUE Dataset-ID: %s"), node_id)
+            if node_id:
+                # a new dataset has no resources yet, the sent values are all that is needed
+                raw_dataset = dict(dkanhandler.getDkanData(dataset), nid=node_id)
+                self.logDatasetChanges({}, node_id)
 
         if not node_id:
             raise Exception(_("Fehler beim Erstellen oder beim Update des Datensatzes"))
 
-        elif node_id == '-':
-            return None
-
-        raw_dataset = dkanhandler.getDatasetDetails(node_id)
-
-        # Summary with changes
-        raw_dataset2 = dkanhelpers.HttpHelper.read_dkan_node(node_id)
-        logging.debug(_(" == Datensatz-Änderung: == "))
-        logging.debug(diff(raw_dataset, raw_dataset2))
-
         # add or update resources
         if not self._ignore_resources:
             self.processResources(raw_dataset, resources)
@@ -99,7 +188,20 @@ class DatasetUploader:
         return node_id
 
 
-    def updateDataset(self, dataset):
+    def logDatasetChanges(self, old_dataset, node_id):
+        """Verify the upload by reading the node again. This costs a request per dataset,
+        so it is only done if log_dataset_changes is set in config.ini and debug messages are logged."""
+        if not (config.log_dataset_changes and logging.getLogger().isEnabledFor(logging.DEBUG)):
+            return
+
+        from jsondiff import diff     # not imported at startup, see app.py
+        raw_dataset = dkanhandler.getDatasetDetails(node_id)
+        logging.debug(_(" == Datensatz-Änderung: == "))
+        logging.debug(diff(old_dataset, raw_dataset))
+
+
+    def isSelected(self, dataset):
+        """Check if the (existing) dataset matches the dataset query ("Datensatz-Beschränkung")"""
         package_id = dataset.getValue(Dataset.DATASET_ID)
         node_id = dataset.getValue(Dataset.NODE_ID)
 
@@ -108,16 +210,28 @@ class DatasetUploader:
 
         if dataset_query and (dataset_query.find(package_id) == -1):
             logging.warning(_("Wird übersprungen wegen Datensatz-Beschränkung: '%s' nicht in '%s'"), package_id, dataset_query)
-            return '-'
+            return False
 
-        elif dataset_query:
+        if dataset_query:
             logging.info(_("Datensatz-Beschränkung passt: %s(%s) ist in '%s'"), package_id, node_id, dataset_query)
-            self.dataset_count += 1
-            return dkanhandler.update(dataset)
+        return True
 
-        else:
-            self.dataset_count += 1
-            return dkanhandler.update(dataset)
+
+    def findNodeId(self, package_id):
+        node_id = dkanhelpers.NodeIdIndex.get_node_id(package_id)
+        if node_id:
+            return node_id
+
+        remote_url = config.dkan_url + config.x_api_find_node_id.format(package_id)
+        node_search = transport.get(remote_url).json()
+        if node_search and node_search[0]['nid']:
+            dkanhelpers.NodeIdIndex.add(package_id, node_search[0]['nid'])
+            return node_search[0]['nid']
+        return None
+
+
+    def updateDataset(self, dataset):
+        return dkanhandler.update(dataset)
 
 
     def deleteDataset(self, node_id):
@@ -137,5 +251,4 @@ class DatasetUploader:
                 )
         else:
             # Create all resources
-            for resource in resources:
-                dkanhandler.createResource(resource, raw_dataset['nid'], raw_dataset['title'])
+            dkanhandler.createResources(resources, raw_dataset['nid'], raw_dataset['title'])
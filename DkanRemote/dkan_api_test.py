@@ -6,7 +6,6 @@ import json
 from .datasetuploader import DatasetUploader
 from . import config
 from . import constants
-from . import excelwriter
 from . import dkanhelpers
 
 def test():
@@ -120,6 +119,7 @@ class DkanApiTest:
         with open(os.path.normpath('DkanRemote/example_row.json')) as json_file:
             row = json.load(json_file)
 
+        from . import excelwriter     # xlsxwriter and jsonschema are only needed here
         error_fields = excelwriter.validate_single_dataset_row(row, node_id)
         if error_fields:
             logging.error(_("Fehler #5005: Datensatz konnte nicht 1:1 angelegt werden."))
@@ -3,15 +3,29 @@ import re
 from typing import List
 import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dkan.client import DatasetAPI, LoginError
 from .constants import Dataset, Resource, ResourceType, AbortProgramError
 from . import dkanhelpers
+from . import fileupload
+from . import uploadjournal
+from . import transport
 from . import config
 
 # pylint: disable=global-statement
 
 api = None
 
+# sessions of worker threads that need their own DKAN login (see use_own_session)
+_thread_local = threading.local()
+# increased by disconnect(), logins of worker threads from before are not used anymore
+_session_generation = 0
+
+# worker threads for concurrent resource requests (see getResourcePool)
+_resource_pool = None
+_resource_pool_lock = threading.Lock()
+
 def expand_into(varname, id_list):
     result = []
     for single_id in id_list:
@@ -53,8 +67,8 @@ def getDkanData(dataset: Dataset):
         group_ids = dataset.getValue(Dataset.GROUPS)
         groups = []
         for group_name, group_id in group_ids:
-            group_data = dkanhelpers.HttpHelper.read_dkan_node(group_id)
-            if not (("type" in group_data) and (group_data['type'] == "group")):
+            group_data = dkanhelpers.ReferenceData.get_group(group_id)
+            if not (group_data and (group_data['type'] == "group")):
                 logging.error(_("Datensatz kann nicht angelegt werden, weil die Gruppe nicht gefunden wurde: %s ('%s')"), group_id, group_name)
                 logging.warning(_("Bitte legen Sie die Gruppe '%s' in ihrem DKAN an."),  group_name)
                 raise RuntimeError("Unknown group " + group_id + " " + group_name)
@@ -170,25 +184,64 @@ def getDkanData(dataset: Dataset):
 
 
 def disconnect():
-    global api
+    global api, _session_generation
     api = None
+    # the pool is kept, other threads may still submit to it,
+    # but its workers are still logged in with the old settings and have to log in again
+    _session_generation += 1
+    # the pooled connections were opened with the old settings (timeouts, pool size, retries)
+    transport.reset()
+
+
+def getResourcePool():
+    """Shared pool for resource requests, it limits how many of them are sent at once.
+    Each worker thread keeps its own DKAN login for all datasets."""
+    global _resource_pool
+    with _resource_pool_lock:
+        if not _resource_pool:
+            _resource_pool = ThreadPoolExecutor(
+                max_workers=config.x_resource_workers,
+                initializer=use_own_session,
+                thread_name_prefix='dkan-resources')
+        return _resource_pool
+
+
+def use_own_session():
+    """Let the calling thread log in with its own DKAN session instead of the shared one.
+    Used as initializer for worker threads, because the pydkan client is not thread safe."""
+    _thread_local.own_session = True
+    _thread_local.api = None
+    _thread_local.generation = _session_generation
+
+
+def currentApi():
+    if getattr(_thread_local, 'own_session', False):
+        if _thread_local.generation != _session_generation:
+            return None
+        return _thread_local.api
+    return api
 
 
 def getApi():
-    if not api:
+    if not currentApi():
         connect()
-    return api
+    return currentApi()
 
 
 def connect():
     global api
-    if api:
+    if currentApi():
         return ""
 
     try:
         logging.debug(_("DKAN-Login: %s @ %s"), config.dkan_username, config.dkan_url)
         # Last parameter is debug mode: True = Debugging ON
-        api = DatasetAPI(config.dkan_url, config.dkan_username, config.dkan_password, True)
+        session = DatasetAPI(config.dkan_url, config.dkan_username, config.dkan_password, True)
+        if getattr(_thread_local, 'own_session', False):
+            _thread_local.api = session
+            _thread_local.generation = _session_generation
+        else:
+            api = session
         return ""
     except LoginError as err:
         logging.error(_("Fehler bei Verbindung zur DKAN-Instanz!"))
@@ -200,7 +253,7 @@ def connect():
 def create(data: Dataset):
     connect()
     logging.info(_("Erstelle DKAN-Datensatz: %s"), data)
-    res = api.node('create', data=getDkanData(data))
+    res = getApi().node('create', data=getDkanData(data))
     logging.debug("result %s", res.text)
     json_response = res.json()
     if not 'nid' in json_response:
@@ -218,11 +271,12 @@ def create(data: Dataset):
 def update(dataset: Dataset):
     connect()
     logging.info(_("Datensatz-Update: %s"), dataset)
-    response = api.node(
+    response = getApi().node(
         'update',
         node_id=dataset.getValue(Dataset.NODE_ID),
         data=getDkanData(dataset)
     )
+    dkanhelpers.HttpHelper.invalidate_dkan_node(dataset.getValue(Dataset.NODE_ID))
     if response.status_code != 200:
         logging.error(_("Fehler beim Datensatz-Update %s %s"), response, response.content)
         return None
@@ -234,29 +288,70 @@ def update(dataset: Dataset):
 def remove(nodeId):
     connect()
     logging.debug(_('Lösche Datensatz %s'), nodeId)
-    response = api.node('delete', node_id=nodeId)
+    response = getApi().node('delete', node_id=nodeId)
+    dkanhelpers.HttpHelper.invalidate_dkan_node(nodeId)
     logging.debug(_("Lösch-Ergebnis: %s"), response.json())
 
 
 def find(title):
+    results = findAll(title)
+    return results[0] if results else 0
+
+
+def findAll(title):
+    """All dataset nodes with the title (titles are not unique)"""
     connect()
     params = {
         'parameters[type]': 'dataset',
         'parameters[title]': title
     }
-    results = api.node(params=params).json()
-    return results[0] if results else 0
+    return getApi().node(params=params).json()
 
 
 def getDatasetDetails(nid):
     connect()
-    r = api.node('retrieve', node_id=nid)
+    r = getApi().node('retrieve', node_id=nid)
     if r.status_code == 404:
         raise Exception('Did not find existing dkan node:', nid)
 
     return r.json()
 
 
+def getCachedNodeDetails(nid):
+    """Like getDatasetDetails, but use the response cache. Nodes that are not visible
+    without login (e.g. unpublished ones) are read with the DKAN session."""
+    node = dkanhelpers.HttpHelper.read_dkan_node(nid)
+    if isinstance(node, dict) and 'nid' in node:
+        return node
+    return getDatasetDetails(nid)
+
+
+def datasetHasChanged(newData, oldData):
+    """Compare the payload of getDkanData with the current dataset node.
+    Only the values that would be sent are compared, so additional keys of the node (e.g. safe_value) are ignored."""
+    for field, newValue in newData.items():
+        if not _valueIsTheSame(newValue, oldData.get(field)):
+            logging.debug(" -> Feld '%s' hat sich geändert", field)
+            return True
+    return False
+
+
+def _valueIsTheSame(newValue, oldValue):
+    if isinstance(newValue, dict):
+        return isinstance(oldValue, dict) and all(
+            _valueIsTheSame(value, oldValue.get(key)) for key, value in newValue.items() if not key.startswith('_'))
+    if isinstance(newValue, list):
+        return isinstance(oldValue, list) and len(newValue) == len(oldValue) and all(
+            _valueIsTheSame(newItem, oldItem) for newItem, oldItem in zip(newValue, oldValue))
+    return _normalizeValue(newValue) == _normalizeValue(oldValue)
+
+
+def _normalizeValue(value):
+    if value is None:
+        return ""
+    return str(value).replace("\r\n", "\n").replace("_x000D_", "").strip()
+
+
 def getResourceDkanData(resource, nid, title, existingDataNode):
     """Return dkan node json data structure for RESOURCES"""
 
@@ -350,24 +445,34 @@ def getResourceDkanData(resource, nid, title, existingDataNode):
 
 def createResource(resource: Resource, nid, title):
     data = getResourceDkanData(resource, nid, title, None)
-    createResourceFromData(data)
+    return createResourceFromData(data)
 
 
 def createResourceFromData(data):
     connect()
     logging.info(_(" -> [wird erstellt] %s"), data['title'])
-    r = api.node('create', data=data)
+    r = getApi().node('create', data=data)
     if r.status_code != 200:
         raise Exception('Error during create resource:', r, r.text)
     resourceResponse = r.json()
     newResourceNodeId = resourceResponse['nid']
     logging.debug(_('  Neue Resource wurde erstellt: %s'), newResourceNodeId)
+    invalidateParentDataset(data)
     handleFileUpload(data, newResourceNodeId)
+    return newResourceNodeId
+
+
+def invalidateParentDataset(resourceData):
+    """The resource list of the dataset node changed with the resource"""
+    parentId = dkanhelpers.JsonHelper.get_nested_json_value(resourceData, ['field_dataset_ref', 'und', 0, 'target_id'])
+    if parentId:
+        dkanhelpers.HttpHelper.invalidate_dkan_node(parentId)
 
 
 def updateResource(data, oldData):
     connect()
     nodeId = oldData['nid']
+    dkanhelpers.HttpHelper.invalidate_dkan_node(nodeId)
     logging.info(_(" '-> [aktualisiere] %s %s"), nodeId, data['title'])
     if 'x_upload_file' in data:
         if None:
@@ -391,34 +496,52 @@ def updateResource(data, oldData):
                 logging.debug("newBody: %s", body1)
                 logging.debug("oldBody: %s", body2)
 
-                response = api.node('delete', node_id=nodeId)
+                response = getApi().node('delete', node_id=nodeId)
                 if response.status_code != 200:
                     logging.error(_("Fehler: %s - %s"), response, response.content)
                     raise Exception('Error during resource update:', response, response.text)
 
                 createResourceFromData(data)
             else:
-                handleFileUpload(data, nodeId)
+                handleFileUpload(data, nodeId, oldData)
 
-        handleFileUpload(data, nodeId)
+        handleFileUpload(data, nodeId, oldData)
 
     else:
-        r = api.node('update', node_id=nodeId, data=data)
+        r = getApi().node('update', node_id=nodeId, data=data)
         logging.debug("  update: result %s", r)
         if r.status_code != 200:
             logging.error(_("FEHLER %s %s"), r, r.content)
             raise Exception('Error during resource update:', r, r.text)
 
 
-def handleFileUpload(data, nodeId):
+def handleFileUpload(data, nodeId, oldData=None):
     connect()
 
     if "x_upload_file" in data:
         filename = data["x_upload_file"]
+        manifest = fileupload.get_upload_manifest()
+        # compare the content with the last upload to this node, also if force_resource_update is set
+        remoteSize = dkanhelpers.JsonHelper.get_nested_json_value(oldData, ['field_upload', 'und', 0, 'filesize']) if oldData else None
+        if oldData and manifest.is_uploaded(nodeId, filename, remoteSize):
+            logging.info(_("  Datei unverändert, kein Upload zu Resource %s: %s"), nodeId, filename)
+            return
+
         logging.info(_("  Datei-Upload zu Resource %s: %s"), nodeId, filename)
         logging.debug(_("  Node Daten: %s"), data)
-        aResponse = api.attach_file_to_node(filename, nodeId, 'field_upload')
+        # the file is streamed, so large files do not have to fit into memory
+        aResponse = fileupload.attach_file_to_node(getApi(), filename, nodeId, 'field_upload')
+        dkanhelpers.HttpHelper.invalidate_dkan_node(nodeId)
         logging.debug(_("  Ergebnis: %s - %s"), aResponse.status_code, aResponse.text)
+        if aResponse.status_code == 200:
+            manifest.record(nodeId, filename)
+
+
+def deleteResource(oldData):
+    op = getApi().node('delete', node_id=oldData['nid'])
+    dkanhelpers.HttpHelper.invalidate_dkan_node(oldData['nid'])
+    invalidateParentDataset(oldData)
+    logging.debug(_("Ergebnis: Status=%s, Text=%s"), op.status_code, op.text)
 
 
 def updateResources(newResources:List[Resource], existingResourceIds, dataset):
@@ -426,11 +549,19 @@ def updateResources(newResources:List[Resource], existingResourceIds, dataset):
 
     logging.info(_("Prüfe bestehende Resourcen: (forceUpdate=%s)"), config.force_resource_update)
 
-    for existingResourceId in existingResourceIds:
+    # fetch all existing resource nodes at once
+    pool = getResourcePool()
+    with dkanhelpers.OrderedLogBuffer() as log_buffer:
+        oldResources = log_buffer.wait_in_order([
+            log_buffer.submit(pool, getCachedNodeDetails, existingResourceId['target_id'])
+            for existingResourceId in existingResourceIds
+        ])
+
+    # compare them with the new resources, and collect the changes that have to be sent
+    operations = []
+    for existingResourceId, oldData in zip(existingResourceIds, oldResources):
         logging.info(_(" Checke Resource-ID %s:"), existingResourceId['target_id'])
 
-        oldData = getDatasetDetails(existingResourceId['target_id'])
-
         logging.debug("%s", [x.getUniqueId() for x in newResources])
 
         # check if the existing resource url also is in the new resource urls
@@ -487,16 +618,47 @@ def updateResources(newResources:List[Resource], existingResourceIds, dataset):
 
             if hasChanged:
                 logging.warn(_("  ..hat sich geändert."))
-                updateResource(newData, oldData)
+                operations.append((updateResource, newData, oldData))
             else:
                 logging.info(_(" '-> [nicht geändert]"))
 
         else:
             # This seems to be an old url that we dont want anymore => delete it
             logging.info(_("  '-> [löschen] %s"), oldData)
-            op = api.node('delete', node_id=oldData['target_id'])
-            logging.debug(_("Ergebnis: Status=%s, Text=%s"), op.status_code, op.text)
+            operations.append((deleteResource, oldData))
 
     # Create new resources
     for resource in newResources:
-        createResource(resource, dataset['nid'], dataset['title'])
+        operations.append((createResource, resource, dataset['nid'], dataset['title']))
+
+    sendResourceOperations(operations)
+
+
+def createResources(newResources:List[Resource], nid, title):
+    sendResourceOperations([(createResource, resource, nid, title) for resource in newResources])
+
+
+def sendResourceOperations(operations):
+    """Run the (function, *args) resource operations of one dataset one after the other.
+    Every create and delete makes DKAN save the resource list of the dataset node again,
+    concurrent saves of the same node can lose resources and change their order.
+    Datasets are uploaded concurrently instead, see excelreader.upload_concurrently."""
+    journal = uploadjournal.get_journal()
+    if journal:
+        # all operations are in the journal before the first one is sent
+        operations = [(journal.run_operation, *getJournalEntry(operation), *operation) for operation in operations]
+        for _run, op, key, *_operation in operations:
+            journal.record(op, key, uploadjournal.PLANNED)
+
+    for function, *args in operations:
+        function(*args)
+
+
+def getJournalEntry(operation):
+    """Return (op, key) of a resource operation for the upload journal"""
+    function, *args = operation
+    if function is createResource:
+        resource, nid, _title = args
+        return 'createResource', 'resource:{}:{}'.format(nid, resource.getUniqueId())
+    # update and delete get the existing resource node as last argument
+    return function.__name__, 'resource:{}'.format(args[-1]['nid'])
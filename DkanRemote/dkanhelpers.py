@@ -3,55 +3,93 @@ import json
 import logging
 import os.path
 import os
-import cgi
-import ssl
+import time
+import hashlib
+import threading
+import contextlib
+from types import MappingProxyType
 from urllib.parse import urlparse
-from urllib.request import urlopen
-from urllib.request import urlretrieve
 from random import random
 from timeit import default_timer as timer
 import requests
 from . import config
-from . import dkanhandler
 from . import constants
-
-import warnings
-import contextlib
-from urllib3.exceptions import InsecureRequestWarning
-
-old_merge_environment_settings = requests.Session.merge_environment_settings
-
-# Fix problems with broken SSL certificates
-# ref. https://stackoverflow.com/questions/15445981/how-do-i-disable-the-security-certificate-check-in-python-requests
-@contextlib.contextmanager
-def no_ssl_verification():
-    opened_adapters = set()
-
-    def merge_environment_settings(self, url, proxies, stream, verify, cert):
-        # Verification happens only once per connection so we need to close
-        # all the opened adapters once we're done. Otherwise, the effects of
-        # verify=False persist beyond the end of this context manager.
-        opened_adapters.add(self.get_adapter(url))
-
-        settings = old_merge_environment_settings(self, url, proxies, stream, verify, cert)
-        settings['verify'] = False
-
-        return settings
-
-    requests.Session.merge_environment_settings = merge_environment_settings
-
-    try:
-        with warnings.catch_warnings():
-            warnings.simplefilter('ignore', InsecureRequestWarning)
-            yield
-    finally:
-        requests.Session.merge_environment_settings = old_merge_environment_settings
-
-        for adapter in opened_adapters:
+from . import transport
+from . import responsecache
+
+
+class OrderedLogBuffer:
+    """Holds back log records of concurrently running jobs, so they can be written in the original order.
+
+    While the buffer is active it is attached as filter to all handlers of the root logger.
+    Records of threads that currently capture into a list are collected there instead of being written,
+    replay() then writes them from the calling thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._handlers = []
+
+    def __enter__(self):
+        self._handlers = list(logging.getLogger().handlers)
+        for handler in self._handlers:
+            handler.addFilter(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        for handler in self._handlers:
+            handler.removeFilter(self)
+        self._handlers = []
+
+    def filter(self, record):
+        records = getattr(self._local, 'records', None)
+        if records is None:
+            return True
+        # the same record is passed to the filter once per handler
+        if not (records and records[-1] is record):
+            records.append(record)
+        return False
+
+    @contextlib.contextmanager
+    def capture(self, records):
+        previous = getattr(self._local, 'records', None)
+        self._local.records = records
+        try:
+            yield records
+        finally:
+            self._local.records = previous
+
+    def run_captured(self, records, function, *args):
+        with self.capture(records):
+            return function(*args)
+
+    def submit(self, pool, function, *args, records=None):
+        """Run the function in the pool, its log records are appended to the returned list"""
+        if records is None:
+            records = []
+        return records, pool.submit(self.run_captured, records, function, *args)
+
+    def wait_in_order(self, jobs):
+        """Wait for the (records, future) jobs one after another, write their log records and return the results.
+        When a job fails, all jobs that did not start yet are cancelled and the error is raised."""
+        results = []
+        for index, (records, future) in enumerate(jobs):
             try:
-                adapter.close()
+                results.append(future.result() if future else None)
             except:
-                pass
+                for _records, pending in jobs[index+1:]:
+                    if pending:
+                        pending.cancel()
+                raise
+            finally:
+                self.replay(records)
+        return results
+
+    @staticmethod
+    def replay(records):
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+        del records[:]
 
 
 class JsonHelper:
@@ -94,67 +132,418 @@ class JsonHelper:
 
 
 
+class NodeIdIndex:
+    ''' Index uuid => node id of all nodes in the DKAN instance.
+
+        It is read page by page from the node list endpoint and saved in a single file in the temp dir,
+        so the node id lookup of a package or resource does not need an own request.
+        The file is used for x_node_index_ttl seconds. If a uuid is not in the index from the file,
+        the node may be new: the index is read again from DKAN (once per run).
+    '''
+
+    _index = None
+    _from_file = False
+    _lock = threading.Lock()
+    # only one thread reads the node list, _lock is not held meanwhile
+    _load_lock = threading.Lock()
+
+    @staticmethod
+    def get_node_id(uuid):
+        index, from_file = NodeIdIndex.get_index()
+        node_id = index.get(uuid)
+        if node_id is None and from_file:
+            logging.debug(_('%s ist nicht im Node-ID-Index, der Index wird neu gelesen'), uuid)
+            index, _from_file = NodeIdIndex.get_index(rebuild=True)
+            node_id = index.get(uuid)
+        return node_id
+
+
+    @staticmethod
+    def get_index(rebuild=False):
+        """ Return (index, True if it was read from the file) """
+        with NodeIdIndex._load_lock:
+            with NodeIdIndex._lock:
+                index, from_file = NodeIdIndex._index, NodeIdIndex._from_file
+            # another thread may have read it again already
+            if index is None or (rebuild and from_file):
+                index, from_file = NodeIdIndex.load(use_file=not rebuild)
+                with NodeIdIndex._lock:
+                    NodeIdIndex._index, NodeIdIndex._from_file = index, from_file
+            return index, from_file
+
+
+    @staticmethod
+    def add(uuid, node_id):
+        with NodeIdIndex._lock:
+            if NodeIdIndex._index is not None:
+                NodeIdIndex._index[uuid] = node_id
+
+
+    @staticmethod
+    def reset():
+        with NodeIdIndex._lock:
+            NodeIdIndex._index = None
+            NodeIdIndex._from_file = False
+
+
+    @staticmethod
+    def get_index_filename():
+        portal_hash = hashlib.md5(config.dkan_url.encode()).hexdigest()
+        return os.path.normpath(config.x_temp_dir + 'node_index_{}.json'.format(portal_hash))
+
+
+    @staticmethod
+    def load(use_file=True):
+        """ Return (index, True if it was read from the file) """
+        index_file = NodeIdIndex.get_index_filename()
+        if os.path.isfile(index_file):
+            if use_file and time.time() - os.path.getmtime(index_file) < config.x_node_index_ttl:
+                try:
+                    with open(index_file, mode='r', encoding='utf-8') as json_data:
+                        index = json.load(json_data)
+                    logging.debug(_('Nutze Node-ID-Index "%s" mit %s Einträgen'), index_file, len(index))
+                    return index, True
+                except json.decoder.JSONDecodeError as err:
+                    logging.debug(_("Node-ID-Index ist fehlerhaft und wird neu gelesen: %s"), err)
+            # outdated, it may contain nodes that were deleted in the meantime
+            with contextlib.suppress(OSError):
+                os.remove(index_file)
+
+        ti = timer()
+        index = {}
+        for node_type in config.x_node_index_types:
+            NodeIdIndex.read_all_pages(node_type, index)
+        logging.info(_('Node-ID-Index mit %s Einträgen gelesen in %.2fs'), len(index), timer() - ti)
+
+        if index:
+            partial_file = '{}.{}.part'.format(index_file, threading.get_ident())
+            with open(partial_file, mode='w', encoding='utf-8') as fw:
+                json.dump(index, fw)
+            os.replace(partial_file, index_file)
+        return index, False
+
+
+    @staticmethod
+    def read_all_pages(node_type, index):
+        page = 0
+        while True:
+            remote_url = config.dkan_url + config.x_api_node_index.format(node_type, config.x_node_index_page_size, page)
+            try:
+                r = transport.get(remote_url)
+                nodes = r.json() if r.status_code == 200 else None
+            except ValueError as err:
+                logging.debug(_("Fehlermeldung (beim Parsen der DKAN-API JSON-Daten): %s"), err)
+                nodes = None
+
+            if nodes is None:
+                logging.warning(_('Node-Liste konnte nicht gelesen werden: {}').format(remote_url))
+                logging.warning(_('Fehlende Node-IDs werden einzeln abgefragt.'))
+                return
+
+            # DKAN may cap the page size, so only stop at an empty page.
+            # Also stop if the page only contains known nodes, in case the server ignores the page parameter.
+            new_nodes = [node for node in nodes if node.get('uuid') and node['uuid'] not in index]
+            if not new_nodes:
+                return
+
+            for node in new_nodes:
+                index[node['uuid']] = node['nid']
+            page += 1
+
+
+class ReferenceData:
+    ''' Registry of the reference data of the DKAN instance: taxonomies, file formats and groups.
+
+        Everything is loaded at once (in parallel) at the start of a run and then shared as read-only
+        mappings by all modules. A snapshot is saved in the temp dir and used for x_reference_data_ttl seconds.
+    '''
+
+    _data = None
+    _lock = threading.Lock()
+    _reload_lock = threading.Lock()
+
+    @staticmethod
+    def get_taxonomy(taxonomy_name):
+        ''' Mapping tid => name of all terms of the taxonomy '''
+        data = ReferenceData.load()
+        if taxonomy_name not in data['taxonomies']:
+            # taxonomy is not used by the column config, load it on its own
+            terms = HttpHelper.parse_admin_page_contents(None, '/admin/structure/taxonomy/{}'.format(taxonomy_name))
+            with ReferenceData._lock:
+                data['taxonomies'][taxonomy_name] = MappingProxyType(dict(terms))
+        return data['taxonomies'][taxonomy_name]
+
+
+    @staticmethod
+    def find_term_ids(taxonomy_name, term_names):
+        ''' Look up the tids of all term names (case insensitive) at once, None for unknown names.
+            The result is memoized per taxonomy and list of names, e.g. for the same cell value in many rows. '''
+        data = ReferenceData.load()
+        key = (taxonomy_name, tuple(term_names))
+        term_ids = data['term_ids'].get(key)
+        if term_ids is None:
+            index = ReferenceData.get_taxonomy_index(taxonomy_name)
+            term_ids = tuple(index.get(term_name.casefold()) for term_name in term_names)
+            if None in term_ids:
+                # the term may have been created after the snapshot was read
+                ReferenceData.reload_taxonomy(taxonomy_name)
+                index = ReferenceData.get_taxonomy_index(taxonomy_name)
+                term_ids = tuple(index.get(term_name.casefold()) for term_name in term_names)
+            with ReferenceData._lock:
+                data['term_ids'][key] = term_ids
+        return term_ids
+
+
+    @staticmethod
+    def reload_taxonomy(taxonomy_name):
+        ''' Read the terms of the taxonomy again from DKAN, only once per load (later calls do nothing) '''
+        data = ReferenceData.load()
+        with ReferenceData._reload_lock:
+            if taxonomy_name in data['reloaded']:
+                return
+            logging.debug(_("Unbekannter Begriff, Taxonomie wird neu gelesen: %s"), taxonomy_name)
+            terms = HttpHelper.parse_admin_page_contents(None, '/admin/structure/taxonomy/{}'.format(taxonomy_name))
+            with ReferenceData._lock:
+                data['reloaded'].add(taxonomy_name)
+                if terms:
+                    data['taxonomies'][taxonomy_name] = MappingProxyType(dict(terms))
+                    data['taxonomy_indexes'].pop(taxonomy_name, None)
+                    data['term_ids'] = {
+                        key: term_ids for key, term_ids in data['term_ids'].items() if key[0] != taxonomy_name}
+
+
+    @staticmethod
+    def get_taxonomy_index(taxonomy_name):
+        ''' Mapping case folded name => tid of all terms of the taxonomy '''
+        data = ReferenceData.load()
+        index = data['taxonomy_indexes'].get(taxonomy_name)
+        if index is None:
+            # if names are not unique, the last term wins (like the old linear search)
+            index = MappingProxyType({
+                str(term_name).casefold(): tid for tid, term_name in ReferenceData.get_taxonomy(taxonomy_name).items()})
+            with ReferenceData._lock:
+                data['taxonomy_indexes'][taxonomy_name] = index
+        return index
+
+
+    @staticmethod
+    def get_file_formats():
+        ''' Mapping lower case format name => tid '''
+        return ReferenceData.load()['file_formats']
+
+
+    @staticmethod
+    def get_group(group_id):
+        ''' Group node (only type and title), or None if there is no such group '''
+        data = ReferenceData.load()
+        group_id = str(group_id)
+        if group_id not in data['groups']:
+            # e.g. a new group, that was created after the snapshot
+            node = HttpHelper.read_dkan_node(group_id) or {}
+            group = {'type': node['type'], 'title': node.get('title', '')} if 'type' in node else None
+            with ReferenceData._lock:
+                data['groups'][group_id] = group
+        return data['groups'][group_id]
+
+
+    @staticmethod
+    def reset():
+        with ReferenceData._lock:
+            ReferenceData._data = None
+
+
+    @staticmethod
+    def get_snapshot_filename():
+        portal_hash = hashlib.md5(config.dkan_url.encode()).hexdigest()
+        return os.path.normpath(config.x_temp_dir + 'reference_data_{}.json'.format(portal_hash))
+
+
+    @staticmethod
+    def load():
+        with ReferenceData._lock:
+            if ReferenceData._data is None:
+                snapshot = ReferenceData.read_snapshot()
+                if snapshot is None:
+                    snapshot = ReferenceData.read_from_dkan()
+                    # an empty list is most probably an error (e.g. login failed), then try again next time
+                    if snapshot['file_formats'] and all(snapshot['taxonomies'].values()):
+                        ReferenceData.save_snapshot(snapshot)
+                ReferenceData._data = {
+                    'taxonomies': {name: MappingProxyType(terms) for name, terms in snapshot['taxonomies'].items()},
+                    'file_formats': MappingProxyType(snapshot['file_formats']),
+                    'groups': snapshot['groups'],
+                    'taxonomy_indexes': {},
+                    'term_ids': {},
+                    'reloaded': set(),
+                }
+            return ReferenceData._data
+
+
+    @staticmethod
+    def read_snapshot():
+        snapshot_file = ReferenceData.get_snapshot_filename()
+        if not os.path.isfile(snapshot_file):
+            return None
+        if os.path.getmtime(snapshot_file) + config.x_reference_data_ttl < time.time():
+            logging.debug(_("Referenzdaten sind veraltet und werden neu gelesen: %s"), snapshot_file)
+            return None
+        try:
+            with open(snapshot_file, mode='r', encoding='utf-8') as json_data:
+                snapshot = json.load(json_data)
+            logging.debug(_('Nutze Referenzdaten "%s"'), snapshot_file)
+            return snapshot
+        except json.decoder.JSONDecodeError as err:
+            logging.debug(_("Referenzdaten sind fehlerhaft und werden neu gelesen: %s"), err)
+            return None
+
+
+    @staticmethod
+    def save_snapshot(snapshot):
+        snapshot_file = ReferenceData.get_snapshot_filename()
+        partial_file = '{}.{}.part'.format(snapshot_file, threading.get_ident())
+        with open(partial_file, mode='w', encoding='utf-8') as fw:
+            json.dump(snapshot, fw)
+        os.replace(partial_file, snapshot_file)
+
+
+    @staticmethod
+    def get_taxonomy_names():
+        ''' All taxonomies that are referenced by the column config ("TID_REF|field|taxonomy") '''
+        schema = constants.get_column_schema()
+        columns = list(schema.dataset.values()) + list(schema.resource_known.values())
+        return sorted({column.taxonomy for column in columns if column.kind == constants.ColumnKind.TID_REF})
+
+
+    @staticmethod
+    def read_from_dkan():
+        ti = timer()
+        # the admin pages can only be read with a DKAN login, the workers of the resource pool have their own
+        from . import dkanhandler     # imported here, dkanhandler imports constants, which imports this module
+        pool = dkanhandler.getResourcePool()
+        taxonomy_names = ReferenceData.get_taxonomy_names()
+        taxonomy_jobs = [
+            pool.submit(HttpHelper.parse_admin_page_contents, None, '/admin/structure/taxonomy/{}'.format(taxonomy_name))
+            for taxonomy_name in taxonomy_names]
+        format_job = pool.submit(HttpHelper.parse_admin_page_contents, None, '/admin/structure/taxonomy/format')
+        groups = ReferenceData.read_all_groups()
+
+        snapshot = {
+            'taxonomies': {name: dict(job.result()) for name, job in zip(taxonomy_names, taxonomy_jobs)},
+            'file_formats': {str(value).lower(): key for key, value in dict(format_job.result()).items()},
+            'groups': groups,
+        }
+        logging.info(_('Referenzdaten gelesen in {:.2f}s: %s Taxonomien, %s Dateiformate, %s Gruppen').format(timer() - ti),
+            len(snapshot['taxonomies']), len(snapshot['file_formats']), len(snapshot['groups']))
+        return snapshot
+
+
+    @staticmethod
+    def read_all_groups():
+        groups = {}
+        page = 0
+        while True:
+            remote_url = config.dkan_url + config.x_api_group_list.format(config.x_node_index_page_size, page)
+            try:
+                r = transport.get(remote_url)
+                nodes = r.json() if r.status_code == 200 else None
+            except ValueError as err:
+                logging.debug(_("Fehlermeldung (beim Parsen der DKAN-API JSON-Daten): %s"), err)
+                nodes = None
+
+            if nodes is None:
+                logging.warning(_('Gruppen-Liste konnte nicht gelesen werden: {}').format(remote_url))
+                return groups
+
+            # like in NodeIdIndex.read_all_pages, stop at an empty page or a page without new groups
+            new_nodes = [node for node in nodes if node.get('nid') and str(node['nid']) not in groups]
+            if not new_nodes:
+                return groups
+
+            for node in new_nodes:
+                groups[str(node['nid'])] = {'type': node.get('type', 'group'), 'title': node.get('title', '')}
+            page += 1
+
+
 class HttpHelper:
     ''' helper methods .. refactor '''
 
-    file_formats = None
-    taxonomy_cache = {}
-
     @staticmethod
     def read_dkan_node(node_id):
-        node_data = HttpHelper.read_remote_json_with_cache(config.x_api_get_node_details.format(node_id, random()), '{}-complete.json'.format(node_id))
+        node_data = HttpHelper.read_remote_json_with_cache(
+            config.x_api_get_node_details.format(node_id, random()), '{}-complete.json'.format(node_id), config.x_cache_ttl_nodes)
         return node_data
 
 
     @staticmethod
-    def read_remote_json_with_cache(remote_url, temp_file):
-        """download a remote url to a temp directory first, then use it"""
+    def invalidate_dkan_node(node_id):
+        """ Remove a node from the cache, e.g. after it was changed """
+        HttpHelper.invalidate_cache('{}-complete.json'.format(node_id))
+
+
+    @staticmethod
+    def invalidate_cache(temp_file):
+        responsecache.get_cache().delete(config.dkan_url + '|' + temp_file)
+
+
+    @staticmethod
+    def read_remote_json_with_cache(remote_url, temp_file, ttl=None):
+        """download a remote url, or use the cached response as long as it is valid
+
+            temp_file is the name of the response in the cache, ttl its lifetime in seconds
+        """
 
-        # prefix with tempdir and convert slashes to backslashes on windows
-        temp_file = os.path.normpath(config.x_temp_dir + temp_file)
+        cache = responsecache.get_cache()
+        cache_key = config.dkan_url + '|' + temp_file
         remote_url = config.dkan_url + remote_url
+        ttl = config.x_cache_ttl if ttl is None else ttl
         data = None
 
-        try:
-            if os.path.isfile(temp_file):
-                logging.debug(_('Nutze Cachedatei "%s" '), temp_file)
+        entry = cache.lookup(cache_key)
+        if entry and cache.is_fresh(entry):
+            logging.debug(_('Nutze Cache-Eintrag "%s" '), temp_file)
+            body = entry.body
+        else:
+            headers = {'Cache-Control': 'no-cache', "Pragma": "no-cache"}
+            # revalidate expired entry if possible, so an unchanged response does not have to be sent again
+            if entry and entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry and entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+            ti = timer()
+            r = transport.get(remote_url, headers=headers)
+            logging.debug(_('HTTP {} | {:.2f}s für: "{}"').format(r.status_code, timer() - ti, remote_url))
+
+            if entry and r.status_code == 304:
+                cache.refresh(cache_key, ttl)
+                body = entry.body
             else:
-                ti = timer()
-                r = requests.get(remote_url, headers={'Cache-Control': 'no-cache', "Pragma": "no-cache"}, verify=False)
-                myfile = r.text
-
-                logging.debug(_('HTTP {} | {:.2f}s für: "{}"').format(r.status_code, timer() - ti, remote_url))
+                body = r.text
                 if r.status_code not in [200,302]:
                     logging.warning(_('Warnung: HTTP {} ist vermutlich ein Problem!').format(r.status_code))
                     logging.warning(_('Betroffene URL: {} ').format(remote_url))
+                else:
+                    cache.store(cache_key, body, r.headers.get('ETag'), r.headers.get('Last-Modified'), ttl)
 
-                with open(temp_file, mode='w', encoding='utf-8') as fw:
-                    fw.write(myfile)
-
-            with open(temp_file, mode='r', encoding='utf-8') as json_data:
-                data = json.load(json_data)
+        try:
+            data = json.loads(body)
 
         except json.decoder.JSONDecodeError as err:
             logging.debug(_("Fehlermeldung (beim Parsen der DKAN-API JSON-Daten): %s"), err)
             logging.error(_("Fehler 5001 beim Lesen der Eingabedaten."))
-            os.remove(temp_file)
+            cache.delete(cache_key)
 
         return data
 
 
     @staticmethod
     def get_taxonomy_values(taxonomy_name):
-        if taxonomy_name not in HttpHelper.taxonomy_cache:
-            HttpHelper.taxonomy_cache[taxonomy_name] = HttpHelper.parse_admin_page_contents(dkanhandler.getApi(), '/admin/structure/taxonomy/{}'.format(taxonomy_name))
-        return HttpHelper.taxonomy_cache[taxonomy_name]
+        return ReferenceData.get_taxonomy(taxonomy_name)
 
 
     @staticmethod
     def get_all_dkan_fileformats():
-        if not HttpHelper.file_formats:
-            fileformats = HttpHelper.parse_admin_page_contents(dkanhandler.getApi(), '/admin/structure/taxonomy/format')
-            HttpHelper.file_formats = {str(value).lower():key for key, value in fileformats.items()}
-        return dict(HttpHelper.file_formats)
+        return ReferenceData.get_file_formats()
 
 
     @staticmethod
@@ -165,50 +554,6 @@ class HttpHelper:
         return file_name
 
 
-    @staticmethod
-    def download_resource(url, lfd_nr, r_format):
-
-        ctx = ssl.create_default_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        try:
-            logging.debug("URL: %s", url)
-            remotefile = urlopen(url, context=ctx)
-        except Exception as err:
-            logging.warning('Fehler: %s', repr(err))
-            logging.error('Resource-URL kann nicht geöffnet werden: %s', url)
-            return None
-
-        backup_filename = filename = ''
-        try:
-            logging.debug("remotefile info %s", remotefile.info())
-            cd_header = remotefile.info()['Content-Disposition']
-            logging.debug("header %s", cd_header)
-            value, params = cgi.parse_header(cd_header)
-            filename = params["filename"]
-            logging.debug("Dateiname aus Header: %s", filename)
-        except Exception as err:
-            logging.debug('Kein Dateiname im Header, Fehler: %s', repr(err))
-            filename = HttpHelper.get_resource_filename(url)
-            if filename:
-                logging.debug("Dateiname aus URL: %s", filename)
-        if filename and (filename.find(".") == -1):
-            filename = filename + '.' + r_format
-
-        if not filename:
-            backup_filename = 'unknown.{}'.format(r_format)
-            logging.warning("Dateiname in URL und Header Leer. Download-Datei wird '%s' genannt.", backup_filename)
-
-        targetpath = os.path.normpath(os.path.join(config.download_dir, lfd_nr + '-' + filename + backup_filename))
-        logging.debug("Download Ziel: %s", targetpath)
-
-        ti = timer()
-        urlretrieve(url, targetpath)
-        logging.info(_(' * Download in {:.4f}s: {} "{}"').format(timer() - ti, (lfd_nr + '-' + filename + backup_filename), url))
-
-        return filename
-
-
     @staticmethod
     def parse_admin_page_contents(pydkan_instance, admin_page_path):
 
@@ -218,14 +563,21 @@ class HttpHelper:
         # Which seems to be the only way to get a list of the dataset_tags with their according IDs
 
         if not pydkan_instance:
+            from . import dkanhandler
             pydkan_instance = dkanhandler.getApi()
         if not pydkan_instance:
             logging.error(_("Anmeldung am DKAN fehlgeschlagen: %s"), admin_page_path)
             return []
 
         tags_url = config.dkan_url + admin_page_path
-        res = None
-        with no_ssl_verification():
+        # the admin pages are read in parallel, so verify=False is only passed to this request
+        from . import fileupload
+        session, login = fileupload.get_login(pydkan_instance)
+        if session:
+            res = session.get(tags_url, verify=False,
+                timeout=(config.x_http_connect_timeout, config.x_http_read_timeout), **login)
+        else:
+            logging.warning(_("Login von pydkan nicht gefunden, SSL-Zertifikat wird geprüft: %s"), tags_url)
             res = pydkan_instance.get(tags_url)
 
         if res.status_code != 200:
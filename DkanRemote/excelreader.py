@@ -2,15 +2,25 @@
 
 import re
 import logging
-import xlrd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .datasetuploader import DatasetUploader
 from . import config
 from . import constants
+from . import dkanhandler
+from . import dkanhelpers
+from . import responsecache
+from . import uploadjournal
+from . import progress
+from .excelrows import ExcelRowReader
 
-def read(command_line_excel_filename):
-    """ read first row of file """
+def read(command_line_excel_filename, cancel_event=None):
+    """ read first row of file
 
-    er = ExcelReader()
+        cancel_event: threading.Event, if it is set the upload stops after the datasets that are being uploaded
+    """
+
+    er = ExcelReader(cancel_event)
     er.import_excel_file_to_dkan(command_line_excel_filename if command_line_excel_filename else config.excel_filename)
 
 
@@ -22,9 +32,17 @@ class ExcelReader:
     columns_in_file = {}
     datasetuploader = None
 
-    def __init__(self):
+    def __init__(self, cancel_event=None):
         self.columns_in_file = {}
         self.datasetuploader = DatasetUploader()
+        self.cancel_event = cancel_event
+        self.job = None
+
+    def isCancelled(self):
+        if self.cancel_event and self.cancel_event.is_set():
+            logging.warning(_("Upload abgebrochen. Mit 'Abgebrochenen Upload fortsetzen' kann er später fortgesetzt werden."))
+            return True
+        return False
 
     def import_excel_file_to_dkan(self, excel_filename):
         dkan_dataset_fields = constants.get_column_config_dataset()
@@ -32,20 +50,11 @@ class ExcelReader:
         dkan_fields = {**dkan_dataset_fields, **dkan_resource_fields}
 
         logging.info(_("Excel Datei wird eingelesen: %s"), excel_filename)
-        loc = (excel_filename)
-
-        wb = xlrd.open_workbook(loc)
-        sheet = wb.sheet_by_index(0)
-        sheet.cell_value(0, 0)
+        excel_rows = ExcelRowReader(excel_filename)
 
         used_fields = {}
-        columns = []
         logging.info(_("Gefundene Spaltenüberschriften der Excel-Datei:"))
-        for i in range(sheet.ncols):
-
-            column_name = sheet.cell_value(0, i)
-            columns.append(column_name)
-
+        for column_name in excel_rows.columns:
             if column_name in dkan_fields:
                 used_fields[column_name] = 1
                 logging.info(" o %s", column_name)
@@ -84,34 +93,83 @@ class ExcelReader:
         constants.Dataset.verify()
         constants.Resource.verify()
 
+        # the datasets may have been changed in the DKAN web interface since the cached responses were read
+        responsecache.get_cache().clear()
+        logging.debug(_("Cache wurde geleert"))
+
+        # taxonomies, file formats and groups are needed for every dataset
+        dkanhelpers.ReferenceData.load()
+
 
         if config.dataset_ids:
         # write only the wanted dataset-ids into x_dataset_ids_temp
             p = re.compile('[-\w]*limit\s*=\s*(\d+)[\w,]*')
             config.x_dataset_ids_temp  = p.sub('', config.dataset_ids)
 
-        self.columns_in_file = columns
-        self.parse_rows(sheet)
+        self.columns_in_file = excel_rows.columns
+
+        # every operation is written to the journal, so an interrupted upload can be resumed
+        uploadjournal.open_journal(excel_filename, config.resume_upload)
+        self.job = progress.start(_('Upload'), excel_rows.nrows - 1 if excel_rows.nrows else None, _('Zeilen'), key='upload')
+        try:
+            completed = self.parse_rows(excel_rows)
+        except:
+            uploadjournal.close_journal('aborted')
+            raise
+        finally:
+            self.job.finish()
+        uploadjournal.close_journal('finished' if completed else 'cancelled')
 
         config.x_dataset_ids_temp = ''
+        responsecache.get_cache().log_statistics()
 
 
-    def parse_rows(self, sheet):
+    def parse_rows(self, excel_rows):
+        """ Upload all datasets, return False if the upload was cancelled """
+        if config.upload_workers > 1:
+            return self.upload_concurrently(self.iterate_datasets(excel_rows), config.upload_workers)
+
+        for dataset, resources in self.iterate_datasets(excel_rows):
+            if self.isCancelled():
+                return False
+            if self.datasetuploader.claimDataset(dataset):
+                self.uploadDataset(dataset, resources)
+            else:
+                self.countRows(resources)
+        return True
+
+
+    def uploadDataset(self, dataset, resources):
+        """ Upload the dataset and count its rows as done """
+        try:
+            node_id = self.datasetuploader.uploadDataset(dataset, resources)
+        except:
+            self.countRows(resources, failed=True)
+            raise
+        self.countRows(resources)
+        return node_id
+
+
+    def countRows(self, resources, failed=False):
+        # the first resource is in the row of the dataset
+        rows = max(1, len(resources))
+        if self.job:
+            self.job.advance(rows, failed=rows if failed else 0)
+
+
+    def iterate_datasets(self, excel_rows):
+        """ Yield every dataset of the sheet together with the resources of the following rows,
+            while the file is still being read """
 
         last_dataset = None
         resources = []
-        for row_nr in range(1, sheet.nrows):
-
-            row = {}
-            for i in range(sheet.ncols):
-                column_value = sheet.cell_value(row_nr, i)
-                column_name = self.columns_in_file[i]
-                row[column_name] = column_value
+        nrows = excel_rows.nrows if excel_rows.nrows else '?'
+        for row_nr, row in excel_rows.rows():
 
             logging.log(
                 # prevent showing too many uninteresting log messages if Datensatz-Beschränkung is set
                 logging.DEBUG if config.x_dataset_ids_temp else logging.INFO,
-                _("Zeile %s/%s"), row_nr, sheet.nrows
+                _("Zeile %s/%s"), row_nr, nrows
                 )
 
             dataset = constants.Dataset.create(row)
@@ -120,7 +178,7 @@ class ExcelReader:
                 logging.debug("Vorheriger Datensatz: %s", last_dataset)
                 # All resource columns were collected. A new dataset should be created.
                 if last_dataset:
-                    self.datasetuploader.processDataset(last_dataset, resources)
+                    yield last_dataset, resources
                 elif resources:
                     logging.warning(_("%s Resourcen werden ignoriert."), len(resources))
 
@@ -135,4 +193,45 @@ class ExcelReader:
 
         # create last dataset in file
         if last_dataset:
-            self.datasetuploader.processDataset(last_dataset, resources)
+            yield last_dataset, resources
+
+
+    def upload_concurrently(self, datasets, workers):
+        """ Upload the datasets with a pool of workers, each with its own DKAN login.
+            The log messages of each dataset are held back and written in row order. """
+
+        logging.info(_("Datensätze werden mit %s parallelen Uploads bearbeitet."), workers)
+
+        with dkanhelpers.OrderedLogBuffer() as log_buffer, \
+                ThreadPoolExecutor(max_workers=workers, initializer=dkanhandler.use_own_session) as pool:
+
+            # only a few datasets are read ahead of the uploads, the rest of the file is read as the uploads proceed
+            jobs = deque()
+            completed = True
+            try:
+                for dataset, resources in datasets:
+                    # the datasets that are already being uploaded are finished
+                    if self.isCancelled():
+                        completed = False
+                        break
+                    records = []
+                    future = None
+                    # limit and dataset query are checked in row order, only the upload itself runs in parallel
+                    with log_buffer.capture(records):
+                        if self.datasetuploader.claimDataset(dataset):
+                            future = log_buffer.submit(pool, self.uploadDataset, dataset, resources, records=records)[1]
+                        else:
+                            self.countRows(resources)
+                    jobs.append((records, future))
+
+                    while len(jobs) > 2 * workers:
+                        log_buffer.wait_in_order([jobs.popleft()])
+
+                # like the sequential upload, stop at the first dataset that fails
+                log_buffer.wait_in_order(list(jobs))
+            except:
+                for _records, pending in jobs:
+                    if pending:
+                        pending.cancel()
+                raise
+        return completed
@@ -0,0 +1,187 @@
+"""Read the first sheet of an excel file row by row
+
+.xlsx files are read directly from the zip archive with an incremental xml parser,
+so only the current row (and the shared strings of the workbook) are kept in memory.
+Old .xls files are read with xlrd.
+"""
+import re
+import logging
+import zipfile
+import posixpath
+from xml.etree.ElementTree import iterparse
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PACKAGE_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+CELL_REFERENCE = re.compile(r'([A-Z]+)(\d+)')
+
+
+class ExcelRowReader:
+    """ Streaming reader for the first sheet of an excel file
+
+        The header row is read when the file is opened, see columns.
+        rows() then yields (row_nr, row) for all following rows, where row is a dict column name => cell value.
+        Like xlrd, numbers are returned as float and empty cells as ''.
+        If rows() is not read to the end, call close() (or use the reader as context manager).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.columns = []
+        self.nrows = None       # number of rows (with header), None if the file does not tell
+        self._rows = None
+
+        if zipfile.is_zipfile(filename):
+            self._rows = self._read_xlsx_rows()
+        else:
+            self._rows = self._read_xls_rows()
+
+        # header row
+        for _row_nr, values in self._rows:
+            self.columns = [str(value) for value in values]
+            break
+
+        duplicates = sorted({column for column in self.columns if column and self.columns.count(column) > 1})
+        if duplicates:
+            # the rows are dicts by column name, only the last of the columns with the same name is used
+            logging.warning(_("Spaltenüberschriften kommen mehrfach vor, nur die letzte Spalte wird gelesen: %s"), ', '.join(duplicates))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        """ Close the file, if rows() was not read to the end """
+        self._rows.close()
+
+
+    def rows(self):
+        for row_nr, values in self._rows:
+            # rows can be shorter than the header, if their last cells are empty
+            values = values + [''] * (len(self.columns) - len(values))
+            yield row_nr, dict(zip(self.columns, values))
+
+
+    def _read_xls_rows(self):
+        import xlrd     # only needed for old .xls files, not imported at startup
+        wb = xlrd.open_workbook(self.filename, on_demand=True)
+        sheet = wb.sheet_by_index(0)
+        self.nrows = sheet.nrows
+        for row_nr in range(sheet.nrows):
+            yield row_nr, sheet.row_values(row_nr)
+        wb.release_resources()
+
+
+    def _read_xlsx_rows(self):
+        with zipfile.ZipFile(self.filename) as archive:
+            shared_strings = self._read_shared_strings(archive)
+            sheet_path = self._get_first_sheet_path(archive)
+
+            with archive.open(sheet_path) as sheet_file:
+                expected_row_nr = 0
+                values = []
+                sheet_data = None
+                for event, element in iterparse(sheet_file, events=('start', 'end')):
+                    if event == 'start':
+                        if element.tag == NS_MAIN + 'row':
+                            values = []
+                        elif element.tag == NS_MAIN + 'sheetData':
+                            sheet_data = element
+                        continue
+
+                    if element.tag == NS_MAIN + 'dimension':
+                        match = CELL_REFERENCE.search(element.get('ref', '').split(':')[-1])
+                        if match:
+                            self.nrows = int(match.group(2))
+
+                    elif element.tag == NS_MAIN + 'c':
+                        column_nr = self._get_column_nr(element.get('r'), len(values))
+                        values.extend([''] * (column_nr - len(values)))
+                        values.append(self._get_cell_value(element, shared_strings))
+                        element.clear()
+
+                    elif element.tag == NS_MAIN + 'row':
+                        # the row attribute is 1-based, empty rows are not in the file
+                        row_nr = int(element.get('r')) - 1 if element.get('r') else expected_row_nr
+                        while expected_row_nr < row_nr:
+                            yield expected_row_nr, []
+                            expected_row_nr += 1
+                        yield row_nr, values
+                        expected_row_nr = row_nr + 1
+                        # drop the finished rows from the parsed tree, so memory use does not grow
+                        sheet_data.clear()
+
+
+    @staticmethod
+    def _read_shared_strings(archive):
+        shared_strings = []
+        if 'xl/sharedStrings.xml' not in archive.namelist():
+            return shared_strings
+
+        with archive.open('xl/sharedStrings.xml') as strings_file:
+            for _event, element in iterparse(strings_file):
+                if element.tag == NS_MAIN + 'si':
+                    # rich text strings consist of several runs
+                    shared_strings.append(''.join(text.text or '' for text in element.iter(NS_MAIN + 't')))
+                    element.clear()
+        return shared_strings
+
+
+    @staticmethod
+    def _get_first_sheet_path(archive):
+        with archive.open('xl/workbook.xml') as workbook_file:
+            for _event, element in iterparse(workbook_file):
+                if element.tag == NS_MAIN + 'sheet':
+                    relation_id = element.get(NS_REL + 'id')
+                    break
+            else:
+                raise ValueError("No sheet found in " + archive.filename)
+
+        with archive.open('xl/_rels/workbook.xml.rels') as rels_file:
+            for _event, element in iterparse(rels_file):
+                if element.tag == NS_PACKAGE_REL + 'Relationship' and element.get('Id') == relation_id:
+                    target = element.get('Target')
+                    if target.startswith('/'):
+                        return target[1:]
+                    return posixpath.normpath(posixpath.join('xl', target))
+
+        raise ValueError("No sheet found in " + archive.filename)
+
+
+    @staticmethod
+    def _get_column_nr(reference, default):
+        match = CELL_REFERENCE.match(reference or '')
+        if not match:
+            return default
+        column_nr = 0
+        for letter in match.group(1):
+            column_nr = column_nr * 26 + ord(letter) - ord('A') + 1
+        return column_nr - 1
+
+
+    @staticmethod
+    def _get_cell_value(element, shared_strings):
+        cell_type = element.get('t', 'n')
+        if cell_type == 'inlineStr':
+            return ''.join(text.text or '' for text in element.iter(NS_MAIN + 't'))
+
+        value = element.find(NS_MAIN + 'v')
+        if value is None or value.text is None:
+            return ''
+        if cell_type == 's':
+            return shared_strings[int(value.text)]
+        if cell_type == 'b':
+            return value.text == '1'
+        if cell_type in ('str', 'e', 'd'):
+            # 'd' are dates as ISO 8601 text (the cell is formatted as date)
+            return value.text
+        try:
+            return float(value.text)
+        except ValueError:
+            return value.text
@@ -2,21 +2,24 @@
 
 import os
 import re
-import sys
 import json
 import logging
 import hashlib
+import threading
 import traceback
+import itertools
 from random import random
-from jsonschema import validate
-from jsonschema.exceptions import ValidationError
-import xlrd
-import xlsxwriter
-import httplib2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from . import config
 from . import constants
 from . import dkanhelpers
 from . import dkanhandler
+from . import responsecache
+from . import linkstatus
+from . import resourcedownload
+from . import progress
+from .excelrows import ExcelRowReader
 from .constants import AbortProgramError
 
 class ExcelResultFile:
@@ -34,6 +37,7 @@ class ExcelResultFile:
     current_row = 0
     current_dataset_nr = 0
     existing_dataset_ids = {}
+    rewritable_datasets = {}
     dataset_tag_names=  {}
     taxonomy_cache = {}
     column_mapping = []
@@ -42,26 +46,36 @@ class ExcelResultFile:
         self.filename = filename
         self.extra_columns = extra_columns
         self.current_row = 0
-
-    def initialize_new_excel_file_with_existing_content(self):
-        """ Read the extisting excel and save ALL content to "old_excel_content",
+        self.dataset_columns = None
+        self.extraction_plan = None
+        self.resource_extraction_plan = None
+        self.downloader = None      # resourcedownload.ResourceDownloader, if resource files are downloaded
+        self.old_datasets = deque()  # [dataset_id, rows] of the old excel file, that are not written yet
+
+    def initialize_new_excel_file_with_existing_content(self, keep_dataset=None, rewrite_dataset=None):
+        """ Read the extisting excel and save ALL content to "old_datasets",
             so we can then write it to a "new" file (=to continue from where we left off)
             Also return all dataset_ids as dict, so we can skip them
+
+            keep_dataset(dataset_id) can be used to drop the rows of datasets (with their resource rows)
+            rewrite_dataset(dataset_id) marks datasets that may be written again (see add_dataset),
+            their old rows are kept if they are not.
         """
         logging.info(_("Öffne Excel-Datei: %s"), self.filename)
         loc = (self.filename)
         self.existing_dataset_ids = {}
-        old_excel_content = []
+        self.rewritable_datasets = {}
+        self.old_datasets = deque([[None, []]])
+        number_of_old_datasets = 0
+        last_dataset_nr = 0
 
         try:
-            wb = xlrd.open_workbook(loc)
-            sheet = wb.sheet_by_index(0)
+            excel_rows = ExcelRowReader(loc)
             self.column_mapping = []
 
             # check if columns of excel file are same as our config
             all_dkan_rows = self.get_column_config()
-            for i in range(sheet.ncols):
-                column_header = sheet.cell_value(0, i)
+            for column_header in excel_rows.columns:
                 self.column_mapping.append(column_header)
                 if column_header not in all_dkan_rows:
                     logging.warning(_("Unbekannte Spalte wird ignoriert: {}").format(column_header))
@@ -72,20 +86,35 @@ class ExcelResultFile:
                 logging.error(_("Fehler #6000: Es wurde mindestens ein DKAN-Feld bzw. eine benötigte Spalte nicht in der Excel-Datei gefunden."))
                 logging.error(_("Fehlende Spalten in der Excel-Datei:"))
                 logging.error(_("%s"), all_dkan_rows)
+                excel_rows.close()
                 raise AbortProgramError(_("Fügen Sie bitte die fehlenden(n) Spalte(n) zur Excel-Datei hinzu (s.o.). "))
 
-            for j in range(1, sheet.nrows):
-                excelrow = []
-                for i in range(sheet.ncols):
-                    excelrow.append(sheet.cell_value(j, i))
-
-                old_excel_content.append(excelrow)
+            keep_rows = True
+            dropped_datasets = 0
+            for _row_nr, row in excel_rows.rows():
+                excelrow = [row[column_header] for column_header in self.column_mapping]
 
                 # save all package_data ids for later use (=lookup of existing ids)
-                index_of_dataset_id = self.column_mapping.index(constants.Dataset.DATASET_ID)
-                dataset_id = excelrow[index_of_dataset_id]
+                dataset_id = row[constants.Dataset.DATASET_ID]
                 if dataset_id:
-                    self.existing_dataset_ids[dataset_id] = True
+                    number_of_old_datasets += 1
+                    # the following resource rows (without dataset id) belong to this dataset
+                    keep_rows = (keep_dataset is None) or keep_dataset(dataset_id)
+                    if keep_rows:
+                        self.old_datasets.append([dataset_id, []])
+                        last_dataset_nr = self.get_dataset_nr(row) or last_dataset_nr + 1
+                        if rewrite_dataset and rewrite_dataset(dataset_id):
+                            self.rewritable_datasets[dataset_id] = last_dataset_nr
+                        else:
+                            self.existing_dataset_ids[dataset_id] = True
+                    else:
+                        dropped_datasets += 1
+
+                if keep_rows:
+                    self.old_datasets[-1][1].append(excelrow)
+
+            if dropped_datasets:
+                logging.info(_("%s Datensätze aus der Excel-Datei werden entfernt."), dropped_datasets)
 
             self.initialize_new_excel_file(True)
 
@@ -94,10 +123,26 @@ class ExcelResultFile:
             self.column_mapping = self.get_column_config()
             self.initialize_new_excel_file(False)
 
-        for row in old_excel_content:
-            self.add_plain_row(row)
+        # continue numbering after the old datasets, also the dropped ones
+        self.current_dataset_nr = max(number_of_old_datasets, last_dataset_nr)
 
-        self.current_dataset_nr = len(self.existing_dataset_ids)
+
+    @staticmethod
+    def get_dataset_nr(row):
+        ''' Number of the dataset in the "Lfd-Nr" of its first row (e.g. 12 for "012-01"), or None '''
+        match = re.match(r'(\d+)-', str(row.get(constants.Resource.LFD_NR) or ''))
+        return int(match.group(1)) if match else None
+
+
+    def write_old_rows(self, until_dataset_id=None):
+        ''' Write the rows of the old excel file, up to the dataset that is written again (its rows are dropped) '''
+        while self.old_datasets:
+            dataset_id, rows = self.old_datasets.popleft()
+            if until_dataset_id and dataset_id == until_dataset_id:
+                return
+            self.rewritable_datasets.pop(dataset_id, None)
+            for row in rows:
+                self.add_plain_row(row)
 
 
     def get_existing_dataset_ids(self):
@@ -112,6 +157,7 @@ class ExcelResultFile:
             first_row = self.column_mapping
 
         # Init workbook objects
+        import xlsxwriter     # not imported at startup, see app.py
         self.workbook = xlsxwriter.Workbook(self.filename)
         self.worksheet = self.workbook.add_worksheet()
         self.bold = self.workbook.add_format({'bold': True})
@@ -204,6 +250,16 @@ class ExcelResultFile:
         return constants.get_column_config_resource()
 
 
+    def get_dataset_columns(self):
+        """ Compiled dataset columns (see constants.ColumnSchema), with the extra columns of this file """
+        if self.dataset_columns is None:
+            columns = dict(constants.get_column_schema().dataset)
+            for col in self.extra_columns:
+                columns["Extra-" + col] = constants.compile_column("Extra-" + col, "EXTRA|" + col)
+            self.dataset_columns = columns
+        return self.dataset_columns
+
+
     def get_taxonomy_value(self, taxonomy_name, t_id):
         ''' Helper function that returns a taxonomy value for an ID, with data fetching & caching '''
         if taxonomy_name not in self.taxonomy_cache:
@@ -215,69 +271,155 @@ class ExcelResultFile:
         return '?'
 
 
-    def handle_tid_ref(self, dkan_node, column_key):
-        s_dummy, s_node_field, s_taxonomy_name = column_key.split('|')
+    def format_taxonomy_terms(self, terms, taxonomy_name):
+        """ terms are the values of a TID_REF field (see constants.Column.accessor), only the first 10 are used """
         tags = []
-        value = None
-        for t_index in range(0,10):
-            t_id = dkanhelpers.JsonHelper.get_nested_json_value(dkan_node, [s_node_field, 'und', t_index, 'tid'])
+        for term in terms[:10]:
+            t_id = term.get('tid') if isinstance(term, dict) else None
             if t_id:
-        # API returns only taxonomy ID. We can get the value via admin page parsing.
-                t_name = self.get_taxonomy_value(s_taxonomy_name, t_id)
+                # API returns only taxonomy ID. We can get the value via admin page parsing.
+                t_name = self.get_taxonomy_value(taxonomy_name, t_id)
                 tags.append('"{}" ({})'.format(t_name, t_id))
-            value = ", ".join(tags)
-        return value
+        return ", ".join(tags)
 
 
-    def convert_dkan_data_to_excel_row_hash(self, package_data, dkan_node, skip_resources):
-        #logging.debug("package_data %s", package_data)
-        #logging.debug("dkan_node %s", dkan_node)
+    @staticmethod
+    def format_groups(package_data, dkan_node):
+        if 'groups' not in package_data:
+            return None
+        groups = []
+        for t_index, group in enumerate(package_data['groups']): # luckily groups are in same order in both api endpoints
+            g_id = dkanhelpers.JsonHelper.get_nested_json_value(dkan_node, ["og_group_ref", 'und', t_index, 'target_id'])
+            groups.append('"{}" ({})'.format(group['title'].replace('"', "'"), g_id))
+        return ", ".join(groups)
 
-        # get the config of which excel columns are mapped to which dkan json keys
-        columns = {}
-        for column_name, column_key in self.get_column_config_dataset().items():
-            value = None
-            if isinstance(column_key, list):
-                value = dkanhelpers.JsonHelper.get_nested_json_value(dkan_node, column_key)
-            elif (column_key[:6] == "EXTRA|") and ("extras" in package_data):
-                extra_key = column_key[6:]
-                #logging.debug("searching extra key %s", extra_key)
-                extra_obj = [x for x in package_data["extras"] if x["key"] == extra_key]
-                value = extra_obj[0]["value"] if extra_obj else None
-
-            elif column_key[:8] == "COLLECT|":
-                extra_key = column_key[8:]
-                if 'groups' in package_data:
-                    groups = []
-                    t_index = 0
-                    for group in package_data['groups']: # luckily groups are in same order in both api endpoints
-                        g_id = dkanhelpers.JsonHelper.get_nested_json_value(dkan_node, ["og_group_ref", 'und', t_index, 'target_id'])
-                        groups.append('"{}" ({})'.format(group['title'].replace('"', "'"), g_id))
-                        t_index += 1
-                    value = ", ".join(groups)
-
-            elif column_key[:7] == "RELATED":
-                related_content = []
-                active_field = column_key[8:]
-                logging.debug("     RELATED: %s => %s", column_key, active_field)
-                for t_index in range(0,10):
-                    rel = dkanhelpers.JsonHelper.get_nested_json_value(dkan_node, [active_field, 'und', t_index])
-                    if rel:
-                        s_title = rel['title'] if rel['title'] else ""
-                        related_content.append('"{}" ({})'.format(s_title.replace('"', "'"), rel['url']))
-                    value = ", ".join(related_content)
-
-            elif column_key[:7] == "TID_REF":
-                value = self.handle_tid_ref(dkan_node, column_key)
 
-            else:
-                if column_key in package_data:
-                    value = package_data[column_key]
-                    logging.debug(" [x] %s => %s", column_key, value)
-                else:
-                    value = None
+    @staticmethod
+    def format_related_content(entries):
+        related_content = []
+        for rel in entries[:10]:
+            if rel:
+                s_title = rel['title'] if rel['title'] else ""
+                related_content.append('"{}" ({})'.format(s_title.replace('"', "'"), rel['url']))
+        return ", ".join(related_content)
+
+
+    def get_extraction_plan(self):
+        """ List of (column name, extractor) for the dataset columns, compiled once per file.
+            Each extractor is called with (package_data, dkan_node, extras), where extras is a dict key => value
+            of the package extras. """
+        if self.extraction_plan is None:
+            plan = []
+            for column_name, column in self.get_dataset_columns().items():
+                plan.append((column_name, self.compile_dataset_extractor(column)))
+            self.extraction_plan = plan
+        return self.extraction_plan
+
+
+    def compile_dataset_extractor(self, column):
+        kind = column.kind
+        if kind == constants.ColumnKind.PATH:
+            return lambda package_data, dkan_node, extras: column.accessor(dkan_node)
+        if kind == constants.ColumnKind.EXTRA:
+            return lambda package_data, dkan_node, extras: extras.get(column.field)
+        if kind == constants.ColumnKind.COLLECT:
+            return lambda package_data, dkan_node, extras: self.format_groups(package_data, dkan_node)
+        if kind == constants.ColumnKind.RELATED:
+            return lambda package_data, dkan_node, extras: self.format_related_content(column.accessor(dkan_node))
+        if kind == constants.ColumnKind.TID_REF:
+            return lambda package_data, dkan_node, extras: self.format_taxonomy_terms(column.accessor(dkan_node), column.taxonomy)
+        return lambda package_data, dkan_node, extras: package_data.get(column.key)
+
+
+    def get_resource_extraction_plan(self):
+        """ Like get_extraction_plan(), for the resource columns. The extractors are called with
+            (resource, lfd_nr) and the detailed ones with (resource_node, resource_url_info). """
+        if self.resource_extraction_plan is None:
+            schema = constants.get_column_schema()
+            url_keyname = schema.resource[constants.Resource.URL].key
+            if isinstance(url_keyname, list):
+                raise AbortProgramError(_('Unerwarteter Knotentyp "Liste".'))
+
+            plan = []
+            for column_name, resource_column in schema.resource.items():
+                plan.append((column_name, self.compile_resource_extractor(resource_column, url_keyname)))
+
+            detailed_plan = []
+            if config.detailed_resources:
+                for column_name, resource_column in schema.resource_detailed.items():
+                    detailed_plan.append((column_name, self.compile_detailed_resource_extractor(resource_column)))
+
+            self.resource_extraction_plan = (plan, detailed_plan)
+        return self.resource_extraction_plan
+
 
-            columns[column_name] = value
+    @staticmethod
+    def compile_resource_extractor(resource_column, url_keyname):
+        rc_key = resource_column.key
+        if rc_key == 'lfd-nr':
+            return lambda resource, lfd_nr: lfd_nr
+
+        if rc_key == 'RTYPE':
+            def get_resource_type(resource, lfd_nr):
+                resource_url = resource.get(url_keyname) or ''
+                if resource_url.find(config.x_uploaded_resource_path) != -1:
+                    return constants.ResourceType.TYPE_UPLOAD
+                if resource_url.find(config.x_uploaded_datastore_path) != -1:
+                    return constants.ResourceType.TYPE_DATASTORE
+                return constants.ResourceType.TYPE_URL
+            return get_resource_type
+
+        def get_resource_value(resource, lfd_nr):
+            try:
+                return resource[rc_key]
+            except KeyError:
+                logging.error(_('Resource Key "%s" nicht gefunden: %s'), rc_key, resource)
+                return ""
+        return get_resource_value
+
+
+    def compile_detailed_resource_extractor(self, resource_column):
+        rc_key = resource_column.key
+        if resource_column.kind == constants.ColumnKind.PATH:
+            return lambda resource_node, resource_url_info: resource_column.accessor(resource_node)
+        if resource_column.kind == constants.ColumnKind.TID_REF:
+            return lambda resource_node, resource_url_info: self.format_taxonomy_terms(
+                resource_column.accessor(resource_node), resource_column.taxonomy)
+        if rc_key == 'RTYPE_DETAILED':
+            return lambda resource_node, resource_url_info: resource_url_info[0]
+        if rc_key == 'RPATH':
+            return lambda resource_node, resource_url_info: resource_url_info[1]
+
+        def get_node_value(resource_node, resource_url_info):
+            try:
+                return resource_node[rc_key]
+            except (KeyError, TypeError):
+                logging.error(_('Detailled Key "%s" nicht gefunden in Node %s'), rc_key, resource_node.get('nid') if isinstance(resource_node, dict) else resource_node)
+                return ""
+        return get_node_value
+
+
+    @staticmethod
+    def get_package_extras(package_data):
+        """ Extras of the package as dict key => value, the first value wins if a key is used twice """
+        extras = {}
+        for extra in package_data.get('extras', []):
+            extras.setdefault(extra['key'], extra['value'])
+        return extras
+
+
+    def convert_dkan_data_to_excel_row_hash(self, package_data, dkan_node, skip_resources, resource_nodes=None, dataset_nr=None):
+        """ Convert the package and its resources to excel rows.
+            resource_nodes can contain already fetched resource nodes by resource package id.
+            dataset_nr is used for the "Lfd-Nr" of the resources, default is the current dataset number. """
+        #logging.debug("package_data %s", package_data)
+        #logging.debug("dkan_node %s", dkan_node)
+
+        # the config of which excel columns are mapped to which dkan json keys is compiled to extractors once
+        extras = self.get_package_extras(package_data)
+        columns = {
+            column_name: extractor(package_data, dkan_node, extras)
+            for column_name, extractor in self.get_extraction_plan()}
 
         # write package_data row without resources
         if (skip_resources) or ('resources' not in package_data):
@@ -285,64 +427,27 @@ class ExcelResultFile:
 
         # write resource rows
         else:
+            resource_plan, detailed_plan = self.get_resource_extraction_plan()
             all_the_rows = []
             for resource_number, resource in enumerate(package_data['resources']):
                 resource_package_id = resource['id']
-                resource_row = {}
-                lfd_nr = '{0:03d}'.format(self.current_dataset_nr) + '-' + '{0:02d}'.format(resource_number+1)
+                lfd_nr = '{0:03d}'.format(dataset_nr or self.current_dataset_nr) + '-' + '{0:02d}'.format(resource_number+1)
 
-                if (config.resources_download) and ("url" in resource):
-                    dkanhelpers.HttpHelper.download_resource(resource['url'], lfd_nr, resource['format'])
+                # the file is downloaded in the background, while the rows are written
+                if (self.downloader) and ("url" in resource):
+                    self.downloader.submit(resource['url'], lfd_nr, resource['format'])
 
                 # get all resource fields according to resource column config
-                for column_name, rc_key in constants.get_column_config_resource().items():
-                    rc_value = ""
-                    if rc_key == 'lfd-nr':
-                        rc_value = lfd_nr
-
-                    elif rc_key == 'RTYPE':
-                        rc_value = constants.ResourceType.TYPE_URL
-                        url_keyname = constants.get_column_config_resource()[constants.Resource.URL]
-                        if isinstance(url_keyname, list):
-                            raise AbortProgramError(_('Unerwarteter Knotentyp "Liste".'))
-                        if url_keyname in resource:
-                            if resource[url_keyname].find(config.x_uploaded_resource_path) != -1:
-                                rc_value = constants.ResourceType.TYPE_UPLOAD
-                            elif resource[url_keyname].find(config.x_uploaded_datastore_path) != -1:
-                                rc_value = constants.ResourceType.TYPE_DATASTORE
+                resource_row = {column_name: extractor(resource, lfd_nr) for column_name, extractor in resource_plan}
 
+                if detailed_plan:
+                    if resource_nodes and (resource_package_id in resource_nodes):
+                        resource_node = resource_nodes[resource_package_id]
                     else:
-                        try:
-                            rc_value = resource[rc_key]
-                        except KeyError:
-                            logging.error(_('Resource Key "%s" nicht gefunden: %s'), rc_key, resource)
-
-                    resource_row[column_name] = rc_value
-
-                if config.detailed_resources:
-                    resource_node_id = DkanApiAccess.get_node_id_for_package_id(resource_package_id)
-                    resource_node = dkanhelpers.HttpHelper.read_dkan_node(resource_node_id)
-                    for column_name, rc_key in constants.get_column_config_resource_detailed().items():
-                        rc_value = ""
-                        if isinstance(rc_key, list):
-                            rc_value = dkanhelpers.JsonHelper.get_nested_json_value(resource_node, rc_key)
-
-                        elif rc_key[:7] == 'TID_REF':
-                            rc_value = self.handle_tid_ref(resource_node, rc_key)
-
-                        elif rc_key == 'RTYPE_DETAILED':
-                            (rc_value, my_tempvalue) = dkanhelpers.JsonHelper.get_resource_url(resource_node)
-
-                        elif rc_key == 'RPATH':
-                            (my_tempvalue, rc_value) = dkanhelpers.JsonHelper.get_resource_url(resource_node)
-
-                        else:
-                            try:
-                                rc_value = resource_node[rc_key]
-                            except KeyError:
-                                logging.error(_('Detailled Key "%s" nicht gefunden: %s'), rc_key, resource)
-
-                        resource_row[column_name] = rc_value
+                        resource_node = DkanApiAccess.read_resource_node(resource_package_id)
+                    resource_url_info = dkanhelpers.JsonHelper.get_resource_url(resource_node)
+                    for column_name, extractor in detailed_plan:
+                        resource_row[column_name] = extractor(resource_node, resource_url_info)
 
 
                 logging.debug(_(
@@ -359,14 +464,24 @@ class ExcelResultFile:
             return all_the_rows
 
 
-    def add_dataset(self, package_data, dkan_node):
-        self.current_dataset_nr += 1
-        rows = self.convert_dkan_data_to_excel_row_hash(package_data, dkan_node, config.skip_resources)
+    def add_dataset(self, package_data, dkan_node, resource_nodes=None):
+        """ A dataset of the old excel file that was marked by rewrite_dataset replaces its old rows,
+            at the same position and with the same "Lfd-Nr" (so the downloaded files keep their names).
+            These datasets have to be added in the order of the excel file and before the new datasets. """
+        dataset_nr = self.rewritable_datasets.get(package_data['id'])
+        if dataset_nr:
+            self.write_old_rows(package_data['id'])
+            del self.rewritable_datasets[package_data['id']]
+        else:
+            self.write_old_rows()
+            self.current_dataset_nr += 1
+            dataset_nr = self.current_dataset_nr
+        rows = self.convert_dkan_data_to_excel_row_hash(package_data, dkan_node, config.skip_resources, resource_nodes, dataset_nr)
         if rows:
             row = rows[0]
             logging.info(
                 _('Datensatz %s hinzufügen: "%s"'),
-                self.current_dataset_nr,
+                dataset_nr,
                 row[constants.Dataset.TITLE] if constants.Dataset.TITLE in row else 'Kein Titel')
 
         for row in rows:
@@ -378,6 +493,7 @@ class ExcelResultFile:
 
 
     def finish(self):
+        self.write_old_rows()
         self.workbook.close()
 
 
@@ -386,6 +502,11 @@ class DkanApiAccess:
 
     @staticmethod
     def get_node_id_for_package_id(package_id):
+        node_id = dkanhelpers.NodeIdIndex.get_node_id(package_id)
+        if node_id:
+            return node_id
+
+        # not in the index (e.g. created after the index was read)
         temp_url = config.x_api_find_node_id.format(package_id)
         node_search = dkanhelpers.HttpHelper.read_remote_json_with_cache(temp_url, '{}.json'.format(package_id))
         if not node_search:
@@ -393,10 +514,27 @@ class DkanApiAccess:
             return None
 
         if node_search[0]['nid']:
+            dkanhelpers.NodeIdIndex.add(package_id, node_search[0]['nid'])
             return node_search[0]['nid']
         return None
 
 
+    @staticmethod
+    def invalidate_package_nodes(package_data):
+        ''' Remove the dataset and resource nodes of the package from the cache '''
+        package_ids = [package_data['id']] + [resource['id'] for resource in package_data.get('resources', [])]
+        for package_id in package_ids:
+            node_id = dkanhelpers.NodeIdIndex.get_node_id(package_id)
+            if node_id:
+                dkanhelpers.HttpHelper.invalidate_dkan_node(node_id)
+
+
+    @staticmethod
+    def read_resource_node(resource_package_id):
+        resource_node_id = DkanApiAccess.get_node_id_for_package_id(resource_package_id)
+        return dkanhelpers.HttpHelper.read_dkan_node(resource_node_id)
+
+
     @staticmethod
     def log_api_error_infos(url):
         logging.error(' ----- ')
@@ -409,18 +547,13 @@ class DkanApiAccess:
 
 
     def get_resource_http_status(self, url):
-        try:
-            htl = httplib2.Http(".cache", disable_ssl_certificate_validation=True)
-            resp = htl.request(url, 'HEAD')
-        except:
-            e = sys.exc_info()
-            logging.exception("Error during resource load")
-            return (False, str(e[0]) + " " + str(e[1]))
-
-        return (int(resp[0]['status']) < 400), resp[0]['status']
+        # shared with the link checker, urls that were checked recently are not requested again
+        return linkstatus.get_http_status(url)
 
 
     def validateJson(self, jsonData, check_schema):
+        from jsonschema import validate
+        from jsonschema.exceptions import ValidationError
         try:
             validate(instance=jsonData, schema=check_schema)
         except ValidationError as err:
@@ -455,8 +588,8 @@ class DkanApiAccess:
         return node_data
 
 
-    def read_remote_json_with_cache(self, remote_url, temp_file):
-        return dkanhelpers.HttpHelper.read_remote_json_with_cache(remote_url, temp_file)
+    def read_remote_json_with_cache(self, remote_url, temp_file, ttl=None):
+        return dkanhelpers.HttpHelper.read_remote_json_with_cache(remote_url, temp_file, ttl)
 
 
     def add_extras_from_package(self, extras, package_data):
@@ -472,7 +605,8 @@ class DkanApiAccess:
     def read_single_package(self, package_id):
         result = self.read_remote_json_with_cache(
             config.api_package_details + package_id + '&cachebuster={}'.format(random()),
-            'package_details_{}.json'.format( package_id )
+            'package_details_{}.json'.format( package_id ),
+            config.x_cache_ttl_nodes
             )
         return result["result"][0]
 
@@ -484,13 +618,18 @@ class DkanApiAccess:
         return self.read_remote_json_with_cache(
             config.api_resource_list + '&cacheBuster={}'.format(random()),
             'current_package_list_with_resources{}.json'.format( hashlib.md5(config.api_resource_list.encode()).hexdigest()
-            )
+            ),
+            config.x_cache_ttl_package_list
         )
 
 
 class Dkan2Excel:
     ''' Read from DKAN, write to excel file '''
 
+    # package modification state of the last export, see package_watermark()
+    watermarks = {}
+    changed_package_ids = set()
+
     def showConfigVars(self):
         ''' print all config variables '''
         for item in dir(config):
@@ -507,6 +646,143 @@ class Dkan2Excel:
         return extras
 
 
+    @staticmethod
+    def package_watermark(package_data):
+        ''' Value that changes whenever the package or its list of resources was modified '''
+        resources = ['{}:{}'.format(resource.get('id', ''), resource.get('revision_id', '')) for resource in package_data.get('resources', [])]
+        return '|'.join([package_data.get('metadata_modified', '')] + resources)
+
+
+    @staticmethod
+    def get_watermark_filename(excel_filename):
+        return os.path.splitext(excel_filename)[0] + '.watermarks.json'
+
+
+    def read_watermarks(self, excel_filename):
+        watermark_file = self.get_watermark_filename(excel_filename)
+        try:
+            with open(watermark_file, mode='r', encoding='utf-8') as json_data:
+                content = json.load(json_data)
+        except FileNotFoundError:
+            return {}
+        except ValueError as err:
+            logging.warning(_("Datei %s kann nicht gelesen werden: %s"), watermark_file, err)
+            return {}
+
+        if content.get('dkan_url') != config.dkan_url:
+            logging.info(_("%s gehört zu einer anderen DKAN-Instanz und wird ignoriert."), watermark_file)
+            return {}
+        return content.get('packages', {})
+
+
+    def save_watermarks(self, excel_filename, watermarks):
+        watermark_file = self.get_watermark_filename(excel_filename)
+        logging.debug(_("Speichere Änderungsstand von %s Datensätzen: %s"), len(watermarks), watermark_file)
+        partial_file = '{}.{}.part'.format(watermark_file, threading.get_ident())
+        with open(partial_file, mode='w', encoding='utf-8') as fw:
+            json.dump({'dkan_url': config.dkan_url, 'packages': watermarks}, fw, indent=1)
+        os.replace(partial_file, watermark_file)
+
+
+    def select_packages(self, dkanApi, packages, existing_dataset_ids, dataset_query):
+        ''' Yield all packages that should be written to the excel file '''
+        for package_data in packages:
+
+            isValid = dkanApi.validateJson(package_data, constants.datasetSchema)
+            if not isValid:
+                raise ValueError('Dataset format is not valid. Scroll up, see detailed error above')
+
+            dataset_id = package_data['id']
+            if dataset_query and (dataset_query.find(dataset_id) == -1):
+                logging.debug(_("%s nicht in %s"), dataset_id, dataset_query)
+                continue
+            elif dataset_query:
+                logging.info(_("Datensatz gefunden: %s"), dataset_id)
+
+            if (config.incremental_export or not config.overwrite_rows) and (dataset_id in existing_dataset_ids):
+                logging.info(_("Bereits im Excel. Überspringe %s"), dataset_id)
+                continue
+
+            if package_data['type'] != 'Dataset':
+                logging.debug(_("Objekt ist kein 'Dataset'. Überspringe %s"), dataset_id)
+                continue
+
+            yield package_data
+
+
+    def prefetch_package_details(self, dkanApi, packages):
+        ''' Yield (package_data, node_data, resource_nodes) in the order of the packages.
+            The details of up to x_prefetch_packages packages are fetched at the same time,
+            their log messages are written when the package is yielded. '''
+        prefetch = max(1, config.x_prefetch_packages)
+        with dkanhelpers.OrderedLogBuffer() as log_buffer, ThreadPoolExecutor(max_workers=prefetch) as pool:
+            window = deque()
+            for package_data in packages:
+                window.append((package_data, log_buffer.submit(pool, self.fetch_package_details, dkanApi, package_data)))
+                if len(window) > prefetch:
+                    yield self.collect_package_details(log_buffer, *window.popleft())
+            while window:
+                yield self.collect_package_details(log_buffer, *window.popleft())
+
+
+    def collect_package_details(self, log_buffer, package_data, job):
+        node_data, resource_nodes = log_buffer.wait_in_order([job])[0]
+        return package_data, node_data, resource_nodes
+
+
+    def fetch_package_details(self, dkanApi, package_data):
+        ''' Read everything from DKAN that is needed for the excel rows of the package.
+            Returns the dataset node and a dict with the detailed resource nodes by resource id '''
+
+        node_data = None
+        resource_nodes = {}
+
+        # cached nodes of a package that changed since the last export are outdated
+        if package_data['id'] in self.changed_package_ids:
+            DkanApiAccess.invalidate_package_nodes(package_data)
+
+        # Sadly all the api endpoints with a list of datasets have missing data
+        # That is why we have to make two extra calls per package_data.  .. maybe there is another way..?
+        if config.x_download_extended_dataset_infos:
+            node_data = dkanApi.readDatasetNodeJson(package_data['id'], None)
+
+        # http-check package_data resources and add check result into nested resource list
+        if (not config.skip_resources) and ('resources' in package_data):
+            for index, resource in enumerate(package_data['resources']):
+                ok = response_code = resource_node = None
+                resource_url = resource['url']
+
+                if (not resource_url):
+                    logging.warn("Empty resource URL")
+                else:
+                    # fix the known dkan problems with urls in ckan api:
+                    #   * html tags inside/before url
+                    #   * double encoded ampersands
+                    if (not resource_url.lower().startswith("http")) or (resource_url.lower().find("amp;") != -1):
+                        logging.warn("Unexpected CKAN resource URL. Re-loading via DKAN API.. %s", resource_url)
+                        resource_node = DkanApiAccess.read_resource_node(resource['id'])
+                        resource_nodes[resource['id']] = resource_node
+                        (my_resource_type, fixed_resource_url) = dkanhelpers.JsonHelper.get_resource_url(resource_node)
+                        resource_url = fixed_resource_url
+                        logging.warn("Dkan Resource Url: %s %s", my_resource_type, fixed_resource_url)
+
+                        # Fix Resouce url in ckan data array
+                        package_data['resources'][index]['url'] = fixed_resource_url
+
+                    if config.check_resources:
+                        logging.debug("Check: %s", resource_url)
+                        (ok, response_code) = dkanApi.get_resource_http_status(resource_url)
+                        logging.debug("Response: %s %s", ok, response_code)
+
+                package_data['resources'][index]['response_ok'] = ok
+                package_data['resources'][index]['response_code'] = response_code
+
+                if config.detailed_resources and (resource['id'] not in resource_nodes):
+                    resource_nodes[resource['id']] = DkanApiAccess.read_resource_node(resource['id'])
+
+        return node_data, resource_nodes
+
+
     def run(self, command_line_excel_filename):
         try:
             excel_filename = command_line_excel_filename if command_line_excel_filename else config.excel_filename
@@ -519,12 +795,7 @@ class Dkan2Excel:
             logging.info("Anzahl Datensätze im DKAN: %s", number_of_datasets)
 
             extra_columns = self.read_all_extra_fields_from_dkan(dkanApi, data)
-
-            excel_file = ExcelResultFile(excel_filename, extra_columns)
-            excel_file.initialize_new_excel_file_with_existing_content()
-
-            existing_dataset_ids = excel_file.get_existing_dataset_ids()
-            nr_of_changes = 0
+            dkanhelpers.ReferenceData.load()
 
             limit = 100000
             dataset_query = config.dataset_ids
@@ -534,75 +805,72 @@ class Dkan2Excel:
                 logging.info(_("Beschränkung per 'Limit'-Query auf %s Datensätze."), limit)
                 dataset_query = dataset_query.replace(match.group(0), '')
 
-            # write all datasets and resources to excel file
-            for package_data in data['result'][0]:
-
-                isValid = dkanApi.validateJson(package_data, constants.datasetSchema)
-                if not isValid:
-                    raise ValueError('Dataset format is not valid. Scroll up, see detailed error above')
-
-                dataset_id = package_data['id']
-                if dataset_query and (dataset_query.find(dataset_id) == -1):
-                    logging.debug(_("%s nicht in %s"), dataset_id, dataset_query)
-                    continue
-                elif dataset_query:
-                    logging.info(_("Datensatz gefunden: %s"), dataset_id)
-
-                if (not config.overwrite_rows) and (dataset_id in existing_dataset_ids):
-                    logging.info(_("Bereits im Excel. Überspringe %s"), dataset_id)
-                    continue
-
-                if package_data['type'] != 'Dataset':
-                    logging.debug(_("Objekt ist kein 'Dataset'. Überspringe %s"), dataset_id)
-                    continue
-
-                node_data = None
-                # Sadly all the api endpoints with a list of datasets have missing data
-                # That is why we have to make two extra calls per package_data.  .. maybe there is another way..?
-                if config.x_download_extended_dataset_infos:
-                    node_data = dkanApi.readDatasetNodeJson(dataset_id, None)
-
-                # http-check package_data resources and add check result into nested resource list
-                if (not config.skip_resources) and ('resources' in package_data):
-                    for index, resource in enumerate(package_data['resources']):
-                        ok = response_code = resource_node = None
-                        resource_url = resource['url']
-
-                        if (not resource_url):
-                            logging.warn("Empty resource URL")
-                        else:
-                            # fix the known dkan problems with urls in ckan api:
-                            #   * html tags inside/before url
-                            #   * double encoded ampersands
-                            if (not resource_url.lower().startswith("http")) or (resource_url.lower().find("amp;") != -1):
-                                logging.warn("Unexpected CKAN resource URL. Re-loading via DKAN API.. %s", resource_url)
-                                resource_node_id = DkanApiAccess.get_node_id_for_package_id(resource['id'])
-                                resource_node = dkanhelpers.HttpHelper.read_dkan_node(resource_node_id)
-                                (my_resource_type, fixed_resource_url) = dkanhelpers.JsonHelper.get_resource_url(resource_node)
-                                resource_url = fixed_resource_url
-                                logging.warn("Dkan Resource Url: %s %s", my_resource_type, fixed_resource_url)
-
-                                # Fix Resouce url in ckan data array
-                                package_data['resources'][index]['url'] = fixed_resource_url
-
-                            if config.check_resources:
-                                logging.debug("Check: %s", resource_url)
-                                (ok, response_code) = dkanApi.get_resource_http_status(resource_url)
-                                logging.debug("Response: %s %s", ok, response_code)
-
-                        package_data['resources'][index]['response_ok'] = ok
-                        package_data['resources'][index]['response_code'] = response_code
-
-                excel_file.add_dataset(package_data, node_data)
-                nr_of_changes += 1
-                if nr_of_changes >= limit:
-                    logging.info(_("Limit von %s erreicht"), limit)
-                    break
-
-
-            excel_file.finish()
+            # compare with the package state of the last export
+            self.watermarks = self.read_watermarks(excel_filename)
+            current_watermarks = {package_data['id']: self.package_watermark(package_data) for package_data in data['result'][0]}
+            self.changed_package_ids = {
+                package_id for package_id, watermark in current_watermarks.items()
+                if self.watermarks.get(package_id) != watermark}
+
+            keep_dataset = None
+            rewrite_dataset = None
+            if config.incremental_export:
+                logging.info(_("Inkrementeller Export: %s von %s Datensätzen sind neu oder geändert."), len(self.changed_package_ids), number_of_datasets)
+                # drop the rows of deleted datasets, changed datasets keep their rows until they are written again
+                keep_dataset = lambda dataset_id: dataset_id in current_watermarks
+                rewrite_dataset = lambda dataset_id: dataset_id in self.changed_package_ids
+
+            excel_file = ExcelResultFile(excel_filename, extra_columns)
+            excel_file.initialize_new_excel_file_with_existing_content(keep_dataset, rewrite_dataset)
+
+            existing_dataset_ids = excel_file.get_existing_dataset_ids()
+            # all datasets of the old file, that are still in it if they are not written again (e.g. because of the limit)
+            old_dataset_ids = list(existing_dataset_ids) + list(excel_file.rewritable_datasets)
+            # changed datasets are written at their old position, so they come first and in the order of the excel file
+            positions = {dataset_id: position for position, dataset_id in enumerate(excel_file.rewritable_datasets)}
+            package_list = sorted(data['result'][0], key=lambda package_data: positions.get(package_data['id'], len(positions)))
+            nr_of_changes = 0
+            written_dataset_ids = []
+
+            if config.resources_download:
+                excel_file.downloader = resourcedownload.ResourceDownloader(config.download_dir)
+
+            # with a dataset query the number of datasets is only known at the end
+            total = None
+            if not dataset_query:
+                total = min(limit, len(self.changed_package_ids) if config.incremental_export else number_of_datasets)
+            export_progress = progress.start(_('Export'), total, _('Datensätze'))
+            try:
+                # write all datasets and resources to excel file
+                # the details of the next packages are fetched in the background, while the current rows are written
+                packages = self.select_packages(dkanApi, package_list, existing_dataset_ids, dataset_query)
+                packages = itertools.islice(packages, limit)   # dont prefetch packages beyond the limit
+                for package_data, node_data, resource_nodes in self.prefetch_package_details(dkanApi, packages):
+                    excel_file.add_dataset(package_data, node_data, resource_nodes)
+                    written_dataset_ids.append(package_data['id'])
+                    export_progress.advance()
+                    nr_of_changes += 1
+                    if nr_of_changes >= limit:
+                        logging.info(_("Limit von %s erreicht"), limit)
+                        break
+
+                excel_file.finish()
+            finally:
+                export_progress.finish()
+                # also after errors, so the finished downloads are in the manifest
+                if excel_file.downloader:
+                    excel_file.downloader.finish()
+
+            # rows that were kept from the old excel file keep their old state
+            new_watermarks = {dataset_id: self.watermarks[dataset_id] for dataset_id in old_dataset_ids if dataset_id in self.watermarks}
+            new_watermarks.update({dataset_id: current_watermarks[dataset_id] for dataset_id in written_dataset_ids})
+            self.save_watermarks(excel_filename, new_watermarks)
+
             logging.info("")
             logging.info(_('Vorgang abgeschlossen, %s Datensätze nach Excel geschrieben.'), nr_of_changes)
+            responsecache.get_cache().log_statistics()
+            if config.check_resources:
+                linkstatus.get_store().log_statistics()
 
         except AbortProgramError as err:
             logging.error(err.message)
@@ -778,26 +1046,23 @@ def print_excel_status(command_line_excel_filename):
 
     logging.info(_(" Dateiname: %s"), excel_filename)
     logging.info(_(" Absoluter Pfad: %s"), os.path.abspath(excel_filename))
-    loc = (excel_filename)
 
     try:
-        wb = xlrd.open_workbook(loc)
+        excel_rows = ExcelRowReader(excel_filename)
     except FileNotFoundError:
         logging.warning(" Datei existiert noch nicht, es können keine Informationen zur Excel-Datei ausgegben werden.")
         return
 
-    sheet = wb.sheet_by_index(0)
-    sheet.cell_value(0, 0)
+    # count the rows only if the file does not tell, otherwise the rows are not read
+    try:
+        nrows = excel_rows.nrows if excel_rows.nrows else 1 + sum(1 for _row in excel_rows.rows())
+    finally:
+        excel_rows.close()
 
     used_fields = {}
-    columns = []
-    logging.info(_(" Datei hat %s Zeilen."), sheet.nrows)
+    logging.info(_(" Datei hat %s Zeilen."), nrows)
     logging.info(_(" Gefundene Spaltenüberschriften der Excel-Datei:"))
-    for i in range(sheet.ncols):
-
-        column_name = sheet.cell_value(0, i)
-        columns.append(column_name)
-
+    for column_name in excel_rows.columns:
         if column_name in dkan_fields:
             used_fields[column_name] = 1
             logging.info(" o %s", column_name)
@@ -0,0 +1,239 @@
+"""Streaming upload of resource files to DKAN
+
+pydkan reads the whole file into memory before it is sent. Here the multipart body is
+generated while it is sent, so only one chunk of the file is in memory at a time,
+and the progress is reported after every chunk.
+Files whose content was already uploaded to the resource are skipped (see UploadManifest).
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from timeit import default_timer as timer
+from . import config
+from . import transport
+from . import progress as progress_jobs
+
+CRLF = b'\r\n'
+
+_manifest = None
+_manifest_lock = threading.Lock()
+_fallback_warned = False
+
+
+class MultipartFileBody:
+    """ multipart/form-data body with some form fields and one file, read in chunks while it is sent.
+
+        The length is known in advance, so requests sends a Content-Length header instead of a chunked body.
+        progress(bytes_sent, total) is called after every chunk of the file.
+    """
+
+    def __init__(self, filename, file_field, fields, progress=None):
+        self.filename = filename
+        self.boundary = uuid.uuid4().hex
+        self.progress = progress
+        self.file_size = os.path.getsize(filename)
+
+        head = b''
+        for name, value in fields.items():
+            head += self._part_header('name="{}"'.format(name)) + str(value).encode('utf-8') + CRLF
+        head += self._part_header(
+            'name="{}"; filename="{}"'.format(file_field, os.path.basename(filename)),
+            'Content-Type: application/octet-stream')
+        self.head = head
+        self.tail = CRLF + b'--' + self.boundary.encode('ascii') + b'--' + CRLF
+
+
+    def _part_header(self, disposition, *headers):
+        lines = [b'--' + self.boundary.encode('ascii'), ('Content-Disposition: form-data; ' + disposition).encode('utf-8')]
+        lines += [header.encode('ascii') for header in headers]
+        return CRLF.join(lines) + CRLF + CRLF
+
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=' + self.boundary
+
+
+    def __len__(self):
+        return len(self.head) + self.file_size + len(self.tail)
+
+
+    def __iter__(self):
+        yield self.head
+        sent = 0
+        with open(self.filename, mode='rb') as source:
+            for chunk in iter(lambda: source.read(config.x_upload_chunk_size), b''):
+                yield chunk
+                sent += len(chunk)
+                if self.progress:
+                    self.progress(sent, self.file_size)
+        yield self.tail
+
+
+class ProgressLogger:
+    """ Progress callback that writes a log message every 10 percent,
+        the bytes are also added to the progress of the running upload """
+
+    def __init__(self, name):
+        self.name = name
+        self.next_percent = 10
+        self.start = timer()
+        self.bytes_sent = 0
+        self.job = progress_jobs.get('upload')
+
+
+    def __call__(self, bytes_sent, total):
+        if self.job:
+            self.job.advance(0, nbytes=bytes_sent - self.bytes_sent)
+        self.bytes_sent = bytes_sent
+        percent = 100 * bytes_sent // total if total else 100
+        if percent >= self.next_percent:
+            elapsed = timer() - self.start
+            logging.info(_("  Upload %s: %s%% (%.1f von %.1f MB, %.1f MB/s)"),
+                self.name, percent, bytes_sent / 1024 / 1024, total / 1024 / 1024,
+                bytes_sent / 1024 / 1024 / elapsed if elapsed else 0)
+            self.next_percent = (percent // 10 + 1) * 10
+
+
+def attach_file_to_node(api, filename, node_id, field='field_upload', progress=None):
+    """ Upload the file to the file field of the node, with the logged in session of the pydkan client api.
+
+        Same request as DatasetAPI.attach_file_to_node, but streamed.
+        Every thread uses its own api session (see dkanhandler.currentApi), so several uploads can run at once.
+    """
+    global _fallback_warned
+    session, login = get_login(api)
+    if not session:
+        # pydkan keeps its login in unknown attributes (another version than in requirements.txt)
+        if not _fallback_warned:
+            _fallback_warned = True
+            logging.warning(_("Login von pydkan nicht gefunden, Dateien werden ohne Streaming hochgeladen "
+                "(ganze Datei im Speicher, ohne Fortschrittsanzeige). Bitte pydkan-Version prüfen."))
+        logging.debug(_("Kein Streaming-Upload möglich, nutze pydkan: %s"), filename)
+        return api.attach_file_to_node(filename, node_id, field)
+
+    if progress is None:
+        progress = ProgressLogger(os.path.basename(filename))
+    body = MultipartFileBody(filename, 'files[file]', {'field_name': field, 'attach': 0}, progress)
+    headers = dict(login.pop('headers', {}))
+    headers.update({'Content-Type': body.content_type, 'Content-Length': str(len(body))})
+    return session.post(
+        config.dkan_url + config.x_api_attach_file.format(node_id),
+        data=body,
+        headers=headers,
+        timeout=(config.x_http_connect_timeout, config.x_upload_read_timeout),
+        verify=False,
+        **login)
+
+
+def get_login(api):
+    """ Return a requests session and the login arguments (cookies, CSRF token header) of the pydkan client,
+        for requests with arguments pydkan does not pass on (streamed body, verify=False per request).
+        Depending on the pydkan version, the login is kept in a requests session or in cookies and headers. """
+    session = getattr(api, 'session', None)
+    if session is not None:
+        return session, {}
+    if hasattr(api, 'cookies'):
+        headers = {name: value for name, value in getattr(api, 'headers', {}).items() if name.lower() != 'content-type'}
+        return transport.get_session(), {'cookies': api.cookies, 'headers': headers}
+    return None, {}
+
+
+class UploadManifest:
+    """ SHA-256 checksums of the files that were uploaded to the resource nodes, stored in the download directory.
+
+        A file is only uploaded again if its content differs from the last upload to the node.
+        Checksums are only calculated again if size or modification time of the file changed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.nodes = self.read()
+        # checksums by file path, so unchanged files are not read again
+        self._checksums = {
+            entry['path']: (entry['size'], entry['mtime_ns'], entry['sha256']) for entry in self.nodes.values()}
+
+
+    def read(self):
+        try:
+            with open(self.filename, mode='r', encoding='utf-8') as json_data:
+                content = json.load(json_data)
+        except FileNotFoundError:
+            return {}
+        except ValueError as err:
+            logging.warning(_("Datei %s kann nicht gelesen werden: %s"), self.filename, err)
+            return {}
+
+        if content.get('dkan_url') != config.dkan_url:
+            logging.info(_("%s gehört zu einer anderen DKAN-Instanz und wird ignoriert."), self.filename)
+            return {}
+        return content.get('nodes', {})
+
+
+    def save(self):
+        # the lock is held while writing, so concurrent uploads can not overwrite newer content
+        with self._lock:
+            temp_file = self.filename + '.tmp'
+            with open(temp_file, mode='w', encoding='utf-8') as fw:
+                json.dump({'dkan_url': config.dkan_url, 'nodes': self.nodes}, fw, indent=1, sort_keys=True)
+            os.replace(temp_file, self.filename)
+
+
+    def get_checksum(self, path):
+        """ Return (size, mtime_ns, sha256) of the file """
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._checksums.get(path)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached
+
+        checksum = hashlib.sha256()
+        with open(path, mode='rb') as source:
+            for chunk in iter(lambda: source.read(config.x_upload_chunk_size), b''):
+                checksum.update(chunk)
+        result = (stat.st_size, stat.st_mtime_ns, checksum.hexdigest())
+        with self._lock:
+            self._checksums[path] = result
+        return result
+
+
+    def is_uploaded(self, node_id, path, remote_size=None):
+        """ True if the same content was uploaded to the node before.
+            remote_size is the size of the file in DKAN, if it differs the file was changed in DKAN. """
+        with self._lock:
+            entry = self.nodes.get(str(node_id))
+        if not entry:
+            return False
+        size, _mtime_ns, sha256 = self.get_checksum(path)
+        if remote_size is not None and str(remote_size) != str(size):
+            logging.debug(_("Dateigröße im DKAN (%s) weicht ab von %s"), remote_size, size)
+            return False
+        return entry['sha256'] == sha256
+
+
+    def record(self, node_id, path):
+        size, mtime_ns, sha256 = self.get_checksum(path)
+        with self._lock:
+            self.nodes[str(node_id)] = {
+                'path': path,
+                'size': size,
+                'mtime_ns': mtime_ns,
+                'sha256': sha256,
+                'uploaded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+        self.save()
+
+
+def get_upload_manifest():
+    """ The manifest of the current download directory """
+    global _manifest
+    filename = os.path.join(os.path.normpath(config.download_dir), config.x_upload_manifest)
+    with _manifest_lock:
+        if not _manifest or _manifest.filename != filename:
+            _manifest = UploadManifest(filename)
+        return _manifest
@@ -3,10 +3,18 @@
 import re
 import sys
 import logging
-import xlrd
-import httplib2
+import threading
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from . import config
 from . import constants
+from . import linkstatus
+from . import progress
+from .excelrows import ExcelRowReader
+
+URL_REGEX = re.compile(r"((http|https)\:\/\/[a-zA-Z0-9\.\/\?\:@\-_=#]+\.([a-zA-Z]){2,6}([a-zA-Z0-9\.\&\/\?\:@\-_=#])*)", re.MULTILINE|re.UNICODE)
 
 def check_links(command_line_excel_filename):
     er = LinkChecker()
@@ -15,36 +23,44 @@ def check_links(command_line_excel_filename):
 
 class LinkChecker:
 
-    def getHttpStatus(self, url):
-        try:
-            htl = httplib2.Http(".cache", disable_ssl_certificate_validation=True)
-            resp = htl.request(url, 'HEAD')
-        except:
-            e = sys.exc_info()
-            logging.exception("Error during resource load")
-            return (False, str(e[0]) + " " + str(e[1]))
+    def __init__(self):
+        self._host_limits = {}
+        self._host_limits_lock = threading.Lock()
+        self.progress = None
 
-        return (int(resp[0]['status']) < 400), resp[0]['status']
 
+    def getHttpStatus(self, url):
+        # urls that were checked recently are not requested again
+        ok, status = linkstatus.get_http_status(url, self.getHostLimit(url))
+        if self.progress:
+            self.progress.advance(failed=0 if ok else 1)
+        return ok, status
 
-    def checkAllLinksInExcelFile(self, excel_filename):
 
-        logging.info(_("Excel Datei wird eingelesen: %s"), excel_filename)
-        loc = (excel_filename)
+    def getHostLimit(self, url):
+        """Semaphore that limits the number of concurrent requests to the host of the url"""
+        host = urlsplit(url).netloc.lower()
+        with self._host_limits_lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(config.x_linkcheck_host_connections)
+            return self._host_limits[host]
 
-        wb = xlrd.open_workbook(loc)
-        sheet = wb.sheet_by_index(0)
-        sheet.cell_value(0, 0)
 
-        URL_REGEX = re.compile(r"((http|https)\:\/\/[a-zA-Z0-9\.\/\?\:@\-_=#]+\.([a-zA-Z]){2,6}([a-zA-Z0-9\.\&\/\?\:@\-_=#])*)", re.MULTILINE|re.UNICODE)
+    def findLinks(self, excel_filename):
+        """Return all urls of the excel file as list of (row_nr, row_name, column_name, url), in row order"""
+        excel_rows = ExcelRowReader(excel_filename)
 
-        for row_nr in range(1, sheet.nrows):
+        # the second column contains the name of the row
+        name_column = excel_rows.columns[1] if len(excel_rows.columns) > 1 else None
+        checked_columns = [column_name for column_name in excel_rows.columns
+            if column_name not in ("Resource-Url", "Resource-Path")]
 
-            for i in range(sheet.ncols):
-                column_name = sheet.cell_value(0, i)
-                if column_name == "Resource-Url" or column_name == "Resource-Path":
-                    continue
-                column_value = str(sheet.cell_value(row_nr, i))
+        links = []
+        for row_nr, row in excel_rows.rows():
+            row_name = row.get(name_column, '')
+
+            for column_name in checked_columns:
+                column_value = str(row[column_name])
                 if not column_value:
                     continue
 
@@ -56,14 +72,47 @@ class LinkChecker:
                     logging.exception("Error message: %s", str(e[0]) + " " + str(e[1]))
                     continue
 
-                if (url_match):
-                    row_name = sheet.cell_value(row_nr, 1)
+                for m in url_match:
+                    links.append((row_nr, row_name, column_name, m[0]))
+        return links
+
+
+    @staticmethod
+    def interleaveHosts(urls):
+        """Order the urls so that consecutive urls belong to different hosts, then the workers
+        do not have to wait for each other because of the per host limit"""
+        urls_by_host = OrderedDict()
+        for url in urls:
+            urls_by_host.setdefault(urlsplit(url).netloc.lower(), []).append(url)
+        interleaved = itertools.zip_longest(*urls_by_host.values())
+        return [url for urls_of_round in interleaved for url in urls_of_round if url], len(urls_by_host)
+
+
+    def checkUrls(self, urls):
+        """Check all urls concurrently, every url only once. Returns dict url => (ok, response_code)"""
+        unique_urls = list(OrderedDict((linkstatus.normalize_url(url), url) for url in urls).values())
+        unique_urls, number_of_hosts = self.interleaveHosts(unique_urls)
+        logging.info(_("Prüfe %s URLs auf %s Servern..."), len(unique_urls), number_of_hosts)
+
+        with progress.start(_('URL-Prüfung'), len(unique_urls), _('URLs')) as self.progress:
+            with ThreadPoolExecutor(max_workers=config.x_linkcheck_workers, thread_name_prefix='linkcheck') as pool:
+                results = dict(zip(map(linkstatus.normalize_url, unique_urls), pool.map(self.getHttpStatus, unique_urls)))
+        self.progress = None
+
+        linkstatus.get_store().log_statistics()
+        return {url: results[linkstatus.normalize_url(url)] for url in urls}
+
+
+    def checkAllLinksInExcelFile(self, excel_filename):
+
+        logging.info(_("Excel Datei wird eingelesen: %s"), excel_filename)
+        links = self.findLinks(excel_filename)
+        results = self.checkUrls([link[3] for link in links])
 
-                    for m in url_match:
-                      check_url = m[0]
-                      (ok, response_code) = self.getHttpStatus(check_url)
+        for row_nr, row_name, column_name, check_url in links:
+            (ok, response_code) = results[check_url]
 
-                      logging.log(
-                        logging.INFO if ok else logging.ERROR,
-                        "[%s|%s] Zeile %s, %s-%s: %s", ok, response_code, row_nr, row_name, column_name, check_url
-                        )
+            logging.log(
+                logging.INFO if ok else logging.ERROR,
+                "[%s|%s] Zeile %s, %s-%s: %s", ok, response_code, row_nr, row_name, column_name, check_url
+                )
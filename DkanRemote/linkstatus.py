@@ -0,0 +1,170 @@
+"""Persistent store for the results of url checks
+
+The link checker and the resource check of the excel export share this store,
+so every url is only requested once per x_link_status_ttl, no matter how often
+it appears in the excel file or in DKAN.
+"""
+import os
+import sys
+import time
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit, urlunsplit
+from . import config
+from . import transport
+
+LinkStatus = namedtuple('LinkStatus', ['url', 'status_code', 'final_url', 'latency', 'checked_at', 'error'])
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def normalize_url(url):
+    """ Key of the url in the store: scheme and host in lower case, without default port and fragment.
+        An url that can not be parsed (e.g. "http://host:abc/") is its own key, the check records it as invalid. """
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+            host = '{}:{}'.format(host, parts.port)
+    except ValueError:
+        return url.strip()
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+class LinkStatusStore:
+    """ Thread safe store of url => LinkStatus """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS link_status (
+            url TEXT PRIMARY KEY,
+            status_code INTEGER NOT NULL,
+            final_url TEXT,
+            latency REAL NOT NULL,
+            checked_at REAL NOT NULL,
+            error TEXT,
+            expires_at REAL NOT NULL)''')
+        self._db.commit()
+
+
+    def lookup(self, url):
+        """ Return the last result for the url, None if it was not checked within its ttl """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT url, status_code, final_url, latency, checked_at, error FROM link_status WHERE url = ? AND expires_at > ?',
+                (normalize_url(url), time.time())).fetchone()
+            if row:
+                self.hits += 1
+                return LinkStatus(*row)
+            return None
+
+
+    def store(self, status):
+        # failed connections are often only temporary, so they are checked again sooner
+        ttl = config.x_link_status_error_ttl if status.error else config.x_link_status_ttl
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO link_status (url, status_code, final_url, latency, checked_at, error, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (status.url, status.status_code, status.final_url, status.latency, status.checked_at, status.error, status.checked_at + ttl))
+            self._db.commit()
+
+
+    def check(self, url, limit=None):
+        """ Return the LinkStatus of the url, request it only if there is no valid result in the store.
+
+            limit is an optional context manager around the request (e.g. a semaphore per host).
+            If another thread is checking the same url at the moment, its result is used.
+        """
+        status = self.lookup(url)
+        if status:
+            return status
+
+        key = normalize_url(url)
+        with self._lock:
+            pending = self._pending.get(key)
+            if not pending:
+                pending = self._pending[key] = threading.Event()
+                is_owner = True
+            else:
+                is_owner = False
+
+        if not is_owner:
+            pending.wait()
+            status = self.lookup(url)
+            if status:
+                return status
+
+        try:
+            with self._lock:
+                self.misses += 1
+            if limit:
+                with limit:
+                    status = self.probe(url)
+            else:
+                status = self.probe(url)
+            self.store(status)
+            return status
+        finally:
+            if is_owner:
+                with self._lock:
+                    del self._pending[key]
+                pending.set()
+
+
+    @staticmethod
+    def probe(url):
+        """ Request the url with HEAD, or with GET if the server does not accept the HEAD request """
+        start = time.time()
+        try:
+            resp = transport.head(url, allow_redirects=True)
+            # some servers do not support HEAD requests, ask them again with GET (without loading the content)
+            if resp.status_code >= 400:
+                resp = transport.get(url, allow_redirects=True, stream=True)
+                resp.close()
+        except:
+            e = sys.exc_info()
+            logging.debug("Error during resource load %s: %s", url, e[1])
+            return LinkStatus(normalize_url(url), 0, None, time.time() - start, start, str(e[0]) + " " + str(e[1]))
+
+        return LinkStatus(normalize_url(url), resp.status_code, resp.url, time.time() - start, start, None)
+
+
+    def purge_expired(self):
+        with self._lock:
+            cursor = self._db.execute('DELETE FROM link_status WHERE expires_at < ?', (time.time(),))
+            self._db.commit()
+            return cursor.rowcount
+
+
+    def log_statistics(self):
+        logging.info(_("URL-Prüfung: %s aus gespeicherten Ergebnissen, %s angefragt"), self.hits, self.misses)
+
+
+def get_http_status(url, limit=None):
+    """ Check the url and return (ok, response code or error message) """
+    status = get_store().check(url, limit)
+    if status.error:
+        return False, status.error
+    return (status.status_code < 400), str(status.status_code)
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if not _store:
+            if not os.path.exists(config.x_temp_dir):
+                os.makedirs(config.x_temp_dir)
+            _store = LinkStatusStore(os.path.normpath(config.x_temp_dir + config.x_link_status_file))
+        return _store
@@ -0,0 +1,95 @@
+"""Logging setup of the program
+
+All records of the root logger go through a queue, the console and the log file of the run
+are written by a background thread, so the worker threads do not wait for the disk.
+The level of single modules can be raised (see config.x_log_levels), so their debug messages
+are dropped before they are formatted and written.
+"""
+import queue
+import atexit
+import logging
+import logging.handlers
+from . import config
+
+_listener = None
+_level_filter = None
+
+
+class ModuleLevelFilter(logging.Filter):
+    """Drop records below the level that is set for their module or logger"""
+
+    def __init__(self, levels=None):
+        super().__init__()
+        self.set_levels(levels or {})
+
+
+    def set_levels(self, levels):
+        """levels: module or logger name => level (name like 'INFO' or number)"""
+        self.levels = {
+            name: level if isinstance(level, int) else logging.getLevelName(level.strip().upper())
+            for name, level in levels.items()}
+        self._thresholds = {}
+
+
+    def filter(self, record):
+        key = (record.name, record.module)
+        threshold = self._thresholds.get(key)
+        if threshold is None:
+            threshold = self._thresholds[key] = self.get_threshold(record.name, record.module)
+        return record.levelno >= threshold
+
+
+    def get_threshold(self, name, module):
+        # our modules log with the root logger, so they are found by module name,
+        # other loggers by their own name or the name of a parent logger
+        candidates = [module] if name == 'root' else []
+        parts = name.split('.')
+        candidates += ['.'.join(parts[:i]) for i in range(len(parts), 0, -1)]
+        for candidate in candidates:
+            level = self.levels.get(candidate)
+            if isinstance(level, int):
+                return level
+        return logging.NOTSET
+
+
+def setup(log_file):
+    """Log everything (at debug level) to the console and into log_file"""
+    global _listener, _level_filter
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('<%(asctime)s %(levelname)s> %(message)s'))
+
+    file_handler = logging.FileHandler(log_file, mode='a')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s\t%(message)s', datefmt='%I:%M:%S'))
+    file_handler.setLevel(logging.DEBUG)
+
+    _level_filter = ModuleLevelFilter(config.x_log_levels)
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(_level_filter)
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+    # write the remaining records when the program ends
+    atexit.register(stop)
+
+
+def stop():
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+def set_module_levels(levels):
+    if _level_filter:
+        _level_filter.set_levels(levels)
+
+
+def get_level_filter():
+    """The filter for the module levels, for other handlers of the root logger (e.g. the log window of the gui)"""
+    return _level_filter
@@ -1,10 +1,12 @@
 import os
 import sys
+import time
+import queue
 import traceback
 import subprocess
 import logging
 import threading
-import markdown
+from collections import deque
 from tkinter import scrolledtext, Tk, Frame, Label, Checkbutton, Button, Entry, StringVar, Text, IntVar, PhotoImage ,\
     HORIZONTAL, DISABLED, SUNKEN, RIDGE, INSERT, NORMAL, END, N, S, W, E, OptionMenu
 from tkinter import ttk
@@ -13,10 +15,15 @@ from datetime import datetime
 from . import config
 from . import excelreader
 from . import linkchecker
+from . import linkstatus
 from . import excelwriter
 from . import confighandler
 from . import dkanhandler
+from . import dkanhelpers
+from . import responsecache
 from . import dkan_api_test
+from . import logsetup
+from . import progress
 from .constants import AbortProgramError
 from pathlib import Path
 
@@ -72,6 +79,7 @@ def isWritable(directory):
         return False
 
 def compileDocs():
+    import markdown     # only needed for the help window
     with open(getLocalPath("docs/index.md"), "r", encoding="utf-8") as input_file:
         text = input_file.read()
         html = markdown.markdown(text)
@@ -88,13 +96,22 @@ def compileDocs():
 
 
 class LoggingTextHandler(logging.Handler):
-    """This class allows you to log to a Tkinter Text or ScrolledText widget"""
+    """This class allows you to log to a Tkinter Text or ScrolledText widget
 
-    def __init__(self, widget):
+    The records are only put on a queue, so the logging threads do not have to wait for the widget.
+    The Tk main loop writes them to the widget in batches, and keeps only the last max_lines lines.
+    """
+
+    def __init__(self, widget, max_lines=None):
         # run the regular Handler __init__
         logging.Handler.__init__(self)
         self.setLevel(logging.DEBUG)
 
+        self.records = queue.SimpleQueue()
+        self.max_lines = max_lines if max_lines else config.x_gui_log_max_lines
+        self.tk_thread = threading.current_thread()
+        self.last_drain = 0
+
         # Store a reference to the Text it will log to
         self.widget = widget
         self.widget.config(state='normal')
@@ -103,16 +120,56 @@ class LoggingTextHandler(logging.Handler):
         self.widget.tag_config("WARNING", foreground="orange")
         self.widget.tag_config("ERROR", foreground="red")
         self.widget.tag_config("CRITICAL", foreground="red", underline=1)
+        self.widget.after(config.x_gui_log_interval, self.poll)
 
     def emit(self, record):
-        msg = self.format(record)
+        # the message is formatted here, the arguments could be changed by the logging thread later
+        self.records.put((self.format(record), record.levelname))
+
+        # actions that run in the Tk thread block the main loop, so the records are written from here
+        if threading.current_thread() is self.tk_thread and time.monotonic() - self.last_drain > config.x_gui_log_interval / 1000:
+            self.drain()
+            self.widget.update()
+
+    def poll(self):
+        self.drain()
+        self.widget.after(config.x_gui_log_interval, self.poll)
+
+    def drain(self):
+        """Write all waiting records to the widget"""
+        self.last_drain = time.monotonic()
+        batch = deque(maxlen=self.max_lines)
+        count = 0
+        try:
+            while True:
+                batch.append(self.records.get_nowait())
+                count += 1
+        except queue.Empty:
+            pass
+        if not batch:
+            return
+
+        # records that would be removed from the widget right away are not written at all
+        if count > len(batch):
+            self.widget.insert(END, _("... {} Zeilen ausgelassen, siehe Log-Datei\n").format(count - len(batch)), "WARNING")
+
+        # one insert per run of records with the same level
+        lines = []
+        level = batch[0][1]
+        for msg, levelname in batch:
+            if levelname != level:
+                self.widget.insert(END, ''.join(lines), level)
+                lines = []
+                level = levelname
+            lines.append(msg + '\n')
+        self.widget.insert(END, ''.join(lines), level)
+
+        line_count = int(self.widget.index('end-1c').split('.')[0])
+        if line_count > self.max_lines:
+            self.widget.delete('1.0', '{}.0'.format(line_count - self.max_lines))
 
-        #self.widget.configure(state='normal')
-        self.widget.insert(END, msg + '\n', record.levelname)
-        #self.widget.configure(state='disabled')
         # Autoscroll to the bottom
         self.widget.yview(END)
-        self.widget.update()
 
 
 class MainGui(Frame):
@@ -295,6 +352,10 @@ class MainGui(Frame):
         self.resources_download = IntVar(value=(1 if config.resources_download else 0))
         Checkbutton(master, text = _("Ressourcen-Dateien herunterladen"),variable = self.resources_download).grid(row=currentRow, column=1, columnspan=2,  sticky=W)
 
+        currentRow +=1
+        self.incremental_export = IntVar(value=(1 if config.incremental_export else 0))
+        Checkbutton(master, text = _("Nur neue und geänderte Datensätze lesen"),variable = self.incremental_export).grid(row=currentRow, column=1, columnspan=2,  sticky=W)
+
         currentRow += 1
         self.download_button = Button(master, text="DKAN -> Excel", command=self.action_download)
         self.download_button.grid(row=currentRow, column=1, sticky=W+E, pady=(y_spacing, 0))
@@ -306,6 +367,19 @@ class MainGui(Frame):
         aktion_label = Label(master, text=_("Aktion: Schreibe Daten zum DKAN"), font=headline_font)
         aktion_label.grid(row=currentRow, column=1, columnspan=2, sticky=W, pady=(10, 0))
 
+        currentRow += 1
+        validate_workers = master.register(self.validate_workers)   # we have to wrap the command
+        self.workers_input = Entry(master, width=5, validate="key", validatecommand=(validate_workers, '%P'))
+        self.workers_input.delete(0, END)
+        self.workers_input.insert(0, str(config.upload_workers))
+        self.workers_input.grid(row=currentRow, column=1, sticky=W, pady=(y_spacing, 0))
+        self.workers_label = Label(master, text=_("Parallele Uploads:"))
+        self.workers_label.grid(row=currentRow, column=0, sticky=E, pady=(y_spacing, 0))
+
+        currentRow +=1
+        self.resume_upload = IntVar(value=(1 if config.resume_upload else 0))
+        Checkbutton(master, text = _("Abgebrochenen Upload fortsetzen"),variable = self.resume_upload).grid(row=currentRow, column=1, columnspan=2,  sticky=W)
+
         currentRow += 1
         self.upload_button = Button(master, text=_("Excel -> DKAN"), command=self.action_upload)
         self.upload_button.grid(row=currentRow, column=1, sticky=W+E, pady=(y_spacing, 0))
@@ -316,7 +390,8 @@ class MainGui(Frame):
         self.empty_space = Label(master, text="")
         self.empty_space.grid(row=currentRow, column=0, sticky=E, pady=(y_spacing, 0))
         master.rowconfigure( currentRow, weight=1 )
-        self.clear_temp_dir()
+        # start with current data, the DKAN may have been changed since the last run
+        self.cleanup_cache(clear=True)
 
 
     def init_logging_textarea(self, window):
@@ -339,8 +414,15 @@ class MainGui(Frame):
         self.progress.configure(mode='determinate',value=0)
         self.progress.grid(row=2, column=0, sticky=(N, S, E, W))
 
+        # actions that run in a thread can be stopped with the cancel button, see execute_thread
+        self.cancel_event = threading.Event()
+        self.cancel_button = Button(self.master_right, text=_("Abbrechen"), command=self.action_cancel, state=DISABLED)
+        self.cancel_button.grid(row=2, column=1, sticky=E, padx=(3, 0))
+
         # Create textLogger
         self.log_textwindow_handler = LoggingTextHandler(self.info_box)
+        if logsetup.get_level_filter():
+            self.log_textwindow_handler.addFilter(logsetup.get_level_filter())
 
         # Add the handler to logger
         logger = logging.getLogger()
@@ -357,8 +439,11 @@ class MainGui(Frame):
         config.skip_resources = self.skip_resources.get()
         config.detailed_resources = self.detailed_resources.get()
         config.resources_download = self.resources_download.get()
+        config.incremental_export = self.incremental_export.get()
         config.dataset_ids = self.query_input.get()
         config.message_level = self.message_level.get()
+        config.upload_workers = max(1, int(self.workers_input.get() or 1))
+        config.resume_upload = self.resume_upload.get()
 
         logging.debug("Log level: %s", config.message_level)
         self.log_textwindow_handler.setLevel(logging.INFO if config.message_level == 'Normal' else logging.DEBUG)
@@ -366,20 +451,17 @@ class MainGui(Frame):
         if has_changed:
             logging.debug(_("Konfiguration wurde geändert."))
             dkanhandler.disconnect()
-            self.clear_temp_dir()
+            self.cleanup_cache()
 
 
-    def clear_temp_dir(self):
-        tempdir = config.x_temp_dir
-        logging.debug(_("Cacheverzeichnis wird geleert: %s"), tempdir)
-        for filename in os.listdir(tempdir):
-            file_path = os.path.join(tempdir, filename)
-            try:
-                if (os.path.isfile(file_path) or os.path.islink(file_path)) and file_path.endswith('.json'):
-                    logging.debug(_("Lösche Datei '%s'"), file_path)
-                    os.unlink(file_path)
-            except Exception as e:
-                logging.warning('Löschen fehlgeschlagen: %s. Grund: %s', file_path, e)
+    def cleanup_cache(self, clear=False):
+        if clear:
+            responsecache.get_cache().clear()
+            logging.debug(_("Cache wurde geleert"))
+        removed = responsecache.get_cache().purge_expired() + linkstatus.get_store().purge_expired()
+        logging.debug(_("Abgelaufene Cache-Einträge entfernt: %s"), removed)
+        dkanhelpers.NodeIdIndex.reset()
+        dkanhelpers.ReferenceData.reset()
 
 
     def validate(self, new_text):
@@ -391,6 +473,10 @@ class MainGui(Frame):
         return True
 
 
+    def validate_workers(self, new_text):
+        return (new_text == '') or new_text.isdigit()
+
+
     def action_open(self):
         ''' Open external file "with a double click" '''
         filename = self.filename_input.get()
@@ -433,14 +519,32 @@ class MainGui(Frame):
         if not self.thrd.is_alive():
             self.cleanup_progressbar()
             return
+        # the worker thread only counts its progress, the widgets are updated here in the Tk thread
+        jobs = progress.active()
+        if jobs and not self.cancel_event.is_set():
+            self.show_progress(jobs[0].state())
+            self.progress_text.set(' | '.join(progress.format_state(job.state()) for job in jobs))
         self.wwindow.after(500, self.check_thread)
 
 
+    def show_progress(self, state):
+        """Determinate bar if the total of the job is known, otherwise the bar keeps moving"""
+        if state.total:
+            if str(self.progress['mode']) != 'determinate':
+                self.progress.stop()
+                self.progress.configure(mode='determinate')
+            self.progress.configure(value=min(100, 100 * state.done / state.total))
+        elif str(self.progress['mode']) != 'indeterminate':
+            self.progress.configure(mode='indeterminate')
+            self.progress.start()
+
+
     def cleanup_progressbar(self):
         self.message_with_time(_('Aktion fertig: {}').format(self.thrd_name))
         self.progress_text.set('')
         self.progress.stop()
         self.progress.configure(mode='determinate',value=0)
+        self.cancel_button.configure(state=DISABLED)
         self.set_all_widget_state("normal")
 
     def show_progressbar(self, thread_name):
@@ -458,8 +562,12 @@ class MainGui(Frame):
                 widget.configure(state=wstate)
 
 
-    def execute_thread(self, fn, thread_name):
+    def execute_thread(self, fn, thread_name, cancellable=False):
+        """Run fn in a worker thread. If cancellable, fn has to stop when self.cancel_event is set."""
         self.show_progressbar(thread_name)
+        self.cancel_event.clear()
+        if cancellable:
+            self.cancel_button.configure(state=NORMAL)
         self.thrd = threading.Thread(target=fn)
         self.thrd.daemon = True
         self.thrd.start()
@@ -491,23 +599,29 @@ class MainGui(Frame):
             _("Die Datensätze aus der Excel-Datei werden nun ins DKAN geschrieben.\n\nWirklich fortfahren?"))
         if result:
             self.update_config()
-            self.show_progressbar(_('DKAN schreiben'))
-            self.clear_temp_dir()
-
-            try:
-                excelreader.read(False)
-            except AbortProgramError as err:
-                logging.error(err.message)
-            except Exception as error:
-                logging.exception(error)
-            except:
-                err = sys.exc_info()
-                logging.error("Unbekannter Fehler: %s", err)
-                logging.error("Fehlermeldung: %s", str(err[0]) + " " + str(err[1]))
-                logging.error("%s", traceback.format_tb(err[2]))
-
-            self.clear_temp_dir()
-            self.cleanup_progressbar()
+            self.execute_thread(self.run_upload, _('DKAN schreiben'), cancellable=True)
+
+
+    def run_upload(self):
+        """Runs in the worker thread, see action_upload"""
+        try:
+            excelreader.read(False, self.cancel_event)
+        except AbortProgramError as err:
+            logging.error(err.message)
+        except Exception as error:
+            logging.exception(error)
+        except:
+            err = sys.exc_info()
+            logging.error("Unbekannter Fehler: %s", err)
+            logging.error("Fehlermeldung: %s", str(err[0]) + " " + str(err[1]))
+            logging.error("%s", traceback.format_tb(err[2]))
+
+
+    def action_cancel(self):
+        self.cancel_event.set()
+        self.cancel_button.configure(state=DISABLED)
+        self.progress_text.set(_('Wird abgebrochen: {} (die laufenden Datensätze werden noch fertig geschrieben)').format(self.thrd_name))
+        logging.warning(_("Abbruch angefordert, warte auf die laufenden Datensätze.."))
 
 
     def message_headline(self, message):
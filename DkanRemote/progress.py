@@ -0,0 +1,168 @@
+"""Progress of long running jobs (upload, download, link check, resource downloads)
+
+A job creates a Progress with start() and reports what it has done. The gui polls the active
+jobs for its progress bar, on the command line a status line is logged every few seconds.
+Throughput and remaining time are calculated from the last x_progress_window seconds.
+"""
+import time
+import logging
+import threading
+from collections import deque, namedtuple
+from . import config
+
+ProgressState = namedtuple('ProgressState', ['name', 'unit', 'total', 'done', 'failed', 'bytes', 'rate', 'byte_rate', 'elapsed', 'eta'])
+
+_active = []
+_listeners = []
+_lock = threading.Lock()
+
+
+class Progress:
+    """ Thread safe counters of one job """
+
+    def __init__(self, name, total=None, unit='', key=None):
+        self.name = name
+        self.key = key
+        self.unit = unit
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._samples = deque([(self.started, 0, 0)])
+        self._lock = threading.Lock()
+
+
+    def set_total(self, total):
+        with self._lock:
+            self.total = total
+        notify(self)
+
+
+    def add_total(self, count=1):
+        with self._lock:
+            self.total = (self.total or 0) + count
+        notify(self)
+
+
+    def advance(self, done=1, failed=0, nbytes=0):
+        """ done: finished items (including the failed ones), failed: items that failed, nbytes: transferred bytes """
+        now = time.monotonic()
+        with self._lock:
+            self.done += done
+            self.failed += failed
+            self.bytes += nbytes
+            # one sample per second is enough for the rolling throughput
+            if now - self._samples[-1][0] >= 1:
+                self._samples.append((now, self.done, self.bytes))
+                while now - self._samples[0][0] > config.x_progress_window and len(self._samples) > 2:
+                    self._samples.popleft()
+        notify(self)
+
+
+    def state(self):
+        now = time.monotonic()
+        with self._lock:
+            since, done_before, bytes_before = self._samples[0]
+            # at least one second, otherwise the first items give absurd rates
+            seconds = max(1, now - since)
+            rate = (self.done - done_before) / seconds
+            byte_rate = (self.bytes - bytes_before) / seconds
+            eta = None
+            if self.total and rate > 0:
+                eta = max(0, self.total - self.done) / rate
+            return ProgressState(self.name, self.unit, self.total, self.done, self.failed, self.bytes,
+                rate, byte_rate, now - self.started, eta)
+
+
+    def finish(self):
+        with _lock:
+            if self in _active:
+                _active.remove(self)
+        notify(self, finished=True)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+
+
+def start(name, total=None, unit='', key=None):
+    """ Create and register the progress of a job, call finish() when the job is done.
+        key can be used by other modules to find the job, see get() """
+    job = Progress(name, total, unit, key)
+    with _lock:
+        _active.append(job)
+    notify(job)
+    return job
+
+
+def active():
+    """ Progress of all running jobs, the oldest first """
+    with _lock:
+        return list(_active)
+
+
+def get(key):
+    """ The running job with the key, None if there is none """
+    with _lock:
+        for job in _active:
+            if job.key == key:
+                return job
+    return None
+
+
+def add_listener(listener):
+    """ listener(progress, finished) is called in the thread of the job after every change """
+    _listeners.append(listener)
+
+
+def notify(job, finished=False):
+    for listener in _listeners:
+        listener(job, finished)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def format_state(state):
+    """ Compact status line, e.g. 'Upload: 120/2000 Zeilen (6%), 1 Fehler, 2.1/s, 12.3 MB (1.2 MB/s), Restzeit 0:14:55' """
+    parts = []
+    if state.total:
+        parts.append('{}/{} {} ({:.0%})'.format(state.done, state.total, state.unit, state.done / state.total).replace('  ', ' '))
+    else:
+        parts.append('{} {}'.format(state.done, state.unit).strip())
+    if state.failed:
+        parts.append(_('{} Fehler').format(state.failed))
+    parts.append('{:.1f}/s'.format(state.rate))
+    if state.bytes:
+        parts.append('{:.1f} MB ({:.1f} MB/s)'.format(state.bytes / 1024 / 1024, state.byte_rate / 1024 / 1024))
+    if state.eta is not None:
+        parts.append(_('Restzeit {}').format(format_duration(state.eta)))
+    else:
+        parts.append(_('Laufzeit {}').format(format_duration(state.elapsed)))
+    return '{}: {}'.format(state.name, ', '.join(parts))
+
+
+class StatusLogger:
+    """ Listener for the command line: logs a status line of each job every x_progress_log_interval seconds and when it is finished """
+
+    def __init__(self):
+        self._last_log = {}
+        self._lock = threading.Lock()
+
+
+    def __call__(self, job, finished):
+        now = time.monotonic()
+        with self._lock:
+            if not finished and now - self._last_log.get(job, job.started) < config.x_progress_log_interval:
+                return
+            self._last_log[job] = now
+            if finished:
+                self._last_log.pop(job)
+        logging.info(format_state(job.state()))
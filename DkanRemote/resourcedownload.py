@@ -0,0 +1,222 @@
+"""Download of resource files into the download directory
+
+The files are downloaded by a pool of worker threads, while the excel rows are written.
+Every file is loaded with one streaming request. Interrupted downloads are kept as .part files
+and are continued with a Range request. The SHA-256 checksum of every finished file is stored
+in a manifest in the download directory, files listed there are not downloaded again.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from email.message import Message
+from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor, wait
+from . import config
+from . import transport
+from . import progress
+from .dkanhelpers import HttpHelper
+
+
+class ResourceDownloader:
+    """ Download resource files in the background, see submit() and finish() """
+
+    def __init__(self, download_dir, workers=None):
+        self.download_dir = os.path.normpath(download_dir)
+        if not os.path.exists(self.download_dir):
+            os.makedirs(self.download_dir)
+        self.manifest_file = os.path.join(self.download_dir, config.x_download_manifest)
+        self.manifest = self.read_manifest()
+        # filename of the finished download of (lfd_nr, url)
+        self._finished = {(entry.get('lfd_nr'), entry.get('url')): filename for filename, entry in self.manifest.items()}
+        self._lock = threading.Lock()
+        self._jobs = []
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers or config.x_download_workers))
+        self.downloaded = self.resumed = self.skipped = self.failed = 0
+        self.progress = progress.start(_('Downloads'), 0, _('Dateien'))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+
+
+    def submit(self, url, lfd_nr, r_format):
+        """ Download the file in the background, the future returns the filename (None on errors) """
+        self.progress.add_total(1)
+        job = self._pool.submit(self.download, url, lfd_nr, r_format)
+        self._jobs.append(job)
+        return job
+
+
+    def finish(self):
+        """ Wait for all downloads and save the manifest """
+        wait(self._jobs)
+        self._jobs = []
+        self._pool.shutdown()
+        self.save_manifest()
+        self.progress.finish()
+        logging.info(
+            _("Downloads: %s geladen (davon %s fortgesetzt), %s bereits vorhanden, %s fehlgeschlagen"),
+            self.downloaded, self.resumed, self.skipped, self.failed)
+
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_file, mode='r', encoding='utf-8') as json_data:
+                return json.load(json_data).get('files', {})
+        except FileNotFoundError:
+            return {}
+        except ValueError as err:
+            logging.warning(_("Datei %s kann nicht gelesen werden: %s"), self.manifest_file, err)
+            return {}
+
+
+    def save_manifest(self):
+        with self._lock:
+            content = {'files': dict(self.manifest)}
+        # write to a temporary file first, so an interrupted run can not destroy the manifest
+        temp_file = self.manifest_file + '.tmp'
+        with open(temp_file, mode='w', encoding='utf-8') as fw:
+            json.dump(content, fw, indent=1, sort_keys=True)
+        os.replace(temp_file, self.manifest_file)
+
+
+    def get_finished_download(self, url, lfd_nr):
+        """ Return the filename, if the file was completely downloaded before and is unchanged on disk """
+        with self._lock:
+            filename = self._finished.get((lfd_nr, url))
+            entry = self.manifest.get(filename)
+        if not entry:
+            return None
+        try:
+            if os.path.getsize(os.path.join(self.download_dir, filename)) == entry['size']:
+                return filename
+        except OSError:
+            pass
+        return None
+
+
+    def get_part_filename(self, url, lfd_nr):
+        # the final filename is only known from the response headers, so the part file is named after the url
+        return os.path.join(self.download_dir, '.{}-{}.part'.format(lfd_nr, hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]))
+
+
+    def download(self, url, lfd_nr, r_format):
+        filename = self.get_finished_download(url, lfd_nr)
+        if filename:
+            logging.debug(_("Bereits heruntergeladen: %s"), filename)
+            with self._lock:
+                self.skipped += 1
+            self.progress.advance()
+            return filename
+
+        ti = timer()
+        part_file = self.get_part_filename(url, lfd_nr)
+        offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+
+        try:
+            logging.debug("URL: %s", url)
+            remotefile = transport.get(url, stream=True, headers=headers)
+            if offset and remotefile.status_code == 416:
+                # the part file is already complete (or bigger than the file on the server), start again
+                remotefile.close()
+                offset = 0
+                remotefile = transport.get(url, stream=True)
+            if not remotefile.ok:
+                # the body is not read, close the response so its connection goes back to the pool
+                remotefile.close()
+                remotefile.raise_for_status()
+        except Exception as err:
+            logging.warning('Fehler: %s', repr(err))
+            logging.error('Resource-URL kann nicht geöffnet werden: %s', url)
+            with self._lock:
+                self.failed += 1
+            self.progress.advance(failed=1)
+            return None
+
+        with remotefile:
+            resumed = offset and self.is_continuation(remotefile, offset)
+            checksum = hashlib.sha256()
+            if resumed:
+                logging.debug(_("Setze Download bei Byte %s fort: %s"), offset, url)
+                with open(part_file, mode='rb') as existing:
+                    for chunk in iter(lambda: existing.read(config.x_download_chunk_size), b''):
+                        checksum.update(chunk)
+
+            filename = lfd_nr + '-' + self.get_filename(remotefile, url, r_format)
+            logging.debug("Download Ziel: %s", filename)
+            try:
+                size = offset if resumed else 0
+                with open(part_file, mode='ab' if resumed else 'wb') as target:
+                    for chunk in remotefile.iter_content(chunk_size=config.x_download_chunk_size):
+                        target.write(chunk)
+                        checksum.update(chunk)
+                        size += len(chunk)
+                        self.progress.advance(0, nbytes=len(chunk))
+                os.replace(part_file, os.path.join(self.download_dir, filename))
+            except Exception as err:
+                # the part file is kept, the next run continues from there
+                logging.warning('Fehler: %s', repr(err))
+                logging.error(_('Download abgebrochen: %s'), url)
+                with self._lock:
+                    self.failed += 1
+                self.progress.advance(failed=1)
+                return None
+
+        with self._lock:
+            self.manifest[filename] = {
+                'url': url,
+                'lfd_nr': lfd_nr,
+                'size': size,
+                'sha256': checksum.hexdigest(),
+                'etag': remotefile.headers.get('ETag'),
+                'last_modified': remotefile.headers.get('Last-Modified'),
+                'downloaded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            self._finished[(lfd_nr, url)] = filename
+            self.downloaded += 1
+            if resumed:
+                self.resumed += 1
+        self.progress.advance()
+
+        logging.info(_(' * Download in {:.4f}s: {} "{}"').format(timer() - ti, filename, url))
+        return filename
+
+
+    @staticmethod
+    def is_continuation(remotefile, offset):
+        """ True if the server sent the rest of the file from offset. Servers without Range support send the whole file. """
+        if remotefile.status_code != 206:
+            return False
+        content_range = remotefile.headers.get('Content-Range', '')     # bytes 1000-1999/2000
+        return content_range.startswith('bytes {}-'.format(offset))
+
+
+    @staticmethod
+    def get_filename(remotefile, url, r_format):
+        filename = ''
+        cd_header = remotefile.headers.get('Content-Disposition')
+        if cd_header:
+            message = Message()
+            message['Content-Disposition'] = cd_header
+            filename = os.path.basename(message.get_filename() or '')
+            logging.debug("Dateiname aus Header: %s", filename)
+        if not filename:
+            filename = HttpHelper.get_resource_filename(url)
+            if filename:
+                logging.debug("Dateiname aus URL: %s", filename)
+
+        if filename and (filename.find(".") == -1):
+            filename = filename + '.' + r_format
+
+        if not filename:
+            filename = 'unknown.{}'.format(r_format)
+            logging.warning("Dateiname in URL und Header Leer. Download-Datei wird '%s' genannt.", filename)
+        return filename
@@ -0,0 +1,148 @@
+"""Persistent cache for DKAN API responses
+
+All responses are stored in one SQLite file. Every entry has its own expiry time,
+expired entries with ETag or Last-Modified are revalidated with a conditional request.
+If the cache grows too big, the least recently used entries are removed.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+from . import config
+
+CacheEntry = namedtuple('CacheEntry', ['body', 'etag', 'last_modified', 'expires_at'])
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class ResponseCache:
+    """ Thread safe key-value store for http response bodies """
+
+    def __init__(self, filename, max_bytes):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            body TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            size INTEGER NOT NULL)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self._db.commit()
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+
+    def lookup(self, key):
+        """ Return the entry, also if it is expired but can be revalidated. None if there is no usable entry. """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body, etag, last_modified, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            entry = CacheEntry(*row) if row else None
+            if entry and not (self.is_fresh(entry) or entry.etag or entry.last_modified):
+                entry = None
+            if entry and self.is_fresh(entry):
+                self.hits += 1
+                self._db.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+                self._db.commit()
+            else:
+                self.misses += 1
+            return entry
+
+
+    @staticmethod
+    def is_fresh(entry):
+        return entry.expires_at > time.time()
+
+
+    def store(self, key, body, etag, last_modified, ttl):
+        size = len(body.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._size -= self._entry_size(key)
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, body, etag, last_modified, expires_at, last_access, size) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, body, etag, last_modified, now + ttl, now, size))
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+
+    def refresh(self, key, ttl):
+        """ The server confirmed that the cached response is still valid """
+        now = time.time()
+        with self._lock:
+            self.revalidated += 1
+            self._db.execute('UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?', (now + ttl, now, key))
+            self._db.commit()
+
+
+    def delete(self, key):
+        with self._lock:
+            self._size -= self._entry_size(key)
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._db.commit()
+
+
+    def purge_expired(self):
+        """ Remove expired entries that can not be revalidated """
+        with self._lock:
+            cursor = self._db.execute(
+                'DELETE FROM responses WHERE expires_at < ? AND etag IS NULL AND last_modified IS NULL', (time.time(),))
+            self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            self._db.commit()
+            return cursor.rowcount
+
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+            self._db.commit()
+            self._size = 0
+
+
+    def log_statistics(self):
+        logging.info(
+            _("Cache: %s Treffer, %s erneuert, %s nicht gefunden (%.1f MB)"),
+            self.hits, self.revalidated, self.misses, self._size / 1024 / 1024)
+
+
+    def _entry_size(self, key):
+        row = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+
+    def _evict(self):
+        """ Remove least recently used entries until the cache uses less than 90% of max_bytes """
+        target = self.max_bytes * 0.9
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall()
+        removed = 0
+        for key, size in rows:
+            if self._size <= target:
+                break
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._size -= size
+            removed += 1
+        logging.debug(_("Cache zu groß, %s Einträge entfernt"), removed)
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if not _cache:
+            if not os.path.exists(config.x_temp_dir):
+                os.makedirs(config.x_temp_dir)
+            _cache = ResponseCache(os.path.normpath(config.x_temp_dir + config.x_cache_file), config.x_cache_max_bytes)
+        return _cache
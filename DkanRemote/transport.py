@@ -0,0 +1,70 @@
+"""Shared HTTP transport for all plain (not pydkan) requests
+
+All requests go through one requests.Session, so keep-alive connections are reused.
+The session keeps a connection pool per host, and failed requests are retried with backoff.
+"""
+import threading
+import urllib3
+from urllib3.util.retry import Retry
+from urllib3.exceptions import InsecureRequestWarning
+import requests
+from requests.adapters import HTTPAdapter
+from . import config
+
+# retry these server responses, they are often only temporary problems of busy servers
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session():
+    retry = Retry(
+        total=config.x_http_retries,
+        backoff_factor=config.x_http_backoff,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=['HEAD', 'GET'],
+        raise_on_status=False)
+    adapter = HTTPAdapter(
+        pool_connections=config.x_http_pool_hosts,
+        pool_maxsize=config.x_http_pool_size,
+        max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    # Many portals and resource servers have broken SSL certificates, so we never verify them
+    session.verify = False
+    urllib3.disable_warnings(InsecureRequestWarning)
+    return session
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if not _session:
+            _session = create_session()
+        return _session
+
+
+def reset():
+    """Close all pooled connections, the next request creates a new session with the current config"""
+    global _session
+    with _session_lock:
+        if _session:
+            _session.close()
+        _session = None
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault('timeout', (config.x_http_connect_timeout, config.x_http_read_timeout))
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def head(url, **kwargs):
+    return request('HEAD', url, **kwargs)
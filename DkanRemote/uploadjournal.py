@@ -0,0 +1,154 @@
+"""Write-ahead journal of the upload from excel to DKAN
+
+Every dataset and resource operation is written to the journal before it is sent, and again
+when DKAN confirmed it (with the node id it returned). The journal is kept next to the excel file.
+If an upload is interrupted, it can be continued with resume: datasets that were finished are
+skipped, datasets that were only partly uploaded are reconciled with their state in DKAN.
+Only the dataset entries are read on resume. The resources of a reconciled dataset are compared
+with the dataset node read fresh from DKAN (like in every update), their entries are a record only.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from . import config
+
+# states of a journal entry, in the order they are written
+PLANNED = 'planned'         # the operation will be sent
+SENT = 'sent'               # the request was sent, but DKAN did not answer yet
+CONFIRMED = 'confirmed'     # DKAN confirmed the operation, nid is the node id it returned
+FAILED = 'failed'           # the operation raised an error
+DONE = 'done'               # dataset and all of its resources are uploaded
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_sent_time(entry):
+    """ Unix time when the operation of a SENT or FAILED entry was sent, None if it is unknown """
+    if 'sent_at' in entry:
+        return entry['sent_at']
+    # journals of older versions only have the time of the entry
+    if entry.get('state') != SENT:
+        return None
+    try:
+        return time.mktime(time.strptime(entry['time'], '%Y-%m-%dT%H:%M:%S'))
+    except (KeyError, ValueError):
+        return None
+
+
+class UploadJournal:
+    """ Thread safe journal file, one json object per line """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.previous = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(filename):
+            if resume:
+                self.previous = self.read()
+                logging.info(_("Setze Upload fort: %s Datensätze laut Journal bereits fertig (%s)"),
+                    sum(1 for entry in self.previous.values() if entry['op'] == 'dataset' and entry['state'] == DONE), filename)
+            elif self.has_unfinished_datasets():
+                logging.warning(_("Der letzte Upload wurde nicht abgeschlossen. Er wird nicht fortgesetzt, sondern neu begonnen."))
+
+        self._file = open(filename, mode='a' if resume else 'w', encoding='utf-8')
+        self.write({'op': 'run', 'state': 'started', 'dkan_url': config.dkan_url})
+
+
+    def read(self):
+        """ Return the last entry of every key from the journal file """
+        entries = {}
+        with open(self.filename, mode='r', encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line can be incomplete, if the program was killed while writing it
+                    continue
+                if entry['op'] == 'run':
+                    if entry.get('dkan_url') != config.dkan_url:
+                        logging.warning(_("%s gehört zu einer anderen DKAN-Instanz und wird ignoriert."), self.filename)
+                        return {}
+                    continue
+                entries[entry['key']] = entry
+        return entries
+
+
+    def has_unfinished_datasets(self):
+        return any(entry['op'] == 'dataset' and entry['state'] != DONE for entry in self.read().values())
+
+
+    def write(self, entry):
+        entry['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        line = json.dumps(entry, default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            # the entry has to be on disk before the request is sent
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+    def record(self, op, key, state, nid=None, **details):
+        self.write(dict(details, op=op, key=key, state=state, nid=nid))
+
+
+    def get_previous(self, key):
+        """ Last entry of the key from the interrupted upload, None if it was not started """
+        return self.previous.get(key)
+
+
+    def run_operation(self, op, key, function, *args):
+        """ Call function(*args) and record it as sent and confirmed. The return value is used as nid, if it is one. """
+        sent_at = time.time()
+        self.record(op, key, SENT, sent_at=sent_at)
+        try:
+            result = function(*args)
+        except Exception as err:
+            self.record(op, key, FAILED, error=repr(err), sent_at=sent_at)
+            raise
+        self.record(op, key, CONFIRMED, nid=result)
+        return result
+
+
+    def close(self, state):
+        self.write({'op': 'run', 'state': state, 'dkan_url': config.dkan_url})
+        with self._lock:
+            self._file.close()
+
+
+    @staticmethod
+    def get_dataset_key(dataset, resources):
+        """ The key identifies a dataset row and its resource rows by their content,
+            if the rows are changed in the excel file, they are uploaded again """
+        rows = [dataset.getRow()] + [resource.getRow() for resource in resources]
+        return 'dataset:' + hashlib.sha1(json.dumps(rows, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+    @staticmethod
+    def get_filename(excel_filename):
+        return os.path.splitext(excel_filename)[0] + '.journal.jsonl'
+
+
+def open_journal(excel_filename, resume=False):
+    global _journal
+    with _journal_lock:
+        _journal = UploadJournal(UploadJournal.get_filename(excel_filename), resume)
+        return _journal
+
+
+def close_journal(state):
+    """ state of the upload run: 'finished' or 'aborted' """
+    global _journal
+    with _journal_lock:
+        if _journal:
+            _journal.close(state)
+        _journal = None
+
+
+def get_journal():
+    """ The journal of the running upload, None if there is none """
+    return _journal
@@ -0,0 +1,56 @@
+"""Micro-benchmark: cost of reading the fields of a dataset row
+
+Compares the old way (building the column config dicts for every field access)
+with the compiled column schema (constants.get_column_schema).
+
+Usage: python benchmarks/column_schema.py [number of rows]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DkanRemote import constants   # pylint: disable=wrong-import-position
+
+
+def build_row():
+    row = {}
+    for column_name, column_key in constants.get_column_config_dataset().items():
+        # taxonomy columns would need a DKAN connection
+        row[column_name] = '' if str(column_key)[:7] == 'TID_REF' else 'Wert ' + column_name
+    return row
+
+
+def read_fields_with_config_dicts(dataset, field_names):
+    """ How Dataset.getValue found the column config before the schema was compiled """
+    for field_name in field_names:
+        column_key = constants.get_column_config_dataset()[field_name]
+        if str(column_key)[:7] != "TID_REF":
+            dataset.getRawValue(field_name)
+
+
+def read_fields_with_schema(dataset, field_names):
+    for field_name in field_names:
+        column = constants.get_column_schema().dataset[field_name]
+        if column.kind != constants.ColumnKind.TID_REF:
+            dataset.getRawValue(field_name)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    dataset = constants.Dataset(build_row())
+    field_names = list(constants.get_column_config_dataset())
+
+    print("{} rows with {} fields each".format(rows, len(field_names)))
+    results = {}
+    for name, function in [('config dicts', read_fields_with_config_dicts), ('compiled schema', read_fields_with_schema)]:
+        seconds = min(timeit.repeat(lambda: function(dataset, field_names), number=rows, repeat=5))
+        results[name] = seconds
+        print("{:>16}: {:8.2f} ms total, {:6.2f} µs per row".format(name, seconds * 1000, seconds / rows * 1000000))
+
+    print("{:>16}: {:.1f}x".format('speedup', results['config dicts'] / results['compiled schema']))
+
+
+if __name__ == '__main__':
+    main()
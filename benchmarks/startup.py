@@ -0,0 +1,115 @@
+"""Startup benchmark: import time of the command line modes
+
+Every mode is started in a fresh interpreter with `python -X importtime`, the import time of
+the modules of the mode is summed up (the interpreter startup itself is not counted).
+The benchmark fails (exit code 1)
+ - if a mode imports a module it does not need (e.g. tkinter for an upload), or
+ - if a mode is slower than in the saved baseline (plus the tolerance), or
+ - if there is no baseline for a mode.
+
+Usage: python benchmarks/startup.py [--runs N] [--tolerance 0.25] [--save]
+  --save  stores the measured times as baseline (benchmarks/startup_baseline.json),
+          run it once on the machine that runs the benchmark
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(ROOT, 'benchmarks', 'startup_baseline.json')
+
+GUI_MODULES = ['tkinter', 'markdown']
+EXPORT_MODULES = ['xlsxwriter', 'jsonschema']
+
+# mode => (modules imported by the mode, modules the mode must not import)
+MODES = {
+    'cli': (['DkanRemote'], GUI_MODULES + EXPORT_MODULES + ['xlrd', 'geomet', 'jsondiff', 'dkan.client', 'requests']),
+    'upload': (['DkanRemote', 'DkanRemote.excelreader'], GUI_MODULES + EXPORT_MODULES + ['xlrd', 'geomet', 'jsondiff']),
+    'validate-node': (['DkanRemote', 'DkanRemote.dkan_api_test'], GUI_MODULES + EXPORT_MODULES + ['xlrd']),
+    'download': (['DkanRemote', 'DkanRemote.excelwriter'], GUI_MODULES + ['xlrd']),
+}
+
+
+def measure(modules):
+    """ Import the modules in a new interpreter, return (milliseconds, names of all imported modules) """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    code = '; '.join('import ' + module for module in modules)
+    # the program writes a log file when it is imported, so it is started in an empty directory
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+            cwd=work_dir, env=env, stderr=subprocess.PIPE, universal_newlines=True, check=False)
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+
+    microseconds = 0
+    imported = set()
+    after_site = False
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        imported.add(name.strip())
+        # modules at the top level were imported by the code, not by another module
+        if after_site and not name[1:].startswith(' '):
+            microseconds += int(cumulative)
+        if name.strip() == 'site':
+            after_site = True
+    return microseconds / 1000, imported
+
+
+def forbidden_imports(imported, forbidden):
+    return [module for module in forbidden if any(name == module or name.startswith(module + '.') for name in imported)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time of the command line modes')
+    parser.add_argument('--runs', type=int, default=5, help='number of measurements per mode, the fastest counts')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown compared to the baseline')
+    parser.add_argument('--save', action='store_true', help='save the measured times as baseline')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    failed = False
+    results = {}
+    for mode, (modules, forbidden) in MODES.items():
+        measurements = [measure(modules) for _run in range(args.runs)]
+        milliseconds = min(ms for ms, _imported in measurements)
+        results[mode] = round(milliseconds, 1)
+
+        status = ''
+        if mode in baseline:
+            limit = baseline[mode] * (1 + args.tolerance)
+            status = 'baseline {:.1f} ms'.format(baseline[mode])
+            if milliseconds > limit and not args.save:
+                status += ', SLOWER THAN {:.1f} ms'.format(limit)
+                failed = True
+        elif not args.save:
+            # without a baseline a slowdown can not be detected
+            status = 'NO BASELINE'
+            failed = True
+        print("{:>14}: {:8.1f} ms  {}".format(mode, milliseconds, status))
+
+        unneeded = forbidden_imports(measurements[0][1], forbidden)
+        if unneeded:
+            print("{:>14}  imports modules it does not need: {}".format('', ', '.join(unneeded)))
+            failed = True
+
+    if args.save:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent=1, sort_keys=True)
+        print("Baseline saved: " + BASELINE_FILE)
+    elif not all(mode in baseline for mode in MODES):
+        print("Baseline missing: " + BASELINE_FILE + ", save one with --save (make bench-startup-baseline)")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+import pytest
+import DkanRemote     # installs _() for the log messages, see DkanRemote/__init__.py
+from DkanRemote import config
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    """ config.x_temp_dir in the tmp path of the test, for a DKAN instance of its own """
+    monkeypatch.setattr(config, 'x_temp_dir', str(tmp_path) + '/')
+    monkeypatch.setattr(config, 'dkan_url', 'https://dkan.example.org')
+    return tmp_path
@@ -0,0 +1,89 @@
+import pytest
+from DkanRemote import config
+from DkanRemote import constants
+from DkanRemote.constants import ColumnKind, Resource, compile_column
+
+
+NODE = {
+    'nid': '12',
+    'body': {'und': [{'format': 'plain_text'}]},
+    'field_tags': {'und': [{'tid': '3'}, {'tid': '4'}]},
+    'field_related_content': {'und': [{'title': 'Doku', 'url': 'https://example.org'}]},
+    'field_empty': [],
+}
+
+PACKAGE = {
+    'title': 'Bäume',
+    'groups': [{'title': 'Umwelt'}],
+    'extras': [{'key': 'Quelle', 'value': 'Stadt'}],
+}
+
+
+def test_path_column():
+    column = compile_column('Text-Format', ['body', 'und', 0, 'format'])
+    assert column.kind == ColumnKind.PATH
+    assert column.accessor(NODE) == 'plain_text'
+    assert column.accessor({}) is None
+
+
+def test_taxonomy_column():
+    column = compile_column('Tags', 'TID_REF|field_tags|tags')
+    assert (column.kind, column.field, column.taxonomy) == (ColumnKind.TID_REF, 'field_tags', 'tags')
+    assert column.accessor(NODE) == [{'tid': '3'}, {'tid': '4'}]
+    assert compile_column('Leer', 'TID_REF|field_empty|tags').accessor(NODE) == []
+    assert column.accessor(None) == []
+
+
+def test_related_collect_and_extra_columns():
+    related = compile_column('Related', 'RELATED|field_related_content')
+    assert related.kind == ColumnKind.RELATED
+    assert related.accessor(NODE)[0]['url'] == 'https://example.org'
+
+    groups = compile_column('Gruppen', 'COLLECT|groups.title')
+    assert groups.kind == ColumnKind.COLLECT
+    assert groups.accessor(PACKAGE) == [{'title': 'Umwelt'}]
+    assert groups.accessor({}) == []
+
+    extra = compile_column('Extra-Quelle', 'EXTRA|Quelle')
+    assert (extra.kind, extra.field) == (ColumnKind.EXTRA, 'Quelle')
+    assert extra.accessor(PACKAGE) == 'Stadt'
+    assert compile_column('Extra-X', 'EXTRA|X').accessor(PACKAGE) is None
+
+
+def test_plain_and_special_columns():
+    title = compile_column('Titel', 'title')
+    assert title.kind == ColumnKind.PLAIN
+    assert title.accessor(PACKAGE) == 'Bäume'
+    assert title.accessor({}) is None
+
+    special = compile_column('Resource-Typ', 'RTYPE')
+    assert special.kind == ColumnKind.SPECIAL
+    assert special.accessor is None
+
+
+def test_column_schema_is_read_only():
+    schema = constants.ColumnSchema(False)
+    assert list(schema.dataset) == list(constants.get_column_config_dataset())
+    with pytest.raises(TypeError):
+        schema.dataset['Neu'] = None
+
+
+def test_column_schema_with_detailed_resources():
+    simple = constants.ColumnSchema(False)
+    detailed = constants.ColumnSchema(True)
+
+    assert Resource.TYP in simple.resource
+    assert Resource.TYP not in detailed.resource
+    # the column can still be read from excel files
+    assert Resource.TYP in detailed.resource_known
+    assert set(detailed.resource_detailed) <= set(detailed.resource_known)
+
+
+def test_column_schema_is_compiled_once_per_setting(monkeypatch):
+    monkeypatch.setattr(config, 'detailed_resources', False)
+    schema = constants.get_column_schema()
+    assert constants.get_column_schema() is schema
+
+    monkeypatch.setattr(config, 'detailed_resources', True)
+    assert constants.get_column_schema() is not schema
+    assert constants.get_column_schema().detailed_resources
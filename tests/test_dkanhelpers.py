@@ -0,0 +1,118 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from DkanRemote import config
+from DkanRemote.dkanhelpers import OrderedLogBuffer, NodeIdIndex
+
+
+def log_after(delay, message):
+    time.sleep(delay)
+    logging.info(message)
+    return message
+
+
+def test_log_buffer_replays_in_submit_order(caplog):
+    caplog.set_level(logging.INFO)
+    with OrderedLogBuffer() as log_buffer, ThreadPoolExecutor(max_workers=3) as pool:
+        # the first job finishes last
+        jobs = [log_buffer.submit(pool, log_after, delay, message) for delay, message in [(0.2, 'a'), (0.1, 'b'), (0, 'c')]]
+        results = log_buffer.wait_in_order(jobs)
+
+    assert results == ['a', 'b', 'c']
+    assert [record.getMessage() for record in caplog.records] == ['a', 'b', 'c']
+
+
+def test_log_buffer_writes_records_of_the_calling_thread(caplog):
+    caplog.set_level(logging.INFO)
+    with OrderedLogBuffer() as log_buffer, ThreadPoolExecutor(max_workers=1) as pool:
+        started = threading.Event()
+        job = log_buffer.submit(pool, lambda: started.wait() and logging.info('job'))
+        logging.info('main')
+        started.set()
+        log_buffer.wait_in_order([job])
+
+    assert [record.getMessage() for record in caplog.records] == ['main', 'job']
+
+
+def test_log_buffer_raises_first_error_and_cancels_pending_jobs(caplog):
+    caplog.set_level(logging.INFO)
+
+    def fail():
+        logging.info('failed')
+        raise ValueError('broken')
+
+    with OrderedLogBuffer() as log_buffer, ThreadPoolExecutor(max_workers=1) as pool:
+        blocker = threading.Event()
+        jobs = [
+            log_buffer.submit(pool, log_after, 0, 'a'),
+            log_buffer.submit(pool, fail),
+            log_buffer.submit(pool, blocker.wait),
+            log_buffer.submit(pool, log_after, 0, 'never'),
+        ]
+        with pytest.raises(ValueError):
+            log_buffer.wait_in_order(jobs)
+        blocker.set()
+
+    assert jobs[3][1].cancelled()
+    assert [record.getMessage() for record in caplog.records] == ['a', 'failed']
+
+
+class FakeNodeList:
+    """ Replaces NodeIdIndex.read_all_pages, counts how often the node list is read from DKAN """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.reads = 0
+
+    def read_all_pages(self, node_type, index):
+        self.reads += 1
+        index.update(self.nodes)
+
+
+@pytest.fixture
+def node_list(temp_dir, monkeypatch):
+    node_list = FakeNodeList({'uuid-1': '1'})
+    monkeypatch.setattr(config, 'x_node_index_types', ['dataset'])
+    monkeypatch.setattr(NodeIdIndex, 'read_all_pages', staticmethod(node_list.read_all_pages))
+    NodeIdIndex.reset()
+    yield node_list
+    NodeIdIndex.reset()
+
+
+def test_node_index_is_read_once_and_saved(node_list):
+    assert NodeIdIndex.get_node_id('uuid-1') == '1'
+    assert NodeIdIndex.get_node_id('uuid-1') == '1'
+    assert node_list.reads == 1
+    assert os.path.isfile(NodeIdIndex.get_index_filename())
+
+    # the next run uses the file
+    NodeIdIndex.reset()
+    assert NodeIdIndex.get_node_id('uuid-1') == '1'
+    assert node_list.reads == 1
+
+
+def test_node_index_from_file_is_read_again_for_unknown_uuid(node_list):
+    NodeIdIndex.get_node_id('uuid-1')
+    NodeIdIndex.reset()
+    node_list.nodes['uuid-2'] = '2'
+
+    assert NodeIdIndex.get_node_id('uuid-2') == '2'
+    assert node_list.reads == 2
+    # the index that was read from DKAN is complete, unknown uuids do not read it again
+    assert NodeIdIndex.get_node_id('uuid-3') is None
+    assert node_list.reads == 2
+
+
+def test_node_index_file_expires(node_list):
+    NodeIdIndex.get_node_id('uuid-1')
+    NodeIdIndex.reset()
+    index_file = NodeIdIndex.get_index_filename()
+    expired = time.time() - config.x_node_index_ttl - 1
+    os.utime(index_file, (expired, expired))
+
+    assert NodeIdIndex.get_node_id('uuid-1') == '1'
+    assert node_list.reads == 2
+    assert os.path.getmtime(index_file) > expired
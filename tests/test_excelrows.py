@@ -0,0 +1,119 @@
+import zipfile
+import pytest
+import xlsxwriter
+from DkanRemote.excelrows import ExcelRowReader
+
+HEADER = ['Titel', 'Anzahl', 'Leer', 'Notiz']
+ROWS = [
+    ['Bäume', 12, '', 'a'],
+    ['Straßen', 3.5, '', ''],
+    [],
+    ['Seen', 0, 'x', 'langer Text mit Umlauten: äöü'],
+]
+
+# what xlrd returns for the rows: numbers as float, empty cells as ''
+EXPECTED = [
+    (1, {'Titel': 'Bäume', 'Anzahl': 12.0, 'Leer': '', 'Notiz': 'a'}),
+    (2, {'Titel': 'Straßen', 'Anzahl': 3.5, 'Leer': '', 'Notiz': ''}),
+    (3, {'Titel': '', 'Anzahl': '', 'Leer': '', 'Notiz': ''}),
+    (4, {'Titel': 'Seen', 'Anzahl': 0.0, 'Leer': 'x', 'Notiz': 'langer Text mit Umlauten: äöü'}),
+]
+
+
+def write_xlsx(filename, header, rows):
+    workbook = xlsxwriter.Workbook(filename)
+    worksheet = workbook.add_worksheet()
+    for row_nr, values in enumerate([header] + rows):
+        for column_nr, value in enumerate(values):
+            if value != '':
+                worksheet.write(row_nr, column_nr, value)
+    workbook.close()
+
+
+def write_sheet_xml(filename, sheet_data):
+    """ Minimal xlsx file with the sheet data xml, for cell types that xlsxwriter does not write """
+    main = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+    relations = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    with zipfile.ZipFile(filename, 'w') as archive:
+        archive.writestr('xl/workbook.xml',
+            '<workbook xmlns="{}" xmlns:r="{}"><sheets><sheet name="A" sheetId="1" r:id="rId1"/></sheets></workbook>'.format(
+                main, relations))
+        archive.writestr('xl/_rels/workbook.xml.rels',
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>')
+        archive.writestr('xl/worksheets/sheet1.xml',
+            '<worksheet xmlns="{}"><sheetData>{}</sheetData></worksheet>'.format(main, sheet_data))
+
+
+def test_xlsx_rows(tmp_path):
+    filename = str(tmp_path / 'datasets.xlsx')
+    write_xlsx(filename, HEADER, ROWS)
+
+    with ExcelRowReader(filename) as reader:
+        assert reader.columns == HEADER
+        assert reader.nrows == 5
+        assert list(reader.rows()) == EXPECTED
+
+
+def test_xls_and_xlsx_rows_are_the_same(tmp_path):
+    xlwt = pytest.importorskip('xlwt')
+    xls_filename = str(tmp_path / 'datasets.xls')
+    workbook = xlwt.Workbook()
+    worksheet = workbook.add_sheet('A')
+    for row_nr, values in enumerate([HEADER] + ROWS):
+        for column_nr, value in enumerate(values):
+            worksheet.write(row_nr, column_nr, value)
+    workbook.save(xls_filename)
+    xlsx_filename = str(tmp_path / 'datasets.xlsx')
+    write_xlsx(xlsx_filename, HEADER, ROWS)
+
+    with ExcelRowReader(xls_filename) as xls_reader, ExcelRowReader(xlsx_filename) as xlsx_reader:
+        assert xls_reader.columns == xlsx_reader.columns
+        assert list(xls_reader.rows()) == list(xlsx_reader.rows()) == EXPECTED
+
+
+def test_xlsx_cell_types(tmp_path):
+    filename = str(tmp_path / 'types.xlsx')
+    write_sheet_xml(filename,
+        '<row r="1"><c r="A1" t="inlineStr"><is><t>Datum</t></is></c><c r="B1" t="inlineStr"><is><t>Wahr</t></is></c>'
+        '<c r="C1" t="inlineStr"><is><t>Formel</t></is></c><c r="E1" t="inlineStr"><is><t>Fehler</t></is></c></row>'
+        '<row r="3"><c r="A3" t="d"><v>2024-05-01T00:00:00</v></c><c r="B3" t="b"><v>1</v></c>'
+        '<c r="C3" t="str"><v>Text</v></c><c r="E3" t="e"><v>#DIV/0!</v></c></row>')
+
+    with ExcelRowReader(filename) as reader:
+        # the empty column D has no header
+        assert reader.columns == ['Datum', 'Wahr', 'Formel', '', 'Fehler']
+        rows = list(reader.rows())
+
+    assert rows[0] == (1, {'Datum': '', 'Wahr': '', 'Formel': '', '': '', 'Fehler': ''})
+    assert rows[1] == (2, {'Datum': '2024-05-01T00:00:00', 'Wahr': True, 'Formel': 'Text', '': '', 'Fehler': '#DIV/0!'})
+
+
+def test_duplicate_headers_are_reported(tmp_path, caplog):
+    filename = str(tmp_path / 'duplicates.xlsx')
+    write_xlsx(filename, ['Titel', 'Notiz', 'Notiz'], [['Bäume', 'erste', 'zweite']])
+
+    with ExcelRowReader(filename) as reader:
+        assert 'Notiz' in caplog.text
+        assert list(reader.rows()) == [(1, {'Titel': 'Bäume', 'Notiz': 'zweite'})]
+
+
+def test_reader_can_be_closed_before_the_end(tmp_path):
+    filename = str(tmp_path / 'datasets.xlsx')
+    write_xlsx(filename, HEADER, ROWS)
+
+    reader = ExcelRowReader(filename)
+    rows = reader.rows()
+    assert next(rows)[0] == 1
+    reader.close()
+    assert list(rows) == []
+
+
+def test_workbook_without_sheet(tmp_path):
+    filename = str(tmp_path / 'empty.xlsx')
+    with zipfile.ZipFile(filename, 'w') as archive:
+        archive.writestr('xl/workbook.xml',
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheets/></workbook>')
+
+    with pytest.raises(ValueError):
+        ExcelRowReader(filename)
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+import pytest
+from DkanRemote import config
+from DkanRemote import fileupload
+from DkanRemote.fileupload import UploadManifest
+
+
+@pytest.fixture
+def download_dir(temp_dir, monkeypatch):
+    monkeypatch.setattr(config, 'download_dir', str(temp_dir))
+    monkeypatch.setattr(fileupload, '_manifest', None)
+    return temp_dir
+
+
+@pytest.fixture
+def uploads(download_dir, monkeypatch):
+    """ handleFileUpload without DKAN: returns the list of uploaded (filename, node id) """
+    dkanhandler = pytest.importorskip('DkanRemote.dkanhandler')
+    uploaded = []
+
+    def attach_file_to_node(api, filename, node_id, field='field_upload', progress=None):
+        uploaded.append((filename, node_id))
+        return SimpleNamespace(status_code=200, text='')
+
+    monkeypatch.setattr(dkanhandler, 'connect', lambda: None)
+    monkeypatch.setattr(dkanhandler, 'getApi', lambda: None)
+    monkeypatch.setattr(dkanhandler.dkanhelpers.HttpHelper, 'invalidate_dkan_node', staticmethod(lambda node_id: None))
+    monkeypatch.setattr(fileupload, 'attach_file_to_node', attach_file_to_node)
+    return dkanhandler, uploaded
+
+
+def uploaded_node(size):
+    return {'field_upload': {'und': [{'filesize': str(size)}]}}
+
+
+def test_unchanged_file_is_not_uploaded_again(uploads, download_dir):
+    dkanhandler, uploaded = uploads
+    path = download_dir / 'data.csv'
+    path.write_text('a;b\n1;2\n')
+    data = {'x_upload_file': str(path)}
+
+    dkanhandler.handleFileUpload(data, '7')
+    dkanhandler.handleFileUpload(data, '7', uploaded_node(path.stat().st_size))
+    assert uploaded == [(str(path), '7')]
+
+    # other content, or a file that was replaced in DKAN
+    path.write_text('a;b\n1;3\n4;5\n')
+    dkanhandler.handleFileUpload(data, '7', uploaded_node(path.stat().st_size))
+    dkanhandler.handleFileUpload(data, '7', uploaded_node(1))
+    assert len(uploaded) == 3
+
+
+def test_manifest_is_kept_in_the_download_dir(download_dir):
+    path = download_dir / 'data.csv'
+    path.write_text('a;b\n')
+
+    manifest = fileupload.get_upload_manifest()
+    assert fileupload.get_upload_manifest() is manifest
+    assert not manifest.is_uploaded('7', str(path))
+    manifest.record('7', str(path))
+
+    manifest = UploadManifest(manifest.filename)
+    assert manifest.is_uploaded('7', str(path))
+    assert not manifest.is_uploaded('8', str(path))
+
+
+def test_manifest_of_another_dkan_instance_is_ignored(download_dir, monkeypatch):
+    path = download_dir / 'data.csv'
+    path.write_text('a;b\n')
+    manifest = fileupload.get_upload_manifest()
+    manifest.record('7', str(path))
+
+    monkeypatch.setattr(config, 'dkan_url', 'https://other.example.org')
+    assert not UploadManifest(manifest.filename).is_uploaded('7', str(path))
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+import pytest
+from DkanRemote import responsecache
+from DkanRemote.responsecache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ Time of the cache, moved forward by the test """
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(responsecache, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return ResponseCache(str(tmp_path / 'responses.sqlite'), max_bytes=1000)
+
+
+def test_fresh_entry_is_a_hit(cache):
+    cache.store('a', 'body', None, None, ttl=60)
+
+    entry = cache.lookup('a')
+    assert entry.body == 'body'
+    assert cache.is_fresh(entry)
+    assert cache.lookup('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_expired_entry_without_validator_is_not_used(cache, clock):
+    cache.store('a', 'body', None, None, ttl=60)
+    clock.now += 61
+
+    assert cache.lookup('a') is None
+    assert cache.purge_expired() == 1
+
+
+def test_expired_entry_with_etag_can_be_revalidated(cache, clock):
+    cache.store('a', 'body', '"v1"', None, ttl=60)
+    clock.now += 61
+
+    entry = cache.lookup('a')
+    assert entry.etag == '"v1"'
+    assert not cache.is_fresh(entry)
+    assert cache.purge_expired() == 0
+
+    cache.refresh('a', ttl=60)
+    assert cache.is_fresh(cache.lookup('a'))
+    assert cache.revalidated == 1
+
+
+def test_least_recently_used_entries_are_evicted(cache, clock):
+    for key in 'abc':
+        cache.store(key, 'x' * 300, None, None, ttl=60)
+        clock.now += 1
+    # "a" is used again, so "b" is now the least recently used entry
+    cache.lookup('a')
+    clock.now += 1
+
+    cache.store('d', 'x' * 300, None, None, ttl=60)
+
+    assert cache.lookup('b') is None
+    assert all(cache.lookup(key) for key in 'acd')
+
+
+def test_size_is_kept_when_an_entry_is_replaced(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'), max_bytes=1000)
+    for _i in range(10):
+        cache.store('a', 'x' * 300, None, None, ttl=60)
+    cache.store('b', 'x' * 300, None, None, ttl=60)
+    assert cache.lookup('a') and cache.lookup('b')
+
+    cache.delete('a')
+    cache.clear()
+    assert cache.lookup('b') is None
+    # the size is read from the file when it is opened again
+    assert ResponseCache(cache.filename, max_bytes=1000)._size == 0
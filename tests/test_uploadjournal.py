@@ -0,0 +1,88 @@
+import json
+import pytest
+from DkanRemote import config
+from DkanRemote import uploadjournal
+from DkanRemote.uploadjournal import PLANNED, SENT, CONFIRMED, FAILED, DONE
+
+
+@pytest.fixture
+def excel_file(temp_dir):
+    yield str(temp_dir / 'datasets.xlsx')
+    uploadjournal.close_journal('finished')
+
+
+def read_entries(journal):
+    with open(journal.filename, encoding='utf-8') as journal_file:
+        return [json.loads(line) for line in journal_file]
+
+
+def test_operation_is_recorded_as_sent_and_confirmed(excel_file):
+    journal = uploadjournal.open_journal(excel_file)
+    journal.record('dataset', 'key', PLANNED)
+
+    assert journal.run_operation('dataset', 'key', lambda value: value, '42') == '42'
+
+    entries = [entry for entry in read_entries(journal) if entry['op'] == 'dataset']
+    assert [entry['state'] for entry in entries] == [PLANNED, SENT, CONFIRMED]
+    assert entries[-1]['nid'] == '42'
+
+
+def test_failed_operation_is_recorded_with_the_time_it_was_sent(excel_file):
+    journal = uploadjournal.open_journal(excel_file)
+
+    def fail():
+        raise RuntimeError('timeout')
+
+    with pytest.raises(RuntimeError):
+        journal.run_operation('dataset', 'key', fail)
+
+    sent, failed = [entry for entry in read_entries(journal) if entry['op'] == 'dataset']
+    assert (sent['state'], failed['state']) == (SENT, FAILED)
+    assert 'timeout' in failed['error']
+    assert uploadjournal.get_sent_time(failed) == sent['sent_at']
+
+
+def test_resume_reads_the_last_state_of_every_key(excel_file):
+    journal = uploadjournal.open_journal(excel_file)
+    journal.record('dataset', 'finished', PLANNED)
+    journal.record('dataset', 'finished', DONE, nid='1')
+    journal.record('dataset', 'interrupted', PLANNED)
+    journal.record('dataset', 'interrupted', SENT)
+    uploadjournal.close_journal('aborted')
+    # the program was killed while it wrote the last line
+    with open(journal.filename, mode='a', encoding='utf-8') as journal_file:
+        journal_file.write('{"op": "dataset", "key": "interr')
+
+    resumed = uploadjournal.open_journal(excel_file, resume=True)
+
+    assert resumed.get_previous('finished')['state'] == DONE
+    assert resumed.get_previous('finished')['nid'] == '1'
+    assert resumed.get_previous('interrupted')['state'] == SENT
+    assert resumed.get_previous('unknown') is None
+
+
+def test_new_upload_starts_a_new_journal(excel_file, caplog):
+    journal = uploadjournal.open_journal(excel_file)
+    journal.record('dataset', 'key', SENT)
+    uploadjournal.close_journal('aborted')
+
+    restarted = uploadjournal.open_journal(excel_file)
+    assert 'nicht abgeschlossen' in caplog.text
+    assert restarted.previous == {}
+    assert [entry['op'] for entry in read_entries(restarted)] == ['run']
+
+
+def test_journal_of_another_dkan_instance_is_ignored(excel_file, monkeypatch):
+    journal = uploadjournal.open_journal(excel_file)
+    journal.record('dataset', 'key', DONE, nid='1')
+    uploadjournal.close_journal('finished')
+
+    monkeypatch.setattr(config, 'dkan_url', 'https://other.example.org')
+    assert uploadjournal.open_journal(excel_file, resume=True).previous == {}
+
+
+def test_sent_time_of_old_journal_entries():
+    assert uploadjournal.get_sent_time({'state': SENT, 'time': '2026-01-02T03:04:05'}) is not None
+    # a failed entry of an old journal only has the time of the failure
+    assert uploadjournal.get_sent_time({'state': FAILED, 'time': '2026-01-02T03:04:05'}) is None
+    assert uploadjournal.get_sent_time({'state': SENT}) is None